@@ -0,0 +1,175 @@
+"""Generate Ninja and Make build files for converting figures.
+
+Each SVG (or DOT) file becomes one build statement, whose outputs are
+those of the export method (`.pdf`, and `.pdf_tex` for `latex-pdf`,
+see `svglatex.formats`),
+and whose implicit dependencies are the files that the source links
+to (for example raster images). So the build system decides which
+figures are stale, and converts them in parallel.
+
+In Ninja files the rules have `restat = 1`, and the command keeps the
+modification time of outputs whose contents did not change, so
+figures that convert to the same outputs do not trigger rebuilds
+downstream.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import os
+import re
+
+import lxml.etree as etree
+
+from svglatex import cache
+from svglatex import dot
+from svglatex import formats
+
+
+_HEADER = '# Generated by `svglatex gen-build`, do not edit.\n'
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_RX_DOT_FILE_ATTR = re.compile(
+    r'\b(?:image|shapefile|fontpath)\s*=\s*"([^"]+)"')
+_RX_URL_SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+
+def implicit_dependencies(source):
+    """Return sorted local files that `source` links to.
+
+    For SVG files, these are the targets of `href` attributes that
+    are not fragments or URLs. For DOT files, these are the files
+    named by the attributes `image`, `shapefile`, and `fontpath`.
+    Relative paths are resolved relative to `source`.
+    Files that do not exist are omitted.
+
+    @type source: `str`
+    @rtype: `list` of `str`
+    """
+    if source.endswith(dot.DOT_EXT):
+        with open(source, 'r', encoding='utf-8') as f:
+            refs = _RX_DOT_FILE_ATTR.findall(f.read())
+    else:
+        refs = _svg_references(source)
+    dirname = os.path.dirname(source)
+    deps = set()
+    for ref in refs:
+        ref = ref.split('#', 1)[0]
+        if not ref or _RX_URL_SCHEME.match(ref):
+            continue
+        path = os.path.normpath(os.path.join(dirname, ref))
+        if os.path.isfile(path):
+            deps.add(path)
+    return sorted(deps)
+
+
+def _svg_references(svg):
+    """Yield values of `href` attributes in SVG file `svg`."""
+    for _, el in etree.iterparse(svg, events=('start',)):
+        for key in (_XLINK_HREF, 'href'):
+            ref = el.attrib.get(key)
+            if ref is not None and not ref.startswith('#'):
+                yield ref
+
+
+def write_ninja(sources, method, fname, svglatex='svglatex'):
+    """Write Ninja build file `fname` for converting `sources`.
+
+    Paths are written relative to the directory of `fname`,
+    where `ninja` is expected to run.
+
+    @type sources: iterable of `str`
+    @type method: `str`
+    @param svglatex: command that invokes `svglatex`
+    """
+    root = os.path.dirname(os.path.abspath(fname))
+    rule = 'svglatex_{m}'.format(m=re.sub(r'\W', '_', method))
+    lines = [
+        _HEADER,
+        'ninja_required_version = 1.3\n',
+        'svglatex = {s}\n'.format(s=svglatex),
+        '\n',
+        'rule {rule}\n'.format(rule=rule),
+        ('  command = $svglatex build --force --restat '
+         '-j 1 -m {m} $in\n').format(m=method),
+        '  description = SVGLATEX $in\n',
+        '  restat = 1\n',
+        '\n']
+    all_outs = list()
+    for source in sources:
+        outs = [
+            _relpath(p, root) for p in formats.outputs(source, method)]
+        deps = [
+            _relpath(p, root) for p in implicit_dependencies(source)]
+        line = 'build {outs}: {rule} {src}'.format(
+            outs=' '.join(_ninja_escape(p) for p in outs),
+            rule=rule,
+            src=_ninja_escape(_relpath(source, root)))
+        if deps:
+            line += ' | ' + ' '.join(_ninja_escape(p) for p in deps)
+        lines.append(line + '\n')
+        all_outs.extend(outs)
+    lines.append('\nbuild figures: phony {outs}\n'.format(
+        outs=' '.join(_ninja_escape(p) for p in all_outs)))
+    lines.append('default figures\n')
+    _write(fname, lines)
+
+
+def write_makefile(sources, method, fname, svglatex='svglatex'):
+    """Write Makefile `fname` for converting `sources`.
+
+    The target `figures` converts all `sources`. Paths are written
+    relative to the directory of `fname`, where `make` is expected
+    to run. Make has no equivalent of the `restat` of Ninja,
+    so outputs are always updated when converting.
+
+    @type sources: iterable of `str`
+    @type method: `str`
+    @param svglatex: command that invokes `svglatex`
+    """
+    root = os.path.dirname(os.path.abspath(fname))
+    sources = list(sources)
+    command = (
+        '$(SVGLATEX) build --force -j 1 -m {m} {src}')
+    lines = [
+        _HEADER,
+        'SVGLATEX ?= {s}\n'.format(s=svglatex),
+        '\n',
+        '.PHONY: figures\n']
+    all_outs = list()
+    rules = list()
+    for source in sources:
+        src = _make_escape(_relpath(source, root))
+        outs = [
+            _make_escape(_relpath(p, root))
+            for p in formats.outputs(source, method)]
+        deps = [
+            _make_escape(_relpath(p, root))
+            for p in implicit_dependencies(source)]
+        all_outs.extend(outs)
+        cmd = command.format(m=method, src=src)
+        rules.append('\n{out}: {deps}\n\t{cmd}\n'.format(
+            out=outs[0], deps=' '.join([src] + deps), cmd=cmd))
+        # further outputs are made by the same command
+        for out in outs[1:]:
+            rules.append('{out}: {first}\n\t@test -f $@ || {cmd}\n'.format(
+                out=out, first=outs[0], cmd=cmd))
+    lines.append('figures: {outs}\n'.format(outs=' '.join(all_outs)))
+    lines.extend(rules)
+    _write(fname, lines)
+
+
+def _relpath(path, root):
+    """Return `path` relative to `root`, with `/` as separator."""
+    return os.path.relpath(os.path.abspath(path), root).replace(
+        os.sep, '/')
+
+
+def _ninja_escape(path):
+    return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def _make_escape(path):
+    return path.replace('$', '$$').replace(' ', '\\ ')
+
+
+def _write(fname, lines):
+    cache.atomic_write(fname, ''.join(lines))
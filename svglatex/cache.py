@@ -0,0 +1,136 @@
+"""Location of, and helpers for, the on-disk cache of svglatex."""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import contextlib
+import hashlib
+import os
+import stat
+import tempfile
+
+
+CACHE_DIR_ENV = 'SVGLATEX_CACHE_DIR'
+
+
+def _read_umask():
+    """Return the file mode creation mask of this process."""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# read once, because reading the mask sets it, which races with threads
+_UMASK = _read_umask()
+
+
+def cache_dir(*parts):
+    """Return path to (sub)directory of the cache, creating it if needed.
+
+    The cache is located at `$SVGLATEX_CACHE_DIR` if that
+    environment variable is set, else under `$XDG_CACHE_HOME/svglatex`
+    (default `~/.cache/svglatex`).
+
+    @param parts: path components under the cache root
+    @rtype: `str`
+    """
+    root = os.environ.get(CACHE_DIR_ENV)
+    if not root:
+        xdg = os.environ.get('XDG_CACHE_HOME')
+        if not xdg:
+            xdg = os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(xdg, 'svglatex')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_digest(path):
+    """Return SHA-256 hex digest of the contents of file `path`.
+
+    @type path: `str`
+    @rtype: `str`
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bytes_digest(data):
+    """Return SHA-256 hex digest of `data`.
+
+    @type data: `bytes`
+    @rtype: `str`
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def atomic_write(path, data):
+    """Write `data` to file `path`, replacing it atomically.
+
+    The data are first written to a temporary file in the
+    same directory, which is then renamed to `path`.
+    So readers never see a partially written file.
+    The file keeps the mode of the file it replaces
+    (see `_copy_mode`).
+
+    @type path: `str`
+    @type data: `bytes` or `str`
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    fd, tmp = tempfile.mkstemp(
+        dir=dirname, prefix='.svglatex-', suffix='.tmp')
+    try:
+        if mode == 'wb':
+            f = os.fdopen(fd, mode)
+        else:
+            f = os.fdopen(fd, mode, encoding='utf-8')
+        with f:
+            f.write(data)
+        _copy_mode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _copy_mode(path, tmp):
+    """Give file `tmp` the mode of file `path`, for replacing it.
+
+    If `path` does not exist, then give `tmp` the mode of new files
+    (`0o666` without the bits of the umask), instead of the mode
+    `0o600` of files made by `tempfile.mkstemp`.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(tmp, mode)
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """Context manager that yields a temporary path for writing `path`.
+
+    The temporary file is in the same directory as `path`, and
+    has the same extension. On exiting without an exception,
+    the temporary file replaces `path` (keeping the mode of `path`,
+    see `_copy_mode`), otherwise it is removed.
+
+    @type path: `str`
+    """
+    dirname, name = os.path.split(os.path.abspath(path))
+    _, ext = os.path.splitext(name)
+    fd, tmp = tempfile.mkstemp(
+        dir=dirname, prefix='.' + name + '.', suffix=ext)
+    os.close(fd)
+    try:
+        yield tmp
+        _copy_mode(path, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,199 @@
+"""Check SVG files for features that the converter does not support.
+
+The checks are in pure Python, and call the same parsing functions as
+the converter, so an SVG file that passes them does not fail in the
+converter because of these features. Checking is much faster than
+running `inkscape`, so batch conversions check all inputs first, and
+do not start any conversion for files with problems.
+
+For DOT files, the SVG made by Graphviz (see `dot.to_svg`) is
+checked, because that SVG is what the converter reads.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import concurrent.futures
+import os
+
+import lxml.etree as etree
+
+from svglatex import converter
+from svglatex import dot
+
+
+# `line` is `None` for problems of the whole file
+Problem = collections.namedtuple('Problem', ['path', 'line', 'message'])
+_SVG = '{http://www.w3.org/2000/svg}'
+
+
+def check_files(paths, jobs=None):
+    """Return problems found in `paths`, checked in parallel.
+
+    @param paths: SVG (or DOT) files
+    @type paths: iterable of `str`
+    @param jobs: number of worker processes,
+        if `None`, then the number of processors
+    @return: maps each path with problems to a
+        `list` of `Problem`
+    @rtype: `dict`
+    """
+    paths = list(paths)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(paths)))
+    if jobs == 1:
+        results = map(check_file, paths)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        with executor:
+            results = list(executor.map(check_file, paths))
+    return {
+        path: problems
+        for path, problems in zip(paths, results)
+        if problems}
+
+
+def check_file(path):
+    """Return all problems found in SVG file `path`.
+
+    If `path` is a DOT file, then the SVG made from it is
+    checked, and problems have the path of that SVG file.
+
+    @type path: `str`
+    @rtype: `list` of `Problem`
+    """
+    if path.endswith(dot.DOT_EXT):
+        try:
+            path = dot.to_svg(path)
+        except Exception as e:
+            return [Problem(path, None, str(e))]
+    problems = list()
+
+    def report(line, message):
+        problems.append(Problem(path, line, message))
+
+    try:
+        doc = etree.parse(path)
+    except (OSError, etree.XMLSyntaxError) as e:
+        report(getattr(e, 'lineno', None), str(e))
+        return problems
+    _check_root(doc.getroot(), report)
+    _check_defs(doc, report)
+    for text in doc.iter(_SVG + 'text'):
+        _check_text(text, report)
+    # tspans that inherit a style repeat its problems
+    return list(collections.OrderedDict.fromkeys(problems))
+
+
+def _check_root(root, report):
+    """Check dimensions of the root `svg` element."""
+    for attr in ('width', 'height'):
+        value = root.attrib.get(attr)
+        if value is None:
+            report(root.sourceline, 'root has no `{a}`'.format(a=attr))
+            continue
+        try:
+            converter._mm_to_svg_units(value)
+        except NotImplementedError as e:
+            report(root.sourceline, 'unsupported {a} "{v}": {e}'.format(
+                a=attr, v=value, e=e))
+        except ValueError:
+            report(root.sourceline, 'cannot parse {a} "{v}"'.format(
+                a=attr, v=value))
+    if 'width' not in root.attrib:
+        return
+    try:
+        converter._scaling_assumed(root.getroottree())
+    except NotImplementedError:
+        pass  # reported above
+    except (ValueError, IndexError, ZeroDivisionError):
+        report(root.sourceline, 'cannot parse viewBox "{v}"'.format(
+            v=root.attrib.get('viewBox')))
+
+
+def _check_defs(doc, report):
+    """Check that all paths have an `id`, if there are `defs`."""
+    if next(doc.iter(_SVG + 'defs'), None) is None:
+        return
+    for path in doc.iter(_SVG + 'path'):
+        if 'id' not in path.attrib:
+            report(path.sourceline, '`path` has no `id`')
+
+
+def _check_text(text, report):
+    """Check position, transformations, and style of `text`."""
+    tspans = text.findall(_SVG + 'tspan')
+    if not tspans:
+        tspans = [text]
+    style = converter._text_style(text)
+    el = text
+    while el is not None:
+        _check_transform(el, report)
+        el = el.getparent()
+    for tspan in tspans:
+        if tspan is not text:
+            _check_transform(tspan, report)
+        for attr in ('x', 'y'):
+            if attr not in tspan.attrib:
+                report(tspan.sourceline, '`{tag}` has no `{a}`'.format(
+                    tag=etree.QName(tspan).localname, a=attr))
+                continue
+            try:
+                float(tspan.attrib[attr])
+            except ValueError:
+                report(tspan.sourceline, (
+                    'cannot parse `{a}` "{v}" (only one '
+                    'coordinate is supported)').format(
+                        a=attr, v=tspan.attrib[attr]))
+        span_style = converter._update_tspan_style(style, tspan)
+        _check_style(tspan, span_style, report)
+
+
+def _check_transform(el, report):
+    """Check that the `transform` of `el` can be parsed."""
+    attribute = el.attrib.get('transform')
+    if attribute is None:
+        return
+    try:
+        converter._parse_svg_transform(attribute)
+    # the parser raises `AssertionError`, `ValueError`, and `Exception`
+    except Exception:
+        report(el.sourceline, 'unsupported transform "{t}"'.format(
+            t=attribute))
+
+
+def _check_style(el, style, report):
+    """Check the text style `style` of `el`."""
+    fill = style.get('fill')
+    if fill is not None:
+        try:
+            converter._parse_svg_color(fill)
+        except Exception:
+            report(el.sourceline, (
+                'unsupported fill color "{c}" '
+                '(only `#rrggbb` is supported)').format(c=fill))
+    weight = style.get('font-weight')
+    if weight is not None and weight not in ('bold', 'normal'):
+        try:
+            int(weight)
+        except ValueError:
+            report(el.sourceline, 'unsupported font-weight "{w}"'.format(
+                w=weight))
+
+
+def format_problems(problems):
+    """Return `str` that lists `problems`, one per line.
+
+    @param problems: as returned by `check_files`
+    @rtype: `str`
+    """
+    lines = list()
+    for path in sorted(problems):
+        for p in problems[path]:
+            if p.line is None:
+                lines.append('{f}: {m}'.format(f=p.path, m=p.message))
+            else:
+                lines.append('{f}:{n}: {m}'.format(
+                    f=p.path, n=p.line, m=p.message))
+    return '\n'.join(lines)
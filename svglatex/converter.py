@@ -39,20 +39,36 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import argparse
+import base64
 import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import logging
 import math
 import os
 import pprint
 import re
 import subprocess
 import sys
-import shutil
 import tempfile
+import threading
 
 # import cairosvg
 import lxml.etree as etree
 
+from svglatex import cache
+from svglatex import fonts
+from svglatex import formats
+from svglatex import inkscape
+from svglatex import lock
+from svglatex import pdf
+from svglatex import simplify
+from svglatex import svgpdf
 
+
+log = logging.getLogger(__name__)
 _FONT_MAP = {
     'CMU Serif': 'rm',
     'CMU Sans Serif': 'sf',
@@ -63,7 +79,8 @@ _FONT_SIZE_MAP = {
     '10px': r'\footnotesize',
     '11px': r'\small',
     '12px': r'\normalsize',
-    '13px': r'\large'}
+    '13px': r'\large',
+    '14px': r'\Large'}
 # 72 big-points (PostScript points) (72 bp) per inch
 PT_PER_INCH = 72.0  # pt / in
 # 96 SVG "User Units" (96 px) per inch
@@ -111,6 +128,24 @@ _INKSVG_NAMESPACES = {
 _RX_TRANSFORM = re.compile('^\s*(\w+)\(([0-9,\s\.-]*)\)\s*')
 # bounding box
 _BBox = collections.namedtuple('BBox', ['x', 'y', 'width', 'height'])
+# `id` given to the root `svg` element if it has none
+_ROOT_ID = 'svglatex_root'
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_RX_URL_REF = re.compile(r'url\(\s*#([^)\s]+)\s*\)')
+# presentation attributes of text, overridden by the attribute `style`
+_TEXT_ATTRIBUTES = (
+    'fill', 'font-family', 'font-size', 'font-style', 'font-weight',
+    'letter-spacing', 'text-anchor', 'word-spacing')
+_RX_FONT_SIZE = re.compile(r'^(\d+\.?\d*|\.\d+)(px)?$')
+# elements that are not rendered where they appear
+_NOT_RENDERED = {
+    'defs', 'clipPath', 'mask', 'pattern',
+    'symbol', 'marker', 'filter', 'metadata'}
+_COVER_ID = 'svglatex_cover_{i}'
+# difference (px) between the size of the exported PDF page and
+# the bounding box of the graphics queried in the original SVG,
+# above which this bounding box is not used
+_COVER_TOLERANCE = 1.0
 
 
 def _parse_args():
@@ -121,7 +156,7 @@ def _parse_args():
     return args
 
 
-def convert(svg_fname):
+def convert(svg_fname, basename=None):
     """Convert SVG `svg_fname` to a PDF and a LaTeX file.
 
     The PDF file includes graphics from the SVG `svg_fname`.
@@ -129,22 +164,448 @@ def convert(svg_fname):
     The LaTeX file has extension `.pdf_tex`.
 
     @type svg_fname: `str`
+    @param basename: path of output files without extension,
+        if `None`, then `svg_fname` without extension
+    @type basename: `str`
+    """
+    convert_targets(
+        svg_fname, [formats.Target('latex-pdf', None)], basename)
+
+
+def convert_targets(
+        svg_fname, targets, basename=None, processes=None,
+        raster_dpi=None, compact=False, estimate_text=False,
+        native_pdf=False, simplify_tolerance=None):
+    """Convert SVG `svg_fname` to each of `targets`.
+
+    The SVG is parsed once. For `latex-pdf`, the text is split from
+    the graphics, as in `convert`. The other targets are exported
+    from `svg_fname`, in the same `inkscape` process that queries
+    the bounding boxes of text that `latex-pdf` needs, where the
+    installed `inkscape` can do so (see `inkscape.strategy`).
+
+    The `inkscape` processes for the graphics and for the original
+    SVG do not depend on each other, so they run concurrently,
+    at most `processes` at a time, see `_run_steps`.
+
+    The size of the graphics is read from the page of the exported
+    PDF, and their position from the bounding boxes of the elements
+    without text, which are queried in the original SVG together
+    with the text (see `_text_free_cover`). Only if these do not
+    match is the SVG of the graphics queried, by another process.
+
+    @type svg_fname: `str`
+    @param targets: `list` of `formats.Target`
+    @param basename: path of output files without extension,
+        if `None`, then `svg_fname` without extension
+    @type basename: `str`
+    @param processes: number of `inkscape` processes,
+        if `None`, then as many as there are independent steps
+    @type processes: `int`
+    @param raster_dpi: if not `None`, then replace elements that
+        have filters by images at this resolution,
+        see `_rasterize_filters`
+    @type raster_dpi: `float`
+    @param compact: if `True`, then define a macro for each style
+        of text in the `.pdf_tex`, see `_TeXPicture.dumps`
+    @type compact: `bool`
+    @param estimate_text: if `True`, then estimate the bounding boxes
+        of text from font metrics, instead of querying `inkscape`,
+        where possible (see `_estimate_text_bboxes`)
+    @type estimate_text: `bool`
+    @param native_pdf: if `True`, then write the PDF of the graphics
+        without `inkscape`, if they contain only supported features
+        (see `svgpdf.export`), else export them with `inkscape`
+    @type native_pdf: `bool`
+    @param simplify_tolerance: if not `None`, then simplify long
+        polylines before exporting, within this distance in bp
+        (see `simplify.simplify_paths`). The text is not changed.
+    @type simplify_tolerance: `float`
     """
     fname, ext = os.path.splitext(svg_fname)
     assert ext == '.svg', ext
+    if basename is not None:
+        fname = basename
+    exports = list()
+    for target in targets:
+        if target.method == 'latex-pdf':
+            continue
+        path, = formats.target_outputs(fname, target)
+        dpi = DPI if target.dpi is None else target.dpi
+        exports.append((target.method, os.path.realpath(path), dpi))
+    latex = any(target.method == 'latex-pdf' for target in targets)
     tex_path = '{fname}.pdf_tex'.format(fname=fname)
     pdf_path = '{fname}.pdf'.format(fname=fname)
-    # convert
-    xml, text_ids, ignore_ids, labels = _split_text_graphics(svg_fname)
-    pdf_bboxes = _generate_pdf_from_svg_using_inkscape(xml, pdf_path)
-    pdf_bbox = _pdf_bounding_box(pdf_bboxes)
-    svg_bboxes = _svg_bounding_boxes(svg_fname)
+    ids = set()
+    query_fname = svg_fname
+    with contextlib.ExitStack() as stack:
+        steps = dict()
+        if latex:
+            xml, text_ids, ignore_ids, labels = _split_text_graphics(
+                svg_fname)
+            ids = text_ids - ignore_ids
+            if raster_dpi is not None:
+                _rasterize_filters(xml, raster_dpi, processes)
+            if simplify_tolerance is not None:
+                simplify.simplify_paths(xml, simplify_tolerance)
+            native = None
+            if native_pdf:
+                native = _native_pdf(stack, xml, pdf_path)
+            cover_ids = list()
+            estimated = None
+            if labels and estimate_text:
+                estimated = _estimate_text_bboxes(
+                    etree.parse(svg_fname), ids)
+            if estimated is not None:
+                # the original SVG need not be queried
+                ids = set()
+            elif labels and native is None:
+                doc = etree.parse(svg_fname)
+                cover_ids, named = _text_free_cover(doc)
+                if named:
+                    query_fname = _write_temp_svg(stack, doc, svg_fname)
+            query = bool(labels) and not cover_ids
+            if native is None:
+                steps.update(_graphics_steps(stack, xml, pdf_path, query))
+            ids = ids.union(cover_ids)
+        export_fname = None
+        if exports and (
+                raster_dpi is not None or
+                simplify_tolerance is not None):
+            doc = etree.parse(svg_fname)
+            changed = False
+            if raster_dpi is not None:
+                changed = _rasterize_filters(doc, raster_dpi, processes)
+            if simplify_tolerance is not None:
+                r = simplify.simplify_paths(doc, simplify_tolerance)
+                changed = changed or r.paths > 0
+            if changed:
+                export_fname = _write_temp_svg(stack, doc, svg_fname)
+        steps.update(_export_steps(
+            stack, query_fname, exports, ids, export_fname))
+        results = _run_steps(steps, processes)
+    if not latex:
+        return
+    svg_bboxes = results.get('text', dict())
+    if estimated is not None:
+        svg_bboxes = estimated
+    if native is not None:
+        pdf_bbox = native
+    elif query:
+        pdf_bbox = _queried_pdf_bounding_box(results['graphics'])
+    else:
+        pdf_bbox = _pdf_bounding_box(
+            results['graphics'], svg_bboxes, cover_ids)
+    if pdf_bbox is None:
+        log.info('Bounding boxes of graphics differ from PDF page, '
+                 'querying the graphics.')
+        pdf_bbox = _queried_pdf_bounding_box(
+            _generate_bounding_boxes(xml))
     svg_bbox = _svg_bounding_box(
         svg_bboxes, text_ids, ignore_ids, pdf_bbox)
-    tex = _TeXPicture(svg_bbox, pdf_bbox, pdf_path, labels)
+    tex = _TeXPicture(svg_bbox, pdf_bbox, pdf_path, labels, compact)
     pdf_tex_contents = tex.dumps()
-    with open(tex_path, 'w', encoding='utf-8') as f:
-        f.write(pdf_tex_contents)
+    cache.atomic_write(tex_path, pdf_tex_contents)
+
+
+def _native_pdf(stack, svg_data, pdfpath):
+    """Write graphics `svg_data` to PDF `pdfpath`, without `inkscape`.
+
+    Return `None` if `svg_data` contains features that are not
+    supported (see `svgpdf.export`), so `inkscape` is needed.
+    As in `_graphics_steps`, the PDF is written to a temporary
+    file, which replaces `pdfpath` when `stack` exits without
+    exception.
+
+    @type stack: `contextlib.ExitStack`
+    @type svg_data: `lxml.etree._ElementTree`
+    @type pdfpath: `str`
+    @return: bounding box of the graphics
+    @rtype: `_BBox` or `None`
+    """
+    try:
+        data, bbox = svgpdf.export(svg_data)
+    except svgpdf.Unsupported as e:
+        log.info('Exporting graphics with inkscape ({e}).'.format(e=e))
+        return None
+    tmp_pdf = stack.enter_context(
+        cache.replacing(os.path.realpath(pdfpath)))
+    with open(tmp_pdf, 'wb') as f:
+        f.write(data)
+    return _BBox(*bbox)
+
+
+def convert_draft(svg_fname, basename=None, compact=False):
+    """Write a draft `.pdf_tex` for SVG `svg_fname`, without `inkscape`.
+
+    The draft contains a frame of the size of the SVG page (from its
+    `width`, `height`, and `viewBox`), and the labels typeset at
+    their positions, but no graphics. The PDF is not written, so
+    the figure is not up to date until converted by `convert`.
+
+    @type svg_fname: `str`
+    @param basename: see `convert`
+    @param compact: see `convert_targets`
+    """
+    fname, ext = os.path.splitext(svg_fname)
+    assert ext == '.svg', ext
+    if basename is not None:
+        fname = basename
+    xml, _, _, labels = _split_text_graphics(svg_fname)
+    page = _page_bbox(xml)
+    tex = _TeXPicture(page, page, None, labels, compact, frame=True)
+    tex_path = '{fname}.pdf_tex'.format(fname=fname)
+    cache.atomic_write(tex_path, tex.dumps())
+
+
+def _page_bbox(doc):
+    """Return bounding box of the page of `doc`, in px.
+
+    @type doc: `lxml.etree._ElementTree`
+    @rtype: `_BBox`
+    """
+    root = doc.getroot()
+    width = _mm_to_svg_units(root.attrib['width'])
+    height = _mm_to_svg_units(root.attrib['height'])
+    x = y = 0.0
+    viewbox = root.attrib.get('viewBox')
+    if viewbox is not None:
+        # labels are in viewBox units, scaled to px
+        scaling = _scaling_assumed(doc)
+        vx, vy = viewbox.replace(',', ' ').split()[:2]
+        x = float(vx) * scaling
+        y = float(vy) * scaling
+    return _BBox(x=x, y=y, width=width, height=height)
+
+
+def convert_bytes(
+        svg_bytes, method='latex-pdf', pdf_name='figure.pdf',
+        processes=None, compact=False):
+    """Convert SVG `svg_bytes` in memory, and return the outputs.
+
+    For `latex-pdf`, return the PDF of the graphics, and the
+    contents of the `.pdf_tex`, which includes the PDF as `pdf_name`.
+    For `pdf`, return the PDF of the whole figure, and `None`.
+
+    Where `inkscape` can read SVG from a pipe (Inkscape >= 1.0),
+    the SVG is passed to `inkscape` through pipes, and the PDF read
+    from a pipe, so no files are written. Otherwise, `inkscape` reads
+    and writes files in a temporary directory. Nothing is printed,
+    and no state is shared between calls, so this function can be
+    called from several threads at once. Relative links in the SVG
+    (for example to images) are not supported.
+
+    @type svg_bytes: `bytes`
+    @param method: `'latex-pdf'` or `'pdf'`
+    @type method: `str`
+    @param pdf_name: name of the PDF in the `.pdf_tex`
+    @type pdf_name: `str`
+    @param processes: see `_run_steps`
+    @param compact: see `convert_targets`
+    @return: `(pdf_bytes, pdf_tex)`
+    @rtype: `tuple`
+    """
+    targets = formats.parse_targets(method)
+    if len(targets) != 1 or targets[0].method not in ('latex-pdf', 'pdf'):
+        raise ValueError(
+            'expected method `latex-pdf` or `pdf`, '
+            'not "{m}"'.format(m=method))
+    if targets[0].method == 'pdf':
+        return _export_bytes(svg_bytes, 'pdf'), None
+    doc = etree.ElementTree(etree.fromstring(svg_bytes))
+    xml, text_ids, ignore_ids, labels = _split_text_tree(
+        copy.deepcopy(doc))
+    ids = text_ids - ignore_ids
+    cover_ids = list()
+    if labels:
+        cover_ids, _ = _text_free_cover(doc)
+    query = bool(labels) and not cover_ids
+    root_id = _ensure_root_id(xml)
+    graphics = etree.tostring(xml, encoding='utf-8', xml_declaration=True)
+    steps = dict(graphics=functools.partial(
+        _export_bytes, graphics, 'pdf'))
+    if query:
+        steps['graphics-query'] = functools.partial(
+            _bytes_bounding_boxes, graphics, {root_id})
+    ids = ids.union(cover_ids)
+    if ids:
+        steps['text'] = functools.partial(
+            _bytes_bounding_boxes,
+            etree.tostring(doc, encoding='utf-8', xml_declaration=True),
+            ids)
+    results = _run_steps(steps, processes)
+    pdf_bytes = results['graphics']
+    svg_bboxes = results.get('text', dict())
+    if query:
+        pdf_bbox = _queried_pdf_bounding_box(results['graphics-query'])
+    else:
+        pdf_bbox = _pdf_bounding_box(
+            pdf.loads_page_box(pdf_bytes), svg_bboxes, cover_ids)
+    if pdf_bbox is None:
+        log.info('Bounding boxes of graphics differ from PDF page, '
+                 'querying the graphics.')
+        pdf_bbox = _queried_pdf_bounding_box(
+            _bytes_bounding_boxes(graphics, {root_id}))
+    svg_bbox = _svg_bounding_box(
+        svg_bboxes, text_ids, ignore_ids, pdf_bbox)
+    tex = _TeXPicture(svg_bbox, pdf_bbox, pdf_name, labels, compact)
+    return pdf_bytes, tex.dumps()
+
+
+def _export_bytes(svg_bytes, export_type):
+    """Return output of exporting SVG `svg_bytes` to `export_type`.
+
+    @type svg_bytes: `bytes`
+    @param export_type: as for `inkscape.export_args`
+    @rtype: `bytes`
+    """
+    ink = inkscape.probe()
+    args = inkscape.export_pipe_args(ink, export_type, DPI)
+    if args is not None:
+        return _pipe_inkscape(args, svg_bytes)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        svg_path = os.path.join(tmpdir, 'figure.svg')
+        out_path = os.path.join(tmpdir, 'figure.' + export_type)
+        with open(svg_path, 'wb') as f:
+            f.write(svg_bytes)
+        _run_inkscape(inkscape.export_args(
+            ink, svg_path, out_path, export_type, DPI), len(svg_bytes))
+        with open(out_path, 'rb') as f:
+            return f.read()
+
+
+def _bytes_bounding_boxes(svg_bytes, ids):
+    """Return bounding boxes of elements with `ids` in `svg_bytes`.
+
+    @type svg_bytes: `bytes`
+    @type ids: `set` of `str`
+    @return: `dict` that maps `id` to `_BBox`
+    @rtype: `dict`
+    """
+    ink = inkscape.probe()
+    args = inkscape.query_all_pipe_args(ink)
+    if args is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            svg_path = os.path.join(tmpdir, 'figure.svg')
+            with open(svg_path, 'wb') as f:
+                f.write(svg_bytes)
+            return _svg_bounding_boxes(svg_path, ids)
+    out = _pipe_inkscape(args, svg_bytes)
+    bboxes = dict()
+    for line in out.decode('utf-8', 'replace').splitlines():
+        bbox = _bbox_from_line(line, ids)
+        if bbox is not None:
+            bboxes[bbox[0]] = bbox[1]
+    return bboxes
+
+
+def _pipe_inkscape(args, data):
+    """Return standard output of `inkscape` run with `args`.
+
+    `data` is written to the standard input of `inkscape`.
+    Raise an exception if `inkscape` fails.
+
+    @type args: `list` of `str`
+    @type data: `bytes`
+    @rtype: `bytes`
+    """
+    rcode, out = inkscape.call(
+        args, len(data), functools.partial(_communicate, data),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE)
+    if rcode != 0:
+        raise Exception((
+            '`{inkscape}` exited with '
+            'return code {rcode}'
+            ).format(
+                inkscape=args[0],
+                rcode=rcode))
+    return out
+
+
+def _communicate(data, proc):
+    """Write `data` to `proc`, and return return code and output.
+
+    @type data: `bytes`
+    @type proc: `subprocess.Popen`
+    @rtype: `tuple`
+    """
+    # written by another thread, so that
+    # a full `stdout` pipe does not block `inkscape`
+    writer = threading.Thread(
+        target=_write_and_close, args=(proc.stdin, data))
+    writer.start()
+    out = proc.stdout.read()
+    writer.join()
+    inkscape.wait(proc)
+    return proc.returncode, out
+
+
+def _read_output(proc):
+    """Return return code and standard output of `proc`.
+
+    @type proc: `subprocess.Popen`
+    @rtype: `tuple`
+    """
+    out = proc.stdout.read()
+    inkscape.wait(proc)
+    return proc.returncode, out
+
+
+def _write_and_close(f, data):
+    """Write `data` to file `f`, and close it."""
+    # if `inkscape` exits early, then its return code is reported
+    try:
+        f.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            f.close()
+        except BrokenPipeError:
+            pass
+
+
+def _run_steps(steps, processes=None):
+    """Call each of `steps` in a thread, and return their results.
+
+    Each step runs one `inkscape` process at a time,
+    so `processes` bounds the number of `inkscape` processes.
+    If a step raises an exception, then it is raised
+    after all steps have finished. If waiting is interrupted,
+    then the `inkscape` processes of the steps (and of no other
+    threads) are killed, see `inkscape.Group`.
+
+    @param steps: `dict` that maps names to callables
+    @param processes: number of threads,
+        if `None`, then one for each step
+    @return: `dict` that maps names to results
+    @rtype: `dict`
+    """
+    if processes is None:
+        processes = len(steps)
+    processes = max(1, min(processes, len(steps)))
+    if processes == 1:
+        return {name: f() for name, f in steps.items()}
+    group = inkscape.Group()
+    with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+        futures = {
+            name: executor.submit(_run_step, group, f)
+            for name, f in steps.items()}
+        try:
+            concurrent.futures.wait(futures.values())
+        except BaseException:
+            # for example, an interrupt: stop `inkscape`,
+            # so that the threads can be joined
+            group.kill()
+            raise
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _run_step(group, f):
+    """Return `f()`, with `inkscape` processes added to `group`."""
+    with inkscape.joined(group):
+        return f()
 
 
 def _split_text_graphics(svg_fname):
@@ -153,7 +614,17 @@ def _split_text_graphics(svg_fname):
     @type svg_fname: `str`
     """
     doc = etree.parse(svg_fname)
-    _print_svg_units(doc)
+    return _split_text_tree(doc)
+
+
+def _split_text_tree(doc):
+    """Return `doc` without text, and text labels.
+
+    The `text` elements are removed from `doc`.
+
+    @type doc: `lxml.etree._ElementTree`
+    """
+    _log_svg_units(doc)
     ignore_ids = set()
     for defs in doc.xpath(
             '//svg:defs',
@@ -178,22 +649,22 @@ def _split_text_graphics(svg_fname):
     return doc, text_ids, ignore_ids, labels
 
 
-def _print_svg_units(doc):
-    """Print `doc` width and height in units.
+def _log_svg_units(doc):
+    """Log `doc` width and height in units.
 
     @type doc: `lxml.etree._ElementTree`
     """
     w = _mm_to_svg_units(doc.getroot().attrib['width'])
     h = _mm_to_svg_units(doc.getroot().attrib['height'])
-    print('width = {w:0.2f} px, height = {h:0.2f} px'.format(
+    log.info('width = {w:0.2f} px, height = {h:0.2f} px'.format(
         w=w, h=h))
     w_inch = w / DPI
     h_inch = h / DPI
-    print('width = {w:0.2f} in, height = {h:0.2f} in'.format(
+    log.info('width = {w:0.2f} in, height = {h:0.2f} in'.format(
         w=w_inch, h=h_inch))
     w_bp = w * SVG_UNITS_TO_BIG_POINTS
     h_bp = h * SVG_UNITS_TO_BIG_POINTS
-    print('width = {w:0.2f} bp, height = {h:0.2f} bp'.format(
+    log.info('width = {w:0.2f} bp, height = {h:0.2f} bp'.format(
         w=w_bp, h=h_bp))
 
 
@@ -235,35 +706,35 @@ def _scaling_assumed(doc):
             viewbox = viewbox.split(',')
         else:
             viewbox = viewbox.split(' ')
-    print('viewbox:' + str(viewbox))
+    log.info('viewbox: {v}'.format(v=viewbox))
     if viewbox is None:
         scaling = 1.0
         return scaling
     # assume same scaling in x and y axes
     viewbox_width = float(viewbox[2])
     if 'in' in width:
-        print('in found')
+        log.info('in found')
         in_width = float(width[:-2])
         # px / viewbox units
         scaling = (
             DPI  # px / in
             * in_width / viewbox_width)  # * in / viewbox units
     elif 'mm' in width:
-        print('mm found')
+        log.info('mm found')
         mm_width = float(width[:-2])
         # px / viewbox units
         scaling = (
             DPI / 25.4  # (px / in) * (in / mm) = (px / mm)
             * mm_width / viewbox_width)  # * mm / viewbox units
     elif 'cm' in width:
-        print('cm found')
+        log.info('cm found')
         cm_width = float(width[:-2])
         # px / viewbox units
         scaling = (
             DPI / 2.54  # (px / in) * (in / cm) = (px / cm)
             * cm_width / viewbox_width)  # * cm / viewbox units
     elif 'pt' in width:
-        print('pt found')
+        log.info('pt found')
         pt_width = float(width[:-2])
         # px / viewbox units
         scaling = (
@@ -272,7 +743,7 @@ def _scaling_assumed(doc):
     elif 'pc' in width:
         raise NotImplementedError('pc units')
     elif 'px' in width:
-        print('px found')
+        log.info('px found')
         px_width = float(width[:-2])
         scaling = px_width / viewbox_width
     else:  # no unit identifier
@@ -289,11 +760,7 @@ def _interpret_svg_text(text_element, labels, scaling):
     @rtype: `set`
     """
     assert text_element.tag.endswith('text'), text_element.tag
-    if 'style' in text_element.attrib:
-        style = _split_svg_style(
-            text_element.attrib['style'])
-    else:
-        style = dict()
+    style = _text_style(text_element)
     text_ids = set()
     if 'id' in text_element.attrib:
         name = text_element.attrib['id']
@@ -328,6 +795,118 @@ def _interpret_svg_text(text_element, labels, scaling):
     return text_ids
 
 
+def _estimate_text_bboxes(doc, ids):
+    """Return bounding boxes of `text` elements with `ids`, estimated.
+
+    The extents are computed from the metrics of the fonts in
+    `_FONT_MAP` (see `fonts.Font.extent`), using the font size,
+    letter spacing, anchor, and transformations of each `tspan`,
+    and contain the bounding boxes that `inkscape` would return.
+    Return `None` if any of `ids` cannot be estimated.
+
+    @type doc: `lxml.etree._ElementTree`
+    @type ids: `set` of `str`
+    @return: `dict` that maps `id` to `_BBox`, or `None`
+    @rtype: `dict`
+    """
+    scaling = _scaling_assumed(doc)
+    bboxes = dict()
+    for text in doc.iter(_svg_tag('text')):
+        name = text.attrib.get('id')
+        if name not in ids:
+            continue
+        corners = _estimate_text_corners(text)
+        if corners is None:
+            log.info('Cannot estimate extent of text "{t}".'.format(
+                t=name))
+            return None
+        xs = [x * scaling for x, _ in corners]
+        ys = [y * scaling for _, y in corners]
+        bboxes[name] = _BBox(
+            x=min(xs), y=min(ys),
+            width=max(xs) - min(xs),
+            height=max(ys) - min(ys))
+    return bboxes
+
+
+def _estimate_text_corners(text):
+    """Return corners of extents of `tspan`s of `text`, or `None`.
+
+    @type text: `lxml.etree._Element`
+    @rtype: `list` of `tuple`
+    """
+    style = _text_style(text)
+    tspans = text.findall(_svg_tag('tspan'))
+    if not tspans:
+        tspans = [text]
+    elif text.text is not None and text.text.strip():
+        return None  # text outside of `tspan`s
+    corners = list()
+    for tspan in tspans:
+        if len(tspan) or 'textLength' in tspan.attrib:
+            return None
+        if not tspan.text:
+            continue
+        span_style = _update_tspan_style(style, tspan)
+        extent = _estimate_tspan_extent(tspan.text, span_style)
+        if extent is None:
+            return None
+        xmin, ymin, xmax, ymax = extent
+        x = float(tspan.attrib['x'])
+        y = float(tspan.attrib['y'])
+        xform = _compute_svg_transform(tspan)
+        for dx, dy in (
+                (xmin, ymin), (xmax, ymin),
+                (xmin, ymax), (xmax, ymax)):
+            corners.append(xform.apply((x + dx, y + dy)))
+    if not corners:
+        return None
+    return corners
+
+
+def _estimate_tspan_extent(text, span_style):
+    """Return extent of `text` with `span_style`, relative to anchor.
+
+    For `text-anchor` `middle` or `end`, the text starts before the
+    anchor by a shift computed from the advance width, which ignores
+    kerning (see `fonts.Font.advance`). Kerning usually narrows text,
+    so the text starts between the computed shift and the anchor.
+    The extent is the union of the extents for these two starts.
+
+    @return: `(xmin, ymin, xmax, ymax)`, or `None`
+    @rtype: `tuple`
+    """
+    family = span_style.get('font-family', '').strip('\'" ')
+    if family not in _FONT_MAP:
+        return None
+    try:
+        size = _mm_to_svg_units(span_style['font-size'])
+        spacing = span_style.get('letter-spacing', 'normal')
+        spacing = 0.0 if spacing == 'normal' else _mm_to_svg_units(spacing)
+    except (KeyError, ValueError, NotImplementedError):
+        return None
+    if span_style.get('word-spacing', 'normal') not in (
+            'normal', '0', '0px'):
+        return None
+    weight = span_style.get('font-weight', 'normal')
+    bold = weight in ('bold', 'bolder') or (
+        weight.isdigit() and int(weight) >= 600)
+    italic = span_style.get('font-style') in ('italic', 'oblique')
+    font = fonts.find_font(family, bold, italic)
+    if font is None:
+        return None
+    extent = font.extent(text, size, spacing)
+    width = font.advance(text, size, spacing)
+    if extent is None or width is None:
+        return None
+    anchor = span_style.get('text-anchor', 'start')
+    shift = dict(start=0.0, middle=width / 2, end=width).get(anchor)
+    if shift is None:
+        return None
+    xmin, ymin, xmax, ymax = extent
+    return xmin - shift, ymin, xmax, ymax
+
+
 def _make_tex_label(tspan):
     """Return a `_TeXLabel` from `tspan`."""
     # position and angle
@@ -349,9 +928,7 @@ def _get_tspan_pos_angle(tspan):
 def _update_tspan_style(style, tspan):
     """Return style of `style` updated using `tspan`."""
     span_style = style.copy()
-    if 'style' in tspan.attrib:
-        st = _split_svg_style(tspan.attrib['style'])
-        span_style.update(st)
+    span_style.update(_text_style(tspan))
     return span_style
 
 
@@ -409,7 +986,7 @@ def _set_font_family(tex_label, span_style):
     if ff in _FONT_MAP:
         tex_label.fontfamily = _FONT_MAP[ff]
     else:
-        print('Could not match font-family', ff)
+        log.warning('Could not match font-family {ff}'.format(ff=ff))
 
 
 def _set_font_size(tex_label, span_style):
@@ -420,7 +997,7 @@ def _set_font_size(tex_label, span_style):
     if fs in _FONT_SIZE_MAP:
         tex_label.fontsize = _FONT_SIZE_MAP[fs]
     else:
-        print('Could not match font-size', fs)
+        log.warning('Could not match font-size {fs}'.format(fs=fs))
 
 
 def _scale_texlabel(tex_label, scaling):
@@ -430,6 +1007,40 @@ def _scale_texlabel(tex_label, scaling):
     tex_label.pos = (x, y)
 
 
+def _text_style(el):
+    """Return `dict` of the style of text element `el`.
+
+    Presentation attributes (for example `text-anchor="middle"`,
+    as written by Graphviz) are included, and properties in the
+    attribute `style` take precedence over them.
+
+    @type el: `lxml.etree._Element`
+    @rtype: `dict`
+    """
+    style = {
+        name: el.attrib[name] for name in _TEXT_ATTRIBUTES
+        if name in el.attrib}
+    if 'style' in el.attrib:
+        style.update(_split_svg_style(el.attrib['style']))
+    if 'font-size' in style:
+        style['font-size'] = _normalize_font_size(style['font-size'])
+    return style
+
+
+def _normalize_font_size(size):
+    """Return font `size` in `px`, if it is in `px` or unitless.
+
+    For example, `"14.00"` (as written by Graphviz) becomes `"14px"`.
+
+    @type size: `str`
+    @rtype: `str`
+    """
+    m = _RX_FONT_SIZE.match(size.strip())
+    if m is None:
+        return size
+    return '{s:g}px'.format(s=float(m.group(1)))
+
+
 def _split_svg_style(style):
     """Return `dict` from parsing `style`."""
     parts = [x.strip() for x in style.split(';')]
@@ -543,7 +1154,7 @@ def _make_rotation_transform(args):
         args = args + [0, 0]  # cx, cy
     xform = _AffineTransform()
     xform.rotate_degrees(*args)
-    print('WARNING: text rotation (not tested)')
+    log.warning('text rotation (not tested)')
     return xform
 
 
@@ -572,34 +1183,471 @@ def _generate_pdf_from_svg_using_inkscape(svg_data, pdfpath):
     @return: bounding boxes
     @rtype: `dict`
     """
-    inkscape = which_inkscape()
-    path = os.path.realpath(pdfpath)
-    args = [inkscape,
-            '--without-gui',
-            '--export-area-drawing',
-            '--export-ignore-filters',
-            '--export-dpi={dpi}'.format(dpi=DPI),
-            '--export-pdf={path}'.format(path=path)]
+    with contextlib.ExitStack() as stack:
+        steps = _graphics_steps(stack, svg_data, pdfpath)
+        results = _run_steps(steps)
+    return results['graphics']
+
+
+def _graphics_steps(stack, svg_data, pdfpath, query=True):
+    """Return steps that export `svg_data` to PDF `pdfpath`.
+
+    If `query`, then the step `'graphics'` returns the bounding
+    boxes of `svg_data`, else the page box of the PDF
+    (see `pdf.page_box`). The PDF is exported to a temporary file,
+    so that readers of `pdfpath` never find it partially written.
+    It replaces `pdfpath` when `stack` exits without exception.
+
+    @type stack: `contextlib.ExitStack`
+    @type svg_data: `lxml.etree._ElementTree`
+    @type pdfpath: `str`
+    @type query: `bool`
+    @return: `dict` that maps names to callables
+    @rtype: `dict`
+    """
+    ink = inkscape.probe()
+    root_id = _ensure_root_id(svg_data)
+    tmp_pdf = stack.enter_context(
+        cache.replacing(os.path.realpath(pdfpath)))
+    tmpsvg = stack.enter_context(tempfile.NamedTemporaryFile(
+        suffix='.svg', delete=True))
+    svg_data.write(tmpsvg, encoding='utf-8',
+                   xml_declaration=True)
+    tmpsvg.flush()
+    # shutil.copyfile(tmpsvg.name, 'foo_bare.svg')
+    tmp_path = os.path.realpath(tmpsvg.name)
+    size = os.path.getsize(tmp_path)
+    if not query:
+        args = inkscape.export_pdf_args(ink, tmp_path, tmp_pdf, DPI)
+        return dict(graphics=functools.partial(
+            _export_page_box, args, tmp_pdf, size))
+    args = inkscape.query_and_export_pdf_args(
+        ink, tmp_path, tmp_pdf, DPI)
+    if args is not None:
+        # one `inkscape` process for both query and export
+        return dict(graphics=functools.partial(
+            _query_bounding_boxes, args, {root_id}, size=size))
+    args = inkscape.export_pdf_args(ink, tmp_path, tmp_pdf, DPI)
+    return {
+        'graphics': functools.partial(
+            _svg_bounding_boxes, tmp_path, {root_id}),
+        'graphics-export': functools.partial(_run_inkscape, args, size)}
+
+
+def _export_page_box(args, pdfpath, size=0):
+    """Run `inkscape` with `args`, and return page box of `pdfpath`.
+
+    @param args: arguments that export PDF `pdfpath`
+    @type pdfpath: `str`
+    @param size: bytes of input, see `inkscape.timeout_for`
+    @return: `(x0, y0, x1, y1)` in big points
+    @rtype: `tuple`
+    """
+    _run_inkscape(args, size)
+    return pdf.page_box(pdfpath)
+
+
+def _generate_bounding_boxes(svg_data):
+    """Return bounding box of the root of `svg_data`.
+
+    @type svg_data: `lxml.etree._ElementTree`
+    @return: as returned by `_svg_bounding_boxes`
+    @rtype: `dict`
+    """
+    root_id = _ensure_root_id(svg_data)
     with tempfile.NamedTemporaryFile(
             suffix='.svg', delete=True) as tmpsvg:
         svg_data.write(tmpsvg, encoding='utf-8',
-                      xml_declaration=True)
+                       xml_declaration=True)
+        tmpsvg.flush()
+        return _svg_bounding_boxes(tmpsvg.name, {root_id})
+
+
+def _text_free_cover(svg_data):
+    """Return `id`s of outermost elements of `svg_data` without text.
+
+    These elements are those of the SVG without `text`, so the
+    union of their bounding boxes is the drawing area of the PDF
+    exported from it. Elements without `id` are given one.
+
+    An empty `list` is returned if the union can differ from
+    the drawing area: if an element that contains `text` is
+    clipped, masked, or filtered, or if there is no graphics.
+
+    @type svg_data: `lxml.etree._ElementTree`
+    @return: `(ids, named)`, where `named` is `True`
+        if any element was given an `id`
+    @rtype: `tuple`
+    """
+    cover = list()
+    pending = [svg_data.getroot()]
+    while pending:
+        el = pending.pop()
+        for child in reversed(el):
+            if not isinstance(child.tag, str):
+                continue  # comment or processing instruction
+            name = etree.QName(child)
+            if name.namespace != _INKSVG_NAMESPACES['svg']:
+                continue
+            if name.localname in _NOT_RENDERED:
+                continue
+            if name.localname == 'text':
+                continue
+            if next(child.iter(_svg_tag('text')), None) is None:
+                cover.append(child)
+                continue
+            if _has_filter(child) or any(
+                    attr in child.attrib or
+                    attr in _split_svg_style(child.attrib.get('style', ''))
+                    for attr in ('clip-path', 'mask')):
+                return list(), False
+            pending.append(child)
+    named = False
+    ids = list()
+    for i, el in enumerate(cover):
+        if 'id' not in el.attrib:
+            el.attrib['id'] = _COVER_ID.format(i=i)
+            named = True
+        ids.append(el.attrib['id'])
+    return ids, named
+
+
+def _write_temp_svg(stack, svg_data, svg_fname):
+    """Write `svg_data` to a temporary file next to `svg_fname`.
+
+    The file is next to `svg_fname`, so that relative links work,
+    and is removed when `stack` exits.
+
+    @type stack: `contextlib.ExitStack`
+    @type svg_data: `lxml.etree._ElementTree`
+    @type svg_fname: `str`
+    @return: path of the temporary file
+    @rtype: `str`
+    """
+    tmpsvg = stack.enter_context(tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(svg_fname)),
+        prefix='.', suffix='.svg', delete=True))
+    svg_data.write(tmpsvg, encoding='utf-8', xml_declaration=True)
+    tmpsvg.flush()
+    return tmpsvg.name
+
+
+def _export_steps(stack, svg_fname, exports, ids, export_fname=None):
+    """Return steps that export SVG file `svg_fname`.
+
+    The step `'text'` (if `ids` is nonempty) returns the bounding
+    boxes of `ids` in `svg_fname`. Outputs are written to temporary
+    files, which replace them when `stack` exits without exception.
+
+    @type stack: `contextlib.ExitStack`
+    @type svg_fname: `str`
+    @param exports: `list` of `(export_type, path, dpi)`,
+        as for `inkscape.query_and_export_args`
+    @type ids: `set` of `str`
+    @param export_fname: SVG file to export instead of `svg_fname`
+    @type export_fname: `str`
+    @return: `dict` that maps names to callables
+    @rtype: `dict`
+    """
+    steps = dict()
+    if ids:
+        steps['text'] = functools.partial(
+            _svg_bounding_boxes, svg_fname, ids)
+    if not exports:
+        return steps
+    ink = inkscape.probe()
+    # the query can be combined with exports of the same file
+    query = bool(ids) and export_fname is None
+    if export_fname is None:
+        export_fname = svg_fname
+    svg_path = os.path.realpath(export_fname)
+    size = os.path.getsize(svg_path)
+    tmp_exports = [
+        (export_type, stack.enter_context(cache.replacing(path)), dpi)
+        for export_type, path, dpi in exports]
+    args = inkscape.query_and_export_args(
+        ink, svg_path, tmp_exports, query=query)
+    if args is not None:
+        # one `inkscape` process for the query and all exports
+        if query:
+            steps['text'] = functools.partial(
+                _query_bounding_boxes, args, ids, size=size)
+        else:
+            steps['export'] = functools.partial(
+                _run_inkscape, args, size)
+        return steps
+    for export_type, path, dpi in tmp_exports:
+        args = inkscape.export_args(ink, svg_path, path, export_type, dpi)
+        steps['export-' + export_type] = functools.partial(
+            _run_inkscape, args, size)
+    return steps
+
+
+def _rasterize_filters(svg_data, dpi, processes=None):
+    """Replace elements of `svg_data` that have filters by images.
+
+    Each element with a filter (that is not inside another one) is
+    rasterized by `inkscape` at `dpi`, in a standalone SVG that
+    contains the element, the definitions that it references, and
+    the transformation of its parent. The image and its bounding box
+    are cached, keyed by a digest of this standalone SVG, so an
+    element is rasterized again only if it, or its position, changed.
+    The element is then replaced by an `image` at the same position.
+
+    @type svg_data: `lxml.etree._ElementTree`
+    @param dpi: resolution of images
+    @type dpi: `float`
+    @param processes: see `_run_steps`
+    @return: number of elements replaced
+    @rtype: `int`
+    """
+    root = svg_data.getroot()
+    elements = _filtered_elements(root)
+    if not elements:
+        return 0
+    ink = inkscape.probe()
+    salt = '\n{dpi}\n{path}:{version}'.format(
+        dpi=dpi, path=ink.path, version=ink.version).encode('utf-8')
+    ids = _ids_in_order(root)
+    steps = dict()
+    for i, el in enumerate(elements):
+        data = _standalone_svg(root, el, ids)
+        key = cache.bytes_digest(data + salt)
+        steps[i] = functools.partial(_cached_raster, data, key, dpi)
+    results = _run_steps(steps, processes)
+    scaling = _scaling_assumed(svg_data)
+    for i, el in enumerate(elements):
+        png, bbox = results[i]
+        _replace_by_image(el, png, bbox, scaling)
+    log.info('rasterized {n} elements with filters'.format(n=len(elements)))
+    return len(elements)
+
+
+def _filtered_elements(root):
+    """Return outermost rendered elements under `root` with a filter.
+
+    @type root: `lxml.etree._Element`
+    @rtype: `list`
+    """
+    found = list()
+    pending = [root]
+    while pending:
+        el = pending.pop()
+        for child in reversed(el):
+            if not isinstance(child.tag, str):
+                continue  # comment or processing instruction
+            if etree.QName(child).localname in _NOT_RENDERED:
+                continue
+            if _has_filter(child):
+                found.append(child)
+            else:
+                pending.append(child)
+    return found
+
+
+def _has_filter(el):
+    """Return `True` if element `el` has a filter."""
+    value = el.attrib.get('filter')
+    if 'style' in el.attrib:
+        value = _split_svg_style(el.attrib['style']).get('filter', value)
+    return value is not None and value.strip() not in ('', 'none')
+
+
+def _ids_in_order(root):
+    """Return `dict` that maps each `id` under `root` to its element.
+
+    The elements are also mapped to their index in document order,
+    under the key `None`.
+    """
+    ids = dict()
+    order = dict()
+    for i, el in enumerate(root.iter()):
+        if not isinstance(el.tag, str):
+            continue
+        order[el] = i
+        if 'id' in el.attrib:
+            ids.setdefault(el.attrib['id'], el)
+    ids[None] = order
+    return ids
+
+
+def _referenced_elements(el, ids):
+    """Return elements outside `el` that `el` references.
+
+    References are followed transitively, and
+    the result is in document order.
+
+    @param ids: as returned by `_ids_in_order`
+    @rtype: `list`
+    """
+    inside = set(el.iter())
+    refs = set()
+    pending = [el]
+    while pending:
+        e = pending.pop()
+        for sub in e.iter():
+            if not isinstance(sub.tag, str):
+                continue
+            for name, value in sub.attrib.items():
+                names = _RX_URL_REF.findall(value)
+                if name in (_XLINK_HREF, 'href') and value.startswith('#'):
+                    names.append(value[1:])
+                for ref_id in names:
+                    target = ids.get(ref_id)
+                    if target is None or target in inside:
+                        continue
+                    if target in refs or el in set(target.iter()):
+                        continue
+                    refs.add(target)
+                    pending.append(target)
+    # copying an element copies its descendants
+    refs = {
+        e for e in refs
+        if not any(a in refs for a in e.iterancestors())}
+    order = ids[None]
+    return sorted(refs, key=order.get)
+
+
+def _standalone_svg(root, el, ids):
+    """Return SVG `bytes` that draws element `el` of `root` alone.
+
+    @param ids: as returned by `_ids_in_order`
+    @rtype: `bytes`
+    """
+    svg = etree.Element(root.tag, nsmap=root.nsmap)
+    for attr in ('width', 'height', 'viewBox'):
+        if attr in root.attrib:
+            svg.attrib[attr] = root.attrib[attr]
+    svg.attrib['id'] = _ROOT_ID
+    defs = etree.SubElement(svg, _svg_tag('defs'))
+    for ref in _referenced_elements(el, ids):
+        defs.append(copy.deepcopy(ref))
+    g = etree.SubElement(svg, _svg_tag('g'))
+    xform = _compute_svg_transform(el.getparent())
+    g.attrib['transform'] = _svg_matrix(xform)
+    el = copy.deepcopy(el)
+    el.tail = None
+    g.append(el)
+    return etree.tostring(svg, encoding='utf-8', xml_declaration=True)
+
+
+def _cached_raster(data, key, dpi):
+    """Return PNG and bounding box of SVG `data`, using the cache.
+
+    @type data: `bytes`
+    @param key: digest of `data` and `dpi`
+    @return: `(png, bbox)`, where `png` is `bytes`,
+        and `bbox` is a `_BBox` in pixels
+    @rtype: `tuple`
+    """
+    png_path = os.path.join(cache.cache_dir('raster'), key + '.png')
+    bbox_path = os.path.join(cache.cache_dir('raster'), key + '.bbox')
+    bbox = _read_raster_bbox(bbox_path)
+    if bbox is None:
+        with lock.locked(png_path):
+            bbox = _read_raster_bbox(bbox_path)
+            if bbox is None:
+                bbox = _rasterize(data, png_path, dpi)
+                cache.atomic_write(
+                    bbox_path, ','.join(repr(v) for v in bbox))
+    with open(png_path, 'rb') as f:
+        png = f.read()
+    return png, bbox
+
+
+def _read_raster_bbox(path):
+    """Return `_BBox` stored in file `path`, or `None`."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return _BBox(*[float(v) for v in f.read().split(',')])
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def _rasterize(data, png_path, dpi):
+    """Export drawing area of SVG `data` to PNG file `png_path`.
+
+    @return: bounding box of the drawing area
+    @rtype: `_BBox`
+    """
+    ink = inkscape.probe()
+    with cache.replacing(png_path) as tmp_png, tempfile.NamedTemporaryFile(
+            suffix='.svg', delete=True) as tmpsvg:
+        tmpsvg.write(data)
         tmpsvg.flush()
-        bboxes = _svg_bounding_boxes(tmpsvg.name)
-        # shutil.copyfile(tmpsvg.name, 'foo_bare.svg')
         tmp_path = os.path.realpath(tmpsvg.name)
-        args.append('--file={s}'.format(s=tmp_path))
-        with subprocess.Popen(args) as proc:
-            proc.wait()
-            if proc.returncode != 0:
-                raise Exception((
-                    '`{inkscape}` conversion of SVG '
-                    'to PDF failed with return code '
-                    '{rcode}'
-                    ).format(
-                        inkscape=inkscape,
-                        rcode=proc.returncode))
-    return bboxes
+        exports = [('png', tmp_png, dpi)]
+        args = inkscape.query_and_export_args(ink, tmp_path, exports)
+        if args is not None:
+            bboxes = _query_bounding_boxes(
+                args, {_ROOT_ID}, size=len(data))
+        else:
+            bboxes = _svg_bounding_boxes(tmp_path, {_ROOT_ID})
+            args = inkscape.export_args(ink, tmp_path, tmp_png, 'png', dpi)
+            _run_inkscape(args, len(data))
+        bbox = bboxes.get(_ROOT_ID)
+        if bbox is None:
+            raise Exception('cannot find the drawing area to rasterize')
+    return bbox
+
+
+def _replace_by_image(el, png, bbox, scaling):
+    """Replace element `el` by an `image` of `png` at `bbox`.
+
+    @param png: PNG image
+    @type png: `bytes`
+    @param bbox: in pixels, as output by `inkscape`
+    @type bbox: `_BBox`
+    @param scaling: pixels per user unit,
+        as returned by `_scaling_assumed`
+    """
+    parent = el.getparent()
+    # from coordinates of `parent` to pixels
+    xform = _AffineTransform()
+    xform.scale(scaling)
+    xform = xform * _compute_svg_transform(parent)
+    image = etree.Element(_svg_tag('image'))
+    if 'id' in el.attrib:
+        image.attrib['id'] = el.attrib['id']
+    image.attrib['x'] = repr(bbox.x)
+    image.attrib['y'] = repr(bbox.y)
+    image.attrib['width'] = repr(bbox.width)
+    image.attrib['height'] = repr(bbox.height)
+    image.attrib['preserveAspectRatio'] = 'none'
+    image.attrib['transform'] = _svg_matrix(xform.inverse())
+    image.attrib[_XLINK_HREF] = 'data:image/png;base64,' + (
+        base64.b64encode(png).decode('ascii'))
+    image.tail = el.tail
+    parent.replace(el, image)
+
+
+def _svg_tag(name):
+    """Return qualified tag of SVG element `name`."""
+    return '{{{ns}}}{name}'.format(
+        ns=_INKSVG_NAMESPACES['svg'], name=name)
+
+
+def _svg_matrix(xform):
+    """Return SVG `transform` attribute for `_AffineTransform`."""
+    a, b, c, d = xform.m
+    e, f = xform.t
+    return 'matrix({})'.format(','.join(
+        '{v:.9f}'.format(v=v) for v in (a, b, c, d, e, f)))
+
+
+def _run_inkscape(args, size=0):
+    """Run `inkscape` with `args`, and raise if it fails.
+
+    @param size: bytes of input, see `inkscape.timeout_for`
+    """
+    rcode = inkscape.call(args, size, inkscape.wait)
+    if rcode != 0:
+        raise Exception((
+            '`{inkscape}` exited with '
+            'return code {rcode}'
+            ).format(
+                inkscape=args[0],
+                rcode=rcode))
 
 
 def _generate_pdf_from_svg_using_cairo(svg_data, pdfpath):
@@ -613,12 +1661,13 @@ def _generate_pdf_from_svg_using_cairo(svg_data, pdfpath):
     @return: bounding boxes
     @rtype: `dict`
     """
+    root_id = _ensure_root_id(svg_data)
     with tempfile.NamedTemporaryFile(
             suffix='.svg', delete=True) as tmpsvg:
         svg_data.write(tmpsvg, encoding='utf-8',
                       xml_declaration=True)
         tmpsvg.flush()
-        bboxes = _svg_bounding_boxes(tmpsvg.name)
+        bboxes = _svg_bounding_boxes(tmpsvg.name, {root_id})
         # shutil.copyfile(tmpsvg.name, 'foo_bare.svg')
         cairosvg.svg2pdf(
             file_obj=tmpsvg,
@@ -626,10 +1675,58 @@ def _generate_pdf_from_svg_using_cairo(svg_data, pdfpath):
     return bboxes
 
 
-def _pdf_bounding_box(pdf_bboxes):
-    """Return PDF bounding box.
+def _ensure_root_id(svg_data):
+    """Return `id` of root element of `svg_data`, assigning one if absent.
 
-    @type pdf_bboxes: `dict`
+    @type svg_data: `lxml.etree._ElementTree`
+    @rtype: `str`
+    """
+    root = svg_data.getroot()
+    if 'id' not in root.attrib:
+        root.attrib['id'] = _ROOT_ID
+    return root.attrib['id']
+
+
+def _pdf_bounding_box(page_box, svg_bboxes, ids):
+    """Return PDF bounding box, from the PDF page and `ids`.
+
+    The size is that of the page, converted to SVG units.
+    The position is that of the union of the bounding boxes of
+    `ids` (the origin, if `ids` is empty). Return `None` if none
+    of `ids` has a bounding box, or if the size of the union
+    differs from the size of the page.
+
+    @param page_box: `(x0, y0, x1, y1)` in big points,
+        as returned by `pdf.page_box`
+    @param svg_bboxes: `dict` that maps `id` to `_BBox`
+    @type ids: `list` of `str`
+    @rtype: `_BBox` or `None`
+    """
+    x0, y0, x1, y1 = page_box
+    width = (x1 - x0) / SVG_UNITS_TO_BIG_POINTS
+    height = (y1 - y0) / SVG_UNITS_TO_BIG_POINTS
+    if not ids:
+        return _BBox(x=0.0, y=0.0, width=width, height=height)
+    # elements that draw nothing have no bounding box
+    boxes = [svg_bboxes[name] for name in ids if name in svg_bboxes]
+    if not boxes:
+        return None
+    corners = [_corners(d) for d in boxes]
+    xmin = min(c[0] for c in corners)
+    xmax = max(c[1] for c in corners)
+    ymin = min(c[2] for c in corners)
+    ymax = max(c[3] for c in corners)
+    if (abs(xmax - xmin - width) > _COVER_TOLERANCE or
+            abs(ymax - ymin - height) > _COVER_TOLERANCE):
+        return None
+    return _BBox(x=xmin, y=ymin, width=width, height=height)
+
+
+def _queried_pdf_bounding_box(pdf_bboxes):
+    """Return PDF bounding box, from the bounding box of the root.
+
+    @param pdf_bboxes: `dict` that contains the bounding box of
+        the root `svg` element, as returned by `_svg_bounding_boxes`
     @rtype: `_BBox`
     """
     # Drawing area coordinates within SVG
@@ -658,7 +1755,7 @@ def _svg_bounding_box(
     xs = set()
     ys = set()
     # pprint.pprint(svg_bboxes)
-    for name in text_ids:
+    for name in sorted(text_ids):
         d = svg_bboxes.get(name)
         if name in ignore_ids or d is None:
             continue
@@ -686,41 +1783,145 @@ def _svg_bounding_box(
     return svg_bbox
 
 
-def _svg_bounding_boxes(svgfile):
-    """Parses the output from inkscape `--query-all`.
+def _svg_bounding_boxes(svgfile, ids=None):
+    """Return bounding boxes of elements with `ids` in `svgfile`.
 
-    This function calls `inkscape`.
+    This function calls `inkscape`. If `inkscape` can query
+    several elements by `id`, then only `ids` are queried.
+    Otherwise, the output of `--query-all` is parsed as it
+    is produced, keeping only `ids`, and stopping when all
+    `ids` have been found.
 
     @type svgfile: `str`
+    @param ids: if `None`, then return all bounding boxes
+    @type ids: `set` of `str`
+    @return: `dict` that maps `id` to `_BBox`
     @rtype: `dict`
     """
-    inkscape = which_inkscape()
+    ink = inkscape.probe()
     path = os.path.realpath(svgfile)
-    args = [
-        inkscape,
-        '--without-gui',
-        '--query-all',
-        '--file={s}'.format(s=path)]
-    with subprocess.Popen(
-            args,
-            stdout=subprocess.PIPE,
-            universal_newlines=True) as proc:
-        lines = proc.stdout.readlines()
-        proc.wait()
-        if proc.returncode != 0:
-            raise Exception((
-                '`{inkscape}` exited with '
-                'return code {rcode}'
-                ).format(
-                    inkscape=inkscape,
-                    rcode=proc.returncode))
+    size = os.path.getsize(path)
+    if ids is not None:
+        if not ids:
+            return dict()
+        args = inkscape.query_ids_args(ink, path, sorted(ids))
+        if args is not None:
+            bboxes = _query_bounding_boxes_by_id(args, sorted(ids), size)
+            if bboxes is not None:
+                return bboxes
+    args = inkscape.query_all_args(ink, path)
+    return _query_bounding_boxes(args, ids, stop_early=True, size=size)
+
+
+def _query_bounding_boxes(args, ids=None, stop_early=False, size=0):
+    """Return bounding boxes output by running `inkscape` with `args`.
+
+    The output of `--query-all` is parsed line by line,
+    keeping only the bounding boxes of `ids`.
+    Lines of the output that are not bounding boxes are skipped.
+
+    @type args: `list` of `str`
+    @param ids: if `None`, then keep all bounding boxes
+    @type ids: `set` of `str`
+    @param stop_early: if `True` and `ids` is not `None`, then
+        stop `inkscape` as soon as all `ids` have been found
+        (so only for calls that only query)
+    @param size: bytes of input, see `inkscape.timeout_for`
+    @return: `dict` that maps `id` to `_BBox`
+    @rtype: `dict`
+    """
+    return inkscape.call(
+        args, size,
+        functools.partial(_read_bounding_boxes, ids, stop_early),
+        stdout=subprocess.PIPE,
+        universal_newlines=True)
+
+
+def _read_bounding_boxes(ids, stop_early, proc):
+    """Return bounding boxes output by `proc`, and wait for it.
+
+    @param ids, stop_early: see `_query_bounding_boxes`
+    @type proc: `subprocess.Popen`
+    @rtype: `dict`
+    """
     bboxes = dict()
-    for line in lines:
-        name, x, y, w, h = _parse_bbox_string(line)
-        bboxes[name] = dict(x=x, y=y, w=w, h=h)
+    stopped = False
+    for line in proc.stdout:
+        bbox = _bbox_from_line(line, ids)
+        if bbox is None:
+            continue
+        name, d = bbox
+        bboxes[name] = d
+        if stop_early and ids is not None and len(bboxes) == len(ids):
+            proc.kill()
+            stopped = True
+            break
+    inkscape.wait(proc)
+    if proc.returncode != 0 and not stopped:
+        raise Exception((
+            '`{inkscape}` exited with '
+            'return code {rcode}'
+            ).format(
+                inkscape=proc.args[0],
+                rcode=proc.returncode))
     return bboxes
 
 
+def _bbox_from_line(line, ids=None):
+    """Return `(id, _BBox)` from line of `--query-all` output.
+
+    Return `None` if `line` is not a bounding box,
+    or is the bounding box of an element not in `ids`.
+
+    @type line: `str`
+    @param ids: if `None`, then any `id`
+    @type ids: `set` of `str`
+    @rtype: `tuple` or `None`
+    """
+    name, _, _ = line.partition(',')
+    if ids is not None and name not in ids:
+        return None
+    if line.count(',') != 4:
+        return None
+    name, x, y, w, h = _parse_bbox_string(line)
+    return name, _BBox(x, y, w, h)
+
+
+def _query_bounding_boxes_by_id(args, ids, size=0):
+    """Return bounding boxes of `ids` using `--query-id`.
+
+    The output contains four lines (x, y, width, height),
+    each with comma-separated values, one for each of `ids`.
+    Return `None` if the output does not have this form.
+
+    @type args: `list` of `str`
+    @type ids: `list` of `str`
+    @param size: bytes of input, see `inkscape.timeout_for`
+    @rtype: `dict` or `None`
+    """
+    rcode, out = inkscape.call(
+        args, size, _read_output,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True)
+    if rcode != 0:
+        return None
+    lines = [line for line in out.splitlines() if line.strip()]
+    if len(lines) != 4:
+        return None
+    try:
+        columns = [
+            [float(v) for v in line.split(',')]
+            for line in lines]
+    except ValueError:
+        return None
+    if any(len(c) != len(ids) for c in columns):
+        return None
+    return {
+        name: _BBox(x, y, w, h)
+        for name, x, y, w, h in zip(ids, *columns)}
+
+
 def which_inkscape():
     """Return absolute path to `inkscape`.
 
@@ -730,10 +1931,10 @@ def which_inkscape():
 
     In the future, using another approach for conversion (e.g., a future
     version of `cairosvg`) will make this function obsolete.
+
+    The result is cached, see `svglatex.inkscape.which_inkscape`.
     """
-    s = shutil.which('inkscape')
-    inkscape_abspath = os.path.realpath(s)
-    return inkscape_abspath
+    return inkscape.which_inkscape()
 
 
 def _parse_bbox_string(line):
@@ -751,15 +1952,11 @@ def _parse_bbox_string(line):
 def _corners(d):
     """Return corner coordinates.
 
-    @param d: `dict` with keys
-        `'x', 'y', 'w', 'h'`
+    @type d: `_BBox`
     @return: quadruple
     @rtype: `tuple`
     """
-    x = d['x']
-    y = d['y']
-    w = d['w']
-    h = d['h']
+    x, y, w, h = d
     xmax = x + w
     ymax = y + h
     return x, xmax, y, ymax
@@ -821,6 +2018,17 @@ class _AffineTransform(object):
         yy = self.t[1] + self.m[1] * x + self.m[3] * y
         return (xx, yy)
 
+    def inverse(self):
+        """Return inverse transformation."""
+        a, b, c, d = self.m
+        e, f = self.t
+        det = a * d - b * c
+        m = (d / det, - b / det, - c / det, a / det)
+        t = (
+            - (m[0] * e + m[2] * f),
+            - (m[1] * e + m[3] * f))
+        return _AffineTransform(t, m)
+
     def __str__(self):
         """Return `str` representation."""
         return '[{},{},{}  ;  {},{},{}]'.format(
@@ -869,18 +2077,18 @@ class _TeXLabel(object):
         self.fontstyle = _STYLE_NORMAL
         self.scale = 1.0
 
-    def texcode(self):
-        """Return LaTeX code."""
-        color = self._color_tex()
-        font = '\\' + self.fontfamily + 'family'
-        font += self._font_weight_tex()
-        font += self._font_style_tex()
-        font += self._font_size_tex()
-        align = self._alignment_tex()
+    def texcode(self, macro=None):
+        """Return LaTeX code.
+
+        @param macro: if not `None`, then a macro that takes the
+            text as argument, and is defined by `style_tex`
+        @type macro: `str`
+        """
         text = self._text()
-        texcode = (
-            font + color + align +
-            r'{\smash{' + text + '}}')
+        if macro is None:
+            texcode = self.style_tex() + r'{\smash{' + text + '}}'
+        else:
+            texcode = macro + '{' + text + '}'
         if self.angle != 0.0:
             texcode = (
                 '\\rotatebox{{{angle}}}{{{texcode}}}'
@@ -889,6 +2097,16 @@ class _TeXLabel(object):
                     texcode=texcode)
         return texcode
 
+    def style_tex(self):
+        """Return LaTeX code for font, color, and alignment."""
+        color = self._color_tex()
+        font = '\\' + self.fontfamily + 'family'
+        font += self._font_weight_tex()
+        font += self._font_style_tex()
+        font += self._font_size_tex()
+        align = self._alignment_tex()
+        return font + color + align
+
     def _color_tex(self):
         """Return LaTeX code for text color."""
         r, g, b = self.color
@@ -946,16 +2164,30 @@ class _TeXPicture(object):
 
     def __init__(
             self, svg_bbox, pdf_bbox,
-            fname=None, labels=None):
+            fname=None, labels=None, compact=False, frame=False):
         self.svg_bbox = svg_bbox
         self.pdf_bbox = pdf_bbox
         self.background_graphics = fname
         if labels is None:
             labels = list()
         self.labels = labels
+        self.compact = compact
+        self.frame = frame
 
     def dumps(self):
-        """Return `str` representation."""
+        """Return `str` representation.
+
+        Labels are written in document order, and numbers are
+        rounded, so the result is the same for the same input.
+
+        If `self.compact`, then a macro is defined for each
+        distinct style of labels (see `_TeXLabel.style_tex`), local
+        to the picture, and each label calls the macro of its style.
+        TeX then reads each style once, instead of once per label.
+
+        If `self.frame`, then a frame is drawn around the picture
+        (in draft mode, where there is no graphics file).
+        """
         unit = self.svg_bbox.width
         xmin = self.svg_bbox.x
         ymin = self.svg_bbox.y
@@ -968,7 +2200,7 @@ class _TeXPicture(object):
             # whereas the `picture` origin is at the lower left corner
             y = (h + ymin) - (self.pdf_bbox.height + self.pdf_bbox.y)
             x, y = _round(x, y, unit=unit)
-            scale = self.pdf_bbox.width / unit
+            scale, = _round(self.pdf_bbox.width, unit=unit, digits=6)
             s = (
                 '\\put({x}, {y}){{'
                 '\\includegraphics[width={scale}\\unitlength]{{{img}}}'
@@ -977,21 +2209,37 @@ class _TeXPicture(object):
                     x=x, y=y,
                     img=self.background_graphics)
             c.append(s)
+        if self.frame:
+            fw, fh = _round(w, h, unit=unit)
+            c.append('\\put(0, 0){{\\framebox({w}, {h}){{}}}}%'.format(
+                w=fw, h=fh))
+        # maps style code to macro name
+        macros = collections.OrderedDict()
         for label in self.labels:
             x, y = label.pos
             # y=0 top in SVG, bottom in `\picture`
             x = x - xmin
             y = (h + ymin) - y
             x, y = _round(x, y, unit=unit)
+            if self.compact:
+                style = label.style_tex()
+                if style not in macros:
+                    macros[style] = _style_macro(len(macros))
+                text = label.texcode(macros[style])
+            else:
+                text = label.texcode()
             s = '\\put({x}, {y}){{{text}}}%'.format(
-                x=x, y=y,
-                text=label.texcode())
+                x=x, y=y, text=text)
             c.append(s)
+        defs = ''.join(
+            '\\def{macro}#1{{{style}{{\\smash{{#1}}}}}}%\n'.format(
+                macro=macro, style=style)
+            for style, macro in macros.items())
         width, height = _round(w, h, unit=unit)
         assert width == 1, width
         s = (
             '\\begingroup%\n' +
-            _PICTURE_PREAMBLE +
+            _PICTURE_PREAMBLE + defs +
             ('\\begin{{picture}}'
              '({width}, {height})%\n').format(
                 width=width,
@@ -1006,9 +2254,30 @@ class _TeXPicture(object):
         self.labels.append(label)
 
 
-def _round(*args, unit=1):
-    """Return `args` normalized by `unit` and rounded."""
-    return tuple(round(x / unit, 3) for x in args)
+def _style_macro(i):
+    """Return name of macro for the `i`-th style of labels.
+
+    The names are `\svglatexA`, ..., `\svglatexZ`, `\svglatexAA`, ...,
+    because names of TeX macros contain only letters.
+
+    @type i: `int`
+    @rtype: `str`
+    """
+    letters = ''
+    i += 1
+    while i > 0:
+        i, r = divmod(i - 1, 26)
+        letters = chr(ord('A') + r) + letters
+    return '\\svglatex' + letters
+
+
+def _round(*args, unit=1, digits=3):
+    """Return `args` normalized by `unit` and rounded.
+
+    Negative zero is replaced by zero, so that the
+    formatted numbers do not depend on rounding errors.
+    """
+    return tuple(round(x / unit, digits) + 0.0 for x in args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+"""Convert Graphviz DOT files to SVG, caching the results.
+
+The SVG files are stored in the cache directory, named by a digest of
+the DOT file contents and of the `dot` executable (path and
+modification time). So `dot` runs again only if the DOT file changed,
+or Graphviz was updated.
+
+Relative references to images (the attribute `image` of nodes) are
+made absolute, based on the directory of the DOT file, before the SVG
+is cached. So the digest includes that directory too.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import hashlib
+import os
+import shutil
+import subprocess
+import urllib.parse
+
+import lxml.etree as etree
+
+from svglatex import cache
+from svglatex import lock
+
+
+DOT_EXT = '.dot'
+# change to discard the cached SVG files
+_VERSION = '2'
+_SVG_IMAGE = '{http://www.w3.org/2000/svg}image'
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+# `dot` path for each value of `$PATH`
+_which = dict()
+
+
+def which_dot():
+    """Return absolute path to `dot` of Graphviz.
+
+    Assume that `dot` is in the `$PATH`.
+
+    @rtype: `str`
+    """
+    key = os.environ.get('PATH')
+    path = _which.get(key)
+    if path is not None:
+        return path
+    s = shutil.which('dot')
+    if s is None:
+        raise FileNotFoundError('`dot` (Graphviz) not found in `$PATH`')
+    path = os.path.realpath(s)
+    _which[key] = path
+    return path
+
+
+def cached_svg_path(dot_file):
+    """Return path of cached SVG file for DOT file `dot_file`.
+
+    @type dot_file: `str`
+    @rtype: `str`
+    """
+    dot = which_dot()
+    base = os.path.dirname(os.path.realpath(dot_file))
+    h = hashlib.sha256()
+    h.update('{v}:{path}:{mtime}:{base}\n'.format(
+        v=_VERSION, path=dot, mtime=os.stat(dot).st_mtime_ns,
+        base=base).encode('utf-8'))
+    with open(dot_file, 'rb') as f:
+        h.update(f.read())
+    fname = '{h}.svg'.format(h=h.hexdigest())
+    return os.path.join(cache.cache_dir('dot'), fname)
+
+
+def to_svg(dot_file):
+    """Return path to SVG file made from DOT file `dot_file`.
+
+    `dot` runs only if the SVG is not already cached.
+    It runs in the directory of `dot_file`, so that `dot`
+    finds files referenced by relative paths in `dot_file`.
+    The SVG is stored elsewhere, so relative references to
+    images in the SVG are made absolute before it is cached
+    (see `_absolute_image_paths`).
+
+    @type dot_file: `str`
+    @rtype: `str`
+    """
+    svg = cached_svg_path(dot_file)
+    if os.path.isfile(svg):
+        return svg
+    with lock.locked(svg):
+        if os.path.isfile(svg):
+            return svg
+        dot_path = os.path.realpath(dot_file)
+        with cache.replacing(svg) as tmp:
+            args = [which_dot(), '-Tsvg', '-o', tmp, dot_path]
+            base = os.path.dirname(dot_path)
+            r = subprocess.call(args, cwd=base)
+            if r != 0:
+                raise Exception((
+                    '`dot` conversion of "{f}" to SVG failed '
+                    'with return code {r}').format(f=dot_file, r=r))
+            _absolute_image_paths(tmp, base)
+    return svg
+
+
+def _absolute_image_paths(svg, base):
+    """Make relative paths of images in `svg` absolute.
+
+    Relative paths are joined to the directory `base`.
+    URLs (for example `data:` or `file:`) and fragments
+    (`#name`) are left unchanged. The file `svg` is
+    written only if some path changed.
+
+    @param svg: path of SVG file
+    @type svg: `str`
+    @type base: `str`
+    """
+    doc = etree.parse(svg)
+    changed = False
+    for image in doc.iter(_SVG_IMAGE):
+        for attr in (_XLINK_HREF, 'href'):
+            ref = image.attrib.get(attr)
+            if ref is None or not _is_relative_path(ref):
+                continue
+            image.attrib[attr] = os.path.join(base, ref)
+            changed = True
+    if changed:
+        doc.write(svg, encoding='UTF-8', xml_declaration=True)
+
+
+def _is_relative_path(ref):
+    """Return `True` if `ref` is a relative file path.
+
+    @type ref: `str`
+    @rtype: `bool`
+    """
+    if not ref or ref.startswith('#') or os.path.isabs(ref):
+        return False
+    return not urllib.parse.urlsplit(ref).scheme
@@ -0,0 +1,335 @@
+"""Metrics of fonts, for estimating the extents of text.
+
+Font files are found with `fc-match` (fontconfig), and read in pure
+Python. TrueType and OpenType files (`.ttf`, `.otf`, `.ttc`) are read
+from their `cmap`, `hmtx`, and (where present) `glyf` tables. Type 1
+fonts are read from the Adobe Font Metrics (`.afm`) file next to them.
+
+The extents are conservative: they contain the outlines of the glyphs,
+as Inkscape draws them, with a margin. Where metrics are missing (no
+`fc-match`, a font not installed, characters not in the font), `None`
+is returned, and callers query Inkscape instead.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import functools
+import os
+import shutil
+import struct
+import subprocess
+
+
+# margin around extents, as fraction of the font size
+MARGIN = 0.02
+_FC_MATCH_TIMEOUT = 10  # seconds
+_SFNT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+_TYPE1_EXTENSIONS = ('.pfb', '.pfa', '.t1')
+# `(xmin, ymin, xmax, ymax)`, with y upwards, in font units
+Box = collections.namedtuple('Box', ['xmin', 'ymin', 'xmax', 'ymax'])
+
+
+class Font(object):
+    """Metrics of a font.
+
+    @ivar units_per_em: font units in one em
+    @ivar advances: `dict` that maps characters to advance widths
+    @ivar boxes: `dict` that maps characters to `Box`,
+        or to `None` for characters without outline
+    @ivar bbox: `Box` that contains all glyphs
+    """
+
+    def __init__(self, units_per_em, advances, boxes, bbox):
+        self.units_per_em = units_per_em
+        self.advances = advances
+        self.boxes = boxes
+        self.bbox = bbox
+
+    def extent(self, text, size, spacing=0.0):
+        """Return extent of `text` typeset at `size`.
+
+        The origin is at the start of the baseline, and y points
+        down, as in SVG. A margin `MARGIN * size` is added.
+        Kerning is ignored, which places glyphs after a negative
+        kerning pair further right, so the extent still contains them.
+        Return `None` if a character of `text` is not in the font.
+
+        @type text: `str`
+        @param size: font size, in SVG user units
+        @param spacing: added after each character (`letter-spacing`)
+        @return: `(xmin, ymin, xmax, ymax)`, or `None`
+        @rtype: `tuple`
+        """
+        scale = size / self.units_per_em
+        x = 0.0
+        xs = list()
+        ys = list()
+        for char in text:
+            if char not in self.advances:
+                return None
+            box = self.boxes.get(char)
+            if box is not None:
+                xs.extend([x + box.xmin * scale, x + box.xmax * scale])
+                ys.extend([- box.ymax * scale, - box.ymin * scale])
+            x += self.advances[char] * scale + spacing
+        if not xs:
+            return None
+        margin = MARGIN * size
+        return (
+            min(xs) - margin, min(ys) - margin,
+            max(xs) + margin, max(ys) + margin)
+
+    def advance(self, text, size, spacing=0.0):
+        """Return advance width of `text` typeset at `size`.
+
+        Kerning is ignored, so the result can differ from the
+        width that Inkscape uses for anchoring text (usually it
+        is larger). Return `None` if a character is not in the font.
+
+        @type text: `str`
+        @rtype: `float` or `None`
+        """
+        if any(char not in self.advances for char in text):
+            return None
+        scale = size / self.units_per_em
+        return sum(
+            self.advances[char] * scale + spacing
+            for char in text)
+
+
+def find_font(family, bold=False, italic=False):
+    """Return `Font` of `family` installed locally, or `None`.
+
+    @type family: `str`
+    @type bold: `bool`
+    @type italic: `bool`
+    @rtype: `Font` or `None`
+    """
+    path = find_font_file(family, bold, italic)
+    if path is None:
+        return None
+    try:
+        return load(path)
+    except (OSError, ValueError, KeyError, IndexError, struct.error):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def find_font_file(family, bold=False, italic=False):
+    """Return path to the file of `family`, using `fc-match`.
+
+    Return `None` if `fc-match` is not installed, or if it
+    substitutes another family for `family`.
+
+    @rtype: `str` or `None`
+    """
+    fc_match = shutil.which('fc-match')
+    if fc_match is None:
+        return None
+    pattern = family
+    if bold:
+        pattern += ':bold'
+    if italic:
+        pattern += ':italic'
+    try:
+        r = subprocess.run(
+            [fc_match, '--format=%{family}\n%{file}', pattern],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            timeout=_FC_MATCH_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = r.stdout.splitlines()
+    if r.returncode != 0 or len(lines) != 2:
+        return None
+    families, path = lines
+    names = {s.strip().lower() for s in families.split(',')}
+    if family.lower() not in names:
+        return None
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def load(path):
+    """Return `Font` read from file `path`.
+
+    @param path: TrueType, OpenType, or Type 1 font file,
+        or AFM file
+    @rtype: `Font`
+    """
+    base, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext in _SFNT_EXTENSIONS:
+        with open(path, 'rb') as f:
+            return _read_sfnt(f.read())
+    if ext in _TYPE1_EXTENSIONS:
+        path = base + '.afm'
+        ext = '.afm'
+    if ext == '.afm':
+        with open(path, 'r', encoding='latin-1') as f:
+            return _read_afm(f.read())
+    raise ValueError('unsupported font file "{p}"'.format(p=path))
+
+
+def _read_sfnt(data):
+    """Return `Font` from TrueType or OpenType `data`."""
+    offset = 0
+    if data[:4] == b'ttcf':
+        # first font of collection
+        offset, = struct.unpack_from('>I', data, 12)
+    num_tables, = struct.unpack_from('>H', data, offset + 4)
+    tables = dict()
+    for i in range(num_tables):
+        tag, _, start, length = struct.unpack_from(
+            '>4sIII', data, offset + 12 + 16 * i)
+        tables[tag.decode('latin-1')] = (start, length)
+    head = tables['head'][0]
+    units_per_em, = struct.unpack_from('>H', data, head + 18)
+    bbox = Box(*struct.unpack_from('>4h', data, head + 36))
+    loca_format, = struct.unpack_from('>h', data, head + 50)
+    num_glyphs, = struct.unpack_from('>H', data, tables['maxp'][0] + 4)
+    num_metrics, = struct.unpack_from('>H', data, tables['hhea'][0] + 34)
+    hmtx = tables['hmtx'][0]
+    metrics = [
+        struct.unpack_from('>Hh', data, hmtx + 4 * i)
+        for i in range(num_metrics)]
+    lsbs = struct.unpack_from(
+        '>{n}h'.format(n=num_glyphs - num_metrics),
+        data, hmtx + 4 * num_metrics)
+    last = metrics[-1][0]
+    metrics.extend((last, lsb) for lsb in lsbs)
+    cmap = _read_cmap(data, tables['cmap'][0])
+    if 'glyf' in tables:
+        glyph_box = _glyf_boxes(data, tables, loca_format, num_glyphs)
+    else:
+        # CFF outlines: left side bearing is the left of the
+        # outline, else the bounding box of the font
+        def glyph_box(glyph):
+            return Box(metrics[glyph][1], bbox.ymin, bbox.xmax, bbox.ymax)
+    advances = dict()
+    boxes = dict()
+    for char, glyph in cmap.items():
+        if glyph == 0 or glyph >= num_glyphs:
+            continue
+        advances[char] = metrics[glyph][0]
+        boxes[char] = glyph_box(glyph)
+    return Font(units_per_em, advances, boxes, bbox)
+
+
+def _glyf_boxes(data, tables, loca_format, num_glyphs):
+    """Return function that maps glyph index to `Box` from `glyf`."""
+    loca = tables['loca'][0]
+    glyf = tables['glyf'][0]
+    if loca_format == 0:
+        offsets = [
+            2 * x for x in struct.unpack_from(
+                '>{n}H'.format(n=num_glyphs + 1), data, loca)]
+    else:
+        offsets = struct.unpack_from(
+            '>{n}I'.format(n=num_glyphs + 1), data, loca)
+
+    def glyph_box(glyph):
+        start = offsets[glyph]
+        if offsets[glyph + 1] == start:
+            return None  # no outline, for example space
+        return Box(*struct.unpack_from('>4h', data, glyf + start + 2))
+    return glyph_box
+
+
+def _read_cmap(data, cmap):
+    """Return `dict` that maps characters to glyph indices.
+
+    The Unicode subtables of formats 4 and 12 are read.
+    """
+    num_subtables, = struct.unpack_from('>H', data, cmap + 2)
+    found = dict()
+    for i in range(num_subtables):
+        platform, encoding, offset = struct.unpack_from(
+            '>HHI', data, cmap + 4 + 8 * i)
+        unicode = platform == 0 or (platform == 3 and encoding in (1, 10))
+        if not unicode:
+            continue
+        start = cmap + offset
+        fmt, = struct.unpack_from('>H', data, start)
+        if fmt in (4, 12) and fmt not in found:
+            found[fmt] = start
+    if 12 in found:
+        return _read_cmap_12(data, found[12])
+    if 4 in found:
+        return _read_cmap_4(data, found[4])
+    raise ValueError('no Unicode `cmap` subtable')
+
+
+def _read_cmap_4(data, start):
+    """Return mapping from `cmap` subtable of format 4."""
+    seg_count = struct.unpack_from('>H', data, start + 6)[0] // 2
+    ends = struct.unpack_from('>{n}H'.format(n=seg_count), data, start + 14)
+    p = start + 16 + 2 * seg_count
+    starts = struct.unpack_from('>{n}H'.format(n=seg_count), data, p)
+    p += 2 * seg_count
+    deltas = struct.unpack_from('>{n}h'.format(n=seg_count), data, p)
+    p += 2 * seg_count
+    range_offsets = struct.unpack_from('>{n}H'.format(n=seg_count), data, p)
+    mapping = dict()
+    for i in range(seg_count):
+        for code in range(starts[i], ends[i] + 1):
+            if code == 0xFFFF:
+                continue
+            if range_offsets[i] == 0:
+                glyph = (code + deltas[i]) & 0xFFFF
+            else:
+                q = (
+                    p + 2 * i + range_offsets[i] +
+                    2 * (code - starts[i]))
+                glyph, = struct.unpack_from('>H', data, q)
+                if glyph != 0:
+                    glyph = (glyph + deltas[i]) & 0xFFFF
+            mapping[chr(code)] = glyph
+    return mapping
+
+
+def _read_cmap_12(data, start):
+    """Return mapping from `cmap` subtable of format 12."""
+    num_groups, = struct.unpack_from('>I', data, start + 12)
+    mapping = dict()
+    for i in range(num_groups):
+        first, last, glyph = struct.unpack_from(
+            '>III', data, start + 16 + 12 * i)
+        for code in range(first, last + 1):
+            mapping[chr(code)] = glyph + code - first
+    return mapping
+
+
+def _read_afm(text):
+    """Return `Font` from Adobe Font Metrics `text`.
+
+    Characters are mapped by their code, for printable ASCII,
+    where the standard encoding agrees with ASCII.
+    """
+    advances = dict()
+    boxes = dict()
+    bbox = None
+    for line in text.splitlines():
+        if line.startswith('FontBBox'):
+            bbox = Box(*(float(x) for x in line.split()[1:5]))
+            continue
+        if not line.startswith('C '):
+            continue
+        fields = dict()
+        for item in line.split(';'):
+            parts = item.split()
+            if parts:
+                fields[parts[0]] = parts[1:]
+        code = int(fields['C'][0])
+        if not 32 <= code < 127 or chr(code) in '`\'':
+            # differ between the standard encoding and ASCII
+            continue
+        char = chr(code)
+        advances[char] = float(fields['WX'][0])
+        b = Box(*(float(x) for x in fields['B'][:4]))
+        boxes[char] = None if b == (0, 0, 0, 0) else b
+    if bbox is None:
+        raise ValueError('no `FontBBox` in AFM')
+    return Font(1000, advances, boxes, bbox)
@@ -0,0 +1,90 @@
+"""Output formats that figures are converted to.
+
+An export method is a comma-separated list of targets,
+for example `latex-pdf,png@150dpi,eps`. The targets are:
+
+- `latex-pdf`: PDF of the graphics, and `.pdf_tex` with the text
+- `pdf`: PDF of the whole figure
+- `eps`: EPS of the whole figure
+- `png@Ndpi`: PNG of the whole figure, at `N` dots per inch
+  (`png` alone is at 96 dpi)
+
+All targets of a method are made from one parse of the SVG,
+see `svglatex.converter.convert_targets`.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import os
+import re
+
+
+Target = collections.namedtuple('Target', ['method', 'dpi'])
+METHODS = ('latex-pdf', 'pdf', 'eps', 'png')
+_EXTENSIONS = {
+    'latex-pdf': ('.pdf', '.pdf_tex'),
+    'pdf': ('.pdf',),
+    'eps': ('.eps',),
+    'png': ('.png',)}
+_DEFAULT_DPI = 96.0
+_RX_TARGET = re.compile(
+    r'^(?P<method>[a-z-]+)(?:@(?P<dpi>\d+(?:\.\d*)?)(?:dpi)?)?$')
+
+
+def parse_targets(method):
+    """Return `list` of `Target` from export method `method`.
+
+    @type method: `str`
+    @rtype: `list` of `Target`
+    @raise ValueError: if `method` is not a list of targets,
+        or two targets write the same file
+    """
+    targets = list()
+    extensions = set()
+    for s in method.split(','):
+        m = _RX_TARGET.match(s.strip())
+        if m is None or m.group('method') not in METHODS:
+            raise ValueError(
+                'unknown export target "{s}", expected one of: '
+                '{m}'.format(s=s, m=', '.join(METHODS)))
+        name = m.group('method')
+        dpi = m.group('dpi')
+        if dpi is not None and name != 'png':
+            raise ValueError(
+                'resolution applies only to `png`, '
+                'not to "{s}"'.format(s=s))
+        if name == 'png':
+            dpi = _DEFAULT_DPI if dpi is None else float(dpi)
+        exts = _EXTENSIONS[name]
+        if extensions.intersection(exts):
+            raise ValueError(
+                'export targets of "{m}" write the '
+                'same file'.format(m=method))
+        extensions.update(exts)
+        targets.append(Target(name, dpi))
+    return targets
+
+
+def target_outputs(base, target):
+    """Return files that `target` writes, for outputs named `base`.
+
+    @param base: path without extension
+    @type target: `Target`
+    @rtype: `list` of `str`
+    """
+    return [base + ext for ext in _EXTENSIONS[target.method]]
+
+
+def outputs(source, method):
+    """Return files written by converting `source` with `method`.
+
+    @param source: path to SVG (or DOT) file
+    @type method: `str`
+    @rtype: `list` of `str`
+    """
+    base = os.path.splitext(source)[0]
+    outs = list()
+    for target in parse_targets(method):
+        outs.extend(target_outputs(base, target))
+    return outs
@@ -0,0 +1,181 @@
+"""History of conversions, stored in an SQLite database.
+
+Each conversion records its wall time, the CPU time and peak resident
+set size of the `inkscape` processes it ran, and its result. Batch
+builds use the history to estimate the duration and memory of each
+conversion, in order to schedule the longest conversions first, and
+within a memory budget.
+
+Only the most recent conversions of each figure are kept. Results are
+also counted for each figure, and checks that found a figure up to
+date are only counted, so the history does not grow with the number
+of LaTeX runs and builds.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import logging
+import os
+import sqlite3
+import time
+
+from svglatex import cache
+
+
+log = logging.getLogger(__name__)
+HISTORY_FILE = 'history.sqlite3'
+# results of conversions
+FRESH = 'fresh'
+CONVERTED = 'converted'
+FAILED = 'failed'
+# number of recent conversions kept, and used for estimates
+_WINDOW = 5
+_TIMEOUT = 30  # seconds to wait for other writers
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversions (
+    path TEXT NOT NULL,
+    method TEXT NOT NULL,
+    time REAL NOT NULL,
+    result TEXT NOT NULL,
+    wall REAL NOT NULL,
+    cpu REAL NOT NULL,
+    rss INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS conversions_path
+    ON conversions (path, method);
+CREATE TABLE IF NOT EXISTS counts (
+    path TEXT NOT NULL,
+    method TEXT NOT NULL,
+    result TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (path, method, result));
+'''
+
+
+Estimate = collections.namedtuple('Estimate', ['wall', 'rss'])
+Stats = collections.namedtuple(
+    'Stats', ['fresh', 'converted', 'failed', 'slowest'])
+Figure = collections.namedtuple(
+    'Figure', ['path', 'method', 'wall', 'cpu', 'rss', 'count'])
+
+
+def _connect():
+    """Return connection to the history database."""
+    fname = os.path.join(cache.cache_dir(), HISTORY_FILE)
+    con = sqlite3.connect(fname, timeout=_TIMEOUT)
+    con.executescript(_SCHEMA)
+    return con
+
+
+def record(path, method, result, wall, cpu=0.0, rss=0):
+    """Append a conversion to the history, and count its result.
+
+    Results `FRESH` are only counted. Of other results, the
+    `_WINDOW` most recent with each result are kept.
+    Failing to write the history is logged, not raised,
+    because the history is not needed for converting.
+
+    @param path: SVG file
+    @type method: `str`
+    @param result: `FRESH`, `CONVERTED`, or `FAILED`
+    @param wall: wall time, in seconds
+    @param cpu: CPU time of child processes, in seconds
+    @param rss: peak resident set size of child processes, in bytes
+    """
+    path = os.path.abspath(path)
+    key = (path, method, result)
+    try:
+        con = _connect()
+        with con:
+            con.execute(
+                'INSERT OR IGNORE INTO counts VALUES (?, ?, ?, 0)', key)
+            con.execute(
+                'UPDATE counts SET count = count + 1 '
+                'WHERE path = ? AND method = ? AND result = ?', key)
+            if result != FRESH:
+                con.execute(
+                    'INSERT INTO conversions '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (path, method, time.time(), result, wall, cpu, rss))
+                _prune(con, path, method, result)
+        con.close()
+    except sqlite3.Error as e:
+        log.warning('Cannot record conversion history: {e}'.format(e=e))
+
+
+def _prune(con, path, method, result):
+    """Remove all but the `_WINDOW` latest conversions with `result`."""
+    key = (path, method, result)
+    con.execute(
+        'DELETE FROM conversions '
+        'WHERE path = ? AND method = ? AND result = ? '
+        'AND rowid NOT IN ('
+        'SELECT rowid FROM conversions '
+        'WHERE path = ? AND method = ? AND result = ? '
+        'ORDER BY time DESC LIMIT ?)',
+        key + key + (_WINDOW,))
+
+
+def estimates(paths, method):
+    """Return estimated wall time and memory of converting `paths`.
+
+    The estimate for each file is the mean wall time, and the
+    maximum peak memory, of its most recent conversions.
+    Files never converted are absent from the result.
+
+    @type paths: iterable of `str`
+    @type method: `str`
+    @return: `dict` that maps paths to `Estimate`
+    """
+    est = dict()
+    try:
+        con = _connect()
+    except sqlite3.Error:
+        return est
+    with con:
+        for path in paths:
+            rows = con.execute(
+                'SELECT wall, rss FROM conversions '
+                'WHERE path = ? AND method = ? AND result = ? '
+                'ORDER BY time DESC LIMIT ?',
+                (os.path.abspath(path), method, CONVERTED,
+                 _WINDOW)).fetchall()
+            if not rows:
+                continue
+            wall = sum(r[0] for r in rows) / len(rows)
+            rss = max(r[1] for r in rows)
+            est[path] = Estimate(wall=wall, rss=rss)
+    con.close()
+    return est
+
+
+def stats(limit=10):
+    """Return counts of results, and slowest figures.
+
+    The times and memory of figures are of their recent conversions,
+    and the count of each figure is of all its conversions.
+
+    @param limit: number of slowest figures to return
+    @rtype: `Stats`
+    """
+    con = _connect()
+    with con:
+        counts = dict(con.execute(
+            'SELECT result, SUM(count) FROM counts '
+            'GROUP BY result').fetchall())
+        rows = con.execute(
+            'SELECT c.path, c.method, AVG(c.wall), AVG(c.cpu), '
+            'MAX(c.rss), COALESCE(MAX(n.count), COUNT(*)) '
+            'FROM conversions AS c LEFT JOIN counts AS n '
+            'ON n.path = c.path AND n.method = c.method '
+            'AND n.result = c.result '
+            'WHERE c.result = ? '
+            'GROUP BY c.path, c.method ORDER BY AVG(c.wall) DESC LIMIT ?',
+            (CONVERTED, limit)).fetchall()
+    con.close()
+    slowest = [Figure(*row) for row in rows]
+    return Stats(
+        fresh=counts.get(FRESH, 0),
+        converted=counts.get(CONVERTED, 0),
+        failed=counts.get(FAILED, 0),
+        slowest=slowest)
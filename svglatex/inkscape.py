@@ -0,0 +1,621 @@
+"""Locate `inkscape`, probe its capabilities, and run it.
+
+The command-line interface of Inkscape changed between versions:
+
+- Inkscape 0.92 uses `--without-gui`, `--export-pdf`, `--file`.
+- Inkscape 1.x uses `--export-filename`, `--export-type`,
+  and the file name as positional argument. Inkscape >= 1.2 can
+  also run queries and exports in one process, using `--actions`.
+
+Which flags the installed `inkscape` supports is found by running
+`inkscape --version`, `--help`, and `--action-list` once. The result
+is cached on disk, keyed by the path and modification time of the
+executable, so the probe runs once per installed binary.
+
+Each `inkscape` process runs in a process group of its own, under a
+watchdog (see `call`). A process that runs longer than a timeout
+(which grows with the size of the input) is killed, together with any
+processes that it started, and is started again, after a delay, with
+a longer timeout. The base timeout in seconds is read from the
+environment variable `$SVGLATEX_TIMEOUT` (`0` turns the watchdog off),
+and the number of retries from `$SVGLATEX_RETRIES`. Processes that are
+still running when `svglatex` is interrupted are killed too (see
+`kill_all`). Processes started for one conversion can be killed
+without affecting other threads, see `Group`.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from svglatex import cache
+
+
+log = logging.getLogger(__name__)
+# invocation strategies, fastest first
+STRATEGY_ACTIONS = 'actions'
+STRATEGY_EXPORT_FILENAME = 'export-filename'
+STRATEGY_LEGACY = 'legacy'
+_ACTIONS_NEEDED = {
+    'query-all', 'export-filename', 'export-type',
+    'export-area-drawing', 'export-ignore-filters',
+    'export-dpi', 'export-do'}
+_PROBE_CACHE_FILE = 'probe.json'
+_PROBE_TIMEOUT = 120  # seconds
+TIMEOUT_ENV = 'SVGLATEX_TIMEOUT'
+RETRIES_ENV = 'SVGLATEX_RETRIES'
+_TIMEOUT = 120.0  # seconds, for any input
+_TIMEOUT_PER_MB = 60.0  # seconds, per MB of input
+_RETRIES = 1
+_BACKOFF = 2.0  # seconds, before the first retry
+_POSIX = os.name == 'posix'
+_RX_VERSION = re.compile(r'Inkscape\s+(\d+)\.(\d+)(?:\.(\d+))?')
+_RX_OPTION = re.compile(r'(?<![\w-])(--[a-z][a-z0-9-]*)')
+_RX_ACTION = re.compile(r'^([a-z][\w.-]*)\s*:', re.MULTILINE)
+# `inkscape` path for each value of `$PATH`
+_which = dict()
+# probe results of this process, keyed as in the cache on disk
+_probed = dict()
+# resources used by `inkscape` processes waited by `wait`
+_usage = dict(cpu=0.0, rss=0)
+_usage_lock = threading.Lock()
+# `inkscape` processes started by `call`, and not yet waited
+_running = set()
+_running_lock = threading.Lock()
+# set by `kill_all`, to start no more processes
+_stopping = threading.Event()
+# `Group` of the current thread, see `joined`
+_local = threading.local()
+# `ru_maxrss` is in kilobytes on Linux, and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+Inkscape = collections.namedtuple(
+    'Inkscape', ['path', 'version', 'options', 'actions'])
+Usage = collections.namedtuple('Usage', ['cpu', 'rss'])
+
+
+class Timeout(Exception):
+    """An `inkscape` process ran longer than its timeout."""
+
+
+class Stopped(Exception):
+    """No `inkscape` processes start after `kill_all` or `Group.kill`."""
+
+
+class Group(object):
+    """`inkscape` processes started by threads that joined the group.
+
+    Killing a group kills only its processes, and no more
+    processes start in threads of the group, see `joined`.
+    """
+
+    def __init__(self):
+        self._procs = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def add(self, proc):
+        """Add `proc`, and return `False` if the group was killed."""
+        with self._lock:
+            self._procs.add(proc)
+            return not self._stopping
+
+    def discard(self, proc):
+        """Remove `proc`."""
+        with self._lock:
+            self._procs.discard(proc)
+
+    def is_killed(self):
+        """Return `True` if `kill` has been called."""
+        with self._lock:
+            return self._stopping
+
+    def kill(self):
+        """Kill the process groups of running processes of the group."""
+        with self._lock:
+            self._stopping = True
+            procs = list(self._procs)
+        for proc in procs:
+            _kill_group(proc)
+
+
+@contextlib.contextmanager
+def joined(group):
+    """Context manager in which the current thread belongs to `group`.
+
+    Processes started meanwhile by `running` in this thread
+    are added to `group`.
+
+    @type group: `Group`
+    """
+    previous = getattr(_local, 'group', None)
+    _local.group = group
+    try:
+        yield
+    finally:
+        _local.group = previous
+
+
+def which_inkscape():
+    """Return absolute path to `inkscape`.
+
+    Assume that `inkscape` is in the `$PATH`.
+    The result is remembered for each value of `$PATH`.
+
+    @rtype: `str`
+    """
+    key = os.environ.get('PATH')
+    path = _which.get(key)
+    if path is not None:
+        return path
+    s = shutil.which('inkscape')
+    if s is None:
+        raise FileNotFoundError('`inkscape` not found in `$PATH`')
+    path = os.path.realpath(s)
+    _which[key] = path
+    return path
+
+
+def probe(path=None):
+    """Return version and capabilities of `inkscape` at `path`.
+
+    @param path: absolute path to `inkscape`,
+        if `None`, then `which_inkscape()`
+    @rtype: `Inkscape`
+    """
+    if path is None:
+        path = which_inkscape()
+    key = '{path}:{mtime}'.format(
+        path=path, mtime=os.stat(path).st_mtime_ns)
+    ink = _probed.get(key)
+    if ink is not None:
+        return ink
+    fname = os.path.join(cache.cache_dir('inkscape'), _PROBE_CACHE_FILE)
+    entry = _load_probe_cache(fname).get(key)
+    if entry is None:
+        entry = _run_probe(path)
+        probes = _load_probe_cache(fname)
+        probes[key] = entry
+        cache.atomic_write(fname, json.dumps(probes, indent=4))
+    ink = Inkscape(
+        path=path,
+        version=tuple(entry['version']),
+        options=frozenset(entry['options']),
+        actions=frozenset(entry['actions']))
+    _probed[key] = ink
+    return ink
+
+
+def _load_probe_cache(fname):
+    """Return `dict` of probe results stored in file `fname`."""
+    try:
+        with open(fname, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _run_probe(path):
+    """Return `dict` with version, options, and actions of `inkscape`."""
+    out = _output([path, '--version'])
+    m = _RX_VERSION.search(out)
+    if m is None:
+        raise Exception(
+            'cannot find version of `{inkscape}` in: {out}'.format(
+                inkscape=path, out=out))
+    version = [int(x) for x in m.groups('0')]
+    out = _output([path, '--help'])
+    options = sorted(set(_RX_OPTION.findall(out)))
+    if '--action-list' in options:
+        out = _output([path, '--action-list'])
+        actions = sorted(set(_RX_ACTION.findall(out)))
+    else:
+        actions = list()
+    return dict(version=version, options=options, actions=actions)
+
+
+def _output(args):
+    """Return combined standard output and error of running `args`."""
+    r = subprocess.run(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        timeout=_PROBE_TIMEOUT)
+    return r.stdout
+
+
+def strategy(ink):
+    """Return fastest invocation strategy that `ink` supports.
+
+    @type ink: `Inkscape`
+    @rtype: `str`
+    """
+    if _ACTIONS_NEEDED.issubset(ink.actions):
+        return STRATEGY_ACTIONS
+    if '--export-filename' in ink.options:
+        return STRATEGY_EXPORT_FILENAME
+    return STRATEGY_LEGACY
+
+
+def query_all_args(ink, svg_path):
+    """Return arguments for querying all bounding boxes.
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @rtype: `list` of `str`
+    """
+    if strategy(ink) == STRATEGY_LEGACY:
+        return [
+            ink.path,
+            '--without-gui',
+            '--query-all',
+            '--file={s}'.format(s=svg_path)]
+    return [ink.path, '--query-all', svg_path]
+
+
+def query_ids_args(ink, svg_path, ids):
+    """Return arguments for querying the bounding boxes of `ids`.
+
+    Return `None` if `ink` cannot query several `ids` in one call
+    (Inkscape 0.92 queries one `id` per call).
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @type ids: `list` of `str`
+    @rtype: `list` of `str`, or `None`
+    """
+    if strategy(ink) == STRATEGY_LEGACY:
+        return None
+    if '--query-id' not in ink.options:
+        return None
+    if any(',' in name for name in ids):
+        return None
+    return [
+        ink.path,
+        '--query-id={ids}'.format(ids=','.join(ids)),
+        '--query-x',
+        '--query-y',
+        '--query-width',
+        '--query-height',
+        svg_path]
+
+
+def export_args(ink, svg_path, out_path, export_type, dpi):
+    """Return arguments for exporting the drawing area.
+
+    Filters are ignored (rasterized) for vector formats,
+    and rendered for `png`.
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @param out_path: absolute path to output file
+    @param export_type: `'pdf'`, `'eps'`, or `'png'`
+    @rtype: `list` of `str`
+    """
+    common = _export_options(export_type, dpi)
+    if strategy(ink) == STRATEGY_LEGACY:
+        return (
+            [ink.path, '--without-gui'] + common + [
+                '--export-{t}={path}'.format(t=export_type, path=out_path),
+                '--file={s}'.format(s=svg_path)])
+    return (
+        [ink.path] + common + [
+            '--export-type={t}'.format(t=export_type),
+            '--export-filename={path}'.format(path=out_path),
+            svg_path])
+
+
+def export_pipe_args(ink, export_type, dpi):
+    """Return arguments for exporting from `stdin` to `stdout`.
+
+    The SVG is read from standard input, and the output is
+    written to standard output, as in `export_args`.
+    Return `None` if `ink` does not support this.
+
+    @type ink: `Inkscape`
+    @param export_type: as for `export_args`
+    @rtype: `list` of `str`, or `None`
+    """
+    if not _can_pipe(ink):
+        return None
+    return (
+        [ink.path, '--pipe'] + _export_options(export_type, dpi) + [
+            '--export-type={t}'.format(t=export_type),
+            '--export-filename=-'])
+
+
+def query_all_pipe_args(ink):
+    """Return arguments for querying all bounding boxes of `stdin`.
+
+    Return `None` if `ink` does not support this.
+
+    @type ink: `Inkscape`
+    @rtype: `list` of `str`, or `None`
+    """
+    if not _can_pipe(ink):
+        return None
+    return [ink.path, '--pipe', '--query-all']
+
+
+def _can_pipe(ink):
+    """Return `True` if `ink` can read SVG from standard input."""
+    return (
+        strategy(ink) != STRATEGY_LEGACY and
+        '--pipe' in ink.options)
+
+
+def _export_options(export_type, dpi):
+    """Return options for exporting the drawing area, see `export_args`."""
+    options = ['--export-area-drawing']
+    if export_type != 'png':
+        options.append('--export-ignore-filters')
+    options.append('--export-dpi={dpi}'.format(dpi=dpi))
+    return options
+
+
+def export_pdf_args(ink, svg_path, pdf_path, dpi):
+    """Return arguments for exporting the drawing area to PDF.
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @param pdf_path: absolute path to PDF file
+    @rtype: `list` of `str`
+    """
+    return export_args(ink, svg_path, pdf_path, 'pdf', dpi)
+
+
+def query_and_export_args(ink, svg_path, exports, query=True):
+    """Return arguments for querying and exporting in one process.
+
+    Return `None` if `ink` does not support this, or if
+    a path cannot be passed inside `--actions`.
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @param exports: `list` of `(export_type, path, dpi)`,
+        with `export_type` and `path` as for `export_args`
+    @param query: if `True`, then query all bounding boxes
+        before exporting
+    @rtype: `list` of `str`, or `None`
+    """
+    if strategy(ink) != STRATEGY_ACTIONS:
+        return None
+    if any(';' in path for _, path, _ in exports):
+        return None
+    actions = ['query-all'] if query else list()
+    # export settings persist between `export-do`,
+    # so all are given for each export
+    for export_type, path, dpi in exports:
+        if export_type == 'png':
+            filters = 'export-ignore-filters:false'
+        else:
+            filters = 'export-ignore-filters'
+        actions.extend([
+            'export-filename:{path}'.format(path=path),
+            'export-type:{t}'.format(t=export_type),
+            'export-area-drawing',
+            filters,
+            'export-dpi:{dpi}'.format(dpi=dpi),
+            'export-do'])
+    return [
+        ink.path,
+        '--actions={a}'.format(a=';'.join(actions)),
+        svg_path]
+
+
+def query_and_export_pdf_args(ink, svg_path, pdf_path, dpi):
+    """Return arguments for querying and exporting PDF in one process.
+
+    See `query_and_export_args`.
+
+    @type ink: `Inkscape`
+    @param svg_path: absolute path to SVG file
+    @param pdf_path: absolute path to PDF file
+    @rtype: `list` of `str`, or `None`
+    """
+    return query_and_export_args(ink, svg_path, [('pdf', pdf_path, dpi)])
+
+
+def wait(proc):
+    """Wait for `proc` to exit, and account for its resource usage.
+
+    The CPU time (user and system, in seconds) and peak resident
+    set size (in bytes) of the child process are added to the
+    totals that `usage` returns. Where `os.wait4` is unavailable,
+    only waiting takes place.
+
+    @type proc: `subprocess.Popen`
+    @return: return code
+    @rtype: `int`
+    """
+    if not hasattr(os, 'wait4') or proc.returncode is not None:
+        return proc.wait()
+    while True:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            # already reaped
+            return proc.wait()
+    if os.WIFSIGNALED(status):
+        proc.returncode = - os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    with _usage_lock:
+        _usage['cpu'] += rusage.ru_utime + rusage.ru_stime
+        _usage['rss'] = max(_usage['rss'], rusage.ru_maxrss * _RSS_UNIT)
+    return proc.returncode
+
+
+def call(args, size, interact, **kw):
+    """Run `inkscape` with `args`, and return `interact(proc)`.
+
+    The process is started as for `running`, and `interact` is called
+    with it, and must wait for it (see `wait`). If the process times
+    out, then it is started again, up to `$SVGLATEX_RETRIES` times
+    (default: 1), each time after a delay twice as long as the
+    previous one, and with a timeout twice as long.
+
+    @type args: `list` of `str`
+    @param size: bytes of input, see `timeout_for`
+    @type size: `int`
+    @param interact: callable that takes a `subprocess.Popen`
+    @param kw: passed to `subprocess.Popen`
+    @raise Timeout: if the last attempt timed out
+    """
+    timeout = timeout_for(size)
+    retries = int(os.environ.get(RETRIES_ENV) or _RETRIES)
+    delay = _BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            with running(args, timeout, **kw) as proc:
+                return interact(proc)
+        except Timeout as e:
+            if attempt == retries:
+                log.error('{e}, giving up after {n} attempts.'.format(
+                    e=e, n=attempt + 1))
+                raise
+            log.warning('{e}, retrying in {d:0.0f} s.'.format(
+                e=e, d=delay))
+        time.sleep(delay)
+        delay *= 2
+        timeout *= 2
+
+
+def timeout_for(size):
+    """Return timeout in seconds for an input of `size` bytes.
+
+    The timeout is `$SVGLATEX_TIMEOUT` (default: 120 s), plus 60 s for
+    each megabyte of input. Return `None` if `$SVGLATEX_TIMEOUT` is `0`.
+
+    @type size: `int`
+    @rtype: `float` or `None`
+    """
+    s = os.environ.get(TIMEOUT_ENV)
+    base = _TIMEOUT if not s else float(s)
+    if base <= 0:
+        return None
+    return base + _TIMEOUT_PER_MB * size / 2**20
+
+
+@contextlib.contextmanager
+def running(args, timeout=None, **kw):
+    """Context manager that yields `inkscape` process run with `args`.
+
+    The process starts in a new session, so in a process group of
+    its own. If it is still running after `timeout` seconds, or when
+    the context exits with an exception (for example an interrupt),
+    then the whole process group is killed. The process should be
+    waited inside the context.
+
+    @type args: `list` of `str`
+    @param timeout: seconds, if `None`, then no timeout
+    @type timeout: `float`
+    @param kw: passed to `subprocess.Popen`
+    @raise Timeout: on exiting the context, if the timeout expired
+    @raise Stopped: if `kill_all` has been called, or `Group.kill`
+        of the group of the current thread (see `joined`)
+    """
+    if _POSIX:
+        kw['start_new_session'] = True
+    expired = threading.Event()
+    group = getattr(_local, 'group', None)
+    if _stopping.is_set() or (group is not None and group.is_killed()):
+        raise Stopped('`svglatex` is stopping')
+    with subprocess.Popen(args, **kw) as proc:
+        with _running_lock:
+            _running.add(proc)
+        killed = group is not None and not group.add(proc)
+        if _stopping.is_set() or killed:
+            # killed while starting
+            _kill_group(proc)
+        watchdog = None
+        if timeout is not None:
+            watchdog = threading.Timer(
+                timeout, _expire, args=(proc, expired))
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            yield proc
+        except BaseException:
+            _kill_group(proc)
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            with _running_lock:
+                _running.discard(proc)
+            if group is not None:
+                group.discard(proc)
+            if expired.is_set():
+                raise Timeout(
+                    '`{inkscape}` timed out after {t:0.0f} s'.format(
+                        inkscape=args[0], t=timeout))
+
+
+def _expire(proc, expired):
+    """Kill `proc` after it timed out, and set `expired`."""
+    with _running_lock:
+        if proc not in _running or proc.returncode is not None:
+            return
+        expired.set()
+    _kill_group(proc)
+
+
+def kill_all():
+    """Kill the process groups of all running `inkscape` processes.
+
+    This is for stopping the `svglatex` process (for example
+    from signal handlers): no more processes are started afterwards,
+    in any thread. To stop only some conversions, use `Group`.
+    """
+    with _running_lock:
+        _stopping.set()
+        procs = list(_running)
+    for proc in procs:
+        _kill_group(proc)
+
+
+def _kill_group(proc):
+    """Kill process group of `proc`, if `proc` is running."""
+    if proc.returncode is not None:
+        return
+    try:
+        if _POSIX:
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def usage():
+    """Return resources used by children waited since `reset_usage`.
+
+    @rtype: `Usage`
+    """
+    with _usage_lock:
+        return Usage(cpu=_usage['cpu'], rss=_usage['rss'])
+
+
+def reset_usage():
+    """Reset the totals that `usage` returns."""
+    with _usage_lock:
+        _usage['cpu'] = 0.0
+        _usage['rss'] = 0
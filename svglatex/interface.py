@@ -11,36 +11,77 @@ Requires `inkscape` in path.
 # All rights reserved. Licensed under BSD-2.
 #
 import argparse
+import collections
+import concurrent.futures
+import contextlib
 import datetime
 import fnmatch
 import logging
+import multiprocessing
 import os
 import shlex
-import subprocess
+import signal
+import sys
+import threading
 import time
 
 import humanize
 
+from svglatex import buildgen
+from svglatex import cache
+from svglatex import check
 from svglatex import converter
+from svglatex import dot
+from svglatex import formats
+from svglatex import history
+from svglatex import inkscape
+from svglatex import journal
+from svglatex import lock
+from svglatex import manifest
+from svglatex import pdf
+from svglatex import typeset
+from svglatex import vcs
 
 
 log = logging.getLogger(__name__)
+# seconds between checks that the parent of a worker is running
+_PARENT_POLL = 1.0
 
 
 def main():
     """Start from here."""
+    _install_signal_handlers()
     args = parse_args()
+    if args.command is not None:
+        args.func(args)
+        return
     f = '{name}.svg'.format(name=args.input_file)
+    f_dot = '{name}{ext}'.format(name=args.input_file, ext=dot.DOT_EXT)
     out_type = args.method
     if './img/' in f:
         files = [f]
+        if not os.path.isfile(f) and os.path.isfile(f_dot):
+            files = [f_dot]
     else:
-        files = locate(f, './img')
+        files = list(locate(f, './img'))
+        if not files:
+            files = locate(f_dot, './img')
     svg = None
     for svg in files:
         log.info('Will convert SVG file "{f}" to {t}'.format(
             f=svg, t=out_type))
-        convert_if_svg_newer(svg, out_type)
+        convert_if_svg_newer(
+            svg, out_type, args.optimize_pdf, args.deterministic,
+            processes=args.processes,
+            raster_dpi=args.rasterize_filters,
+            compact=args.compact_tex,
+            estimate_text=args.estimate_text,
+            draft=args.draft,
+            native_pdf=args.native_pdf,
+            simplify_tolerance=args.simplify_paths)
+        # drafts are not up to date
+        if not args.draft:
+            manifest.update([(args.input_file, out_type, svg)])
     if svg is None:
         raise Exception(
             'SVG file "{f}" not found! '
@@ -56,42 +97,842 @@ def parse_args():
             'Name (w/o extension) of SVG file. '
             'Either file name to search for under `./img`, '
             'or path that starts with `./img`.'))
-    choices = [
-        'latex-pdf', 'pdf']
     parser.add_argument(
-        '-m', '--method', type=str, choices=choices,
+        '-m', '--method', type=_parse_method,
         help=(
             'Export to this file type. '
             'The prefix "latex" produces also a file `*.pdf_tex` '
             'that contains the text from the SVG. '
             'The command `\includesvgpdf` passes `pdf`, '
-            'and `\includesvg` passes `latex-pdf`.'))
+            'and `\includesvg` passes `latex-pdf`. '
+            'Several comma-separated targets are converted together, '
+            'for example `latex-pdf,png@150dpi,eps`.'))
+    _add_optimize_pdf_arg(parser)
+    _add_deterministic_arg(parser)
+    _add_processes_arg(parser, None)
+    _add_rasterize_filters_arg(parser)
+    _add_compact_tex_arg(parser)
+    _add_estimate_text_arg(parser)
+    _add_draft_arg(parser)
+    _add_native_pdf_arg(parser)
+    _add_simplify_paths_arg(parser)
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser(
+        'build',
+        help='Convert all SVG files that are not up to date.')
+    build_parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['./img'],
+        help=(
+            'SVG or DOT file, or directory to search for '
+            'SVG and DOT files (default: `./img`).'))
+    build_parser.add_argument(
+        '-m', '--method', type=_parse_method,
+        default='latex-pdf',
+        help='Export to this file type (default: `latex-pdf`).')
+    build_parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help=(
+            'Number of parallel conversions '
+            '(default: number of processors).'))
+    build_parser.add_argument(
+        '--memory-budget', type=_parse_size, default=None,
+        help=(
+            'Start conversions only while their estimated peak memory '
+            '(from the build history) fits in this many bytes, '
+            'for example `8G` (default: 80% of physical memory).'))
+    build_parser.add_argument(
+        '--force', action='store_true',
+        help='Convert also SVG files that are up to date.')
+    build_parser.add_argument(
+        '--changed-since', metavar='REV', type=str, default=None,
+        help=(
+            'Convert only figures that changed (or whose linked '
+            'files changed) since the `git` revision `REV`, '
+            'regardless of modification times. Outputs of other '
+            'figures are kept, and marked as up to date.'))
+    build_parser.add_argument(
+        '--resume', action='store_true',
+        help=(
+            'Resume an interrupted build: skip figures whose '
+            'conversion the journal records as completed, with '
+            'outputs unchanged since.'))
+    build_parser.add_argument(
+        '--restat', action='store_true',
+        help=(
+            'Keep the modification time of outputs whose contents '
+            'did not change (for `restat` rules of Ninja). '
+            'PDF files change at each conversion, unless '
+            '`--deterministic` is given.'))
+    _add_optimize_pdf_arg(build_parser)
+    _add_deterministic_arg(build_parser)
+    _add_processes_arg(build_parser, 1)
+    _add_rasterize_filters_arg(build_parser)
+    _add_compact_tex_arg(build_parser)
+    _add_estimate_text_arg(build_parser)
+    _add_draft_arg(build_parser)
+    _add_native_pdf_arg(build_parser)
+    _add_simplify_paths_arg(build_parser)
+    build_parser.set_defaults(func=_build_command)
+    check_parser = subparsers.add_parser(
+        'check',
+        help=(
+            'Report features of SVG files that the converter '
+            'does not support, without running `inkscape`.'))
+    check_parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['./img'],
+        help=(
+            'SVG file, or directory to search for '
+            'SVG files (default: `./img`).'))
+    check_parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help=(
+            'Number of parallel checks '
+            '(default: number of processors).'))
+    check_parser.set_defaults(func=_check_command)
+    gen_parser = subparsers.add_parser(
+        'gen-build',
+        help='Write a Ninja or Make build file for converting figures.')
+    gen_parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['./img'],
+        help=(
+            'SVG or DOT file, or directory to search for '
+            'SVG and DOT files (default: `./img`).'))
+    group = gen_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        '--ninja', metavar='FILE', type=str,
+        help='Write a Ninja build file.')
+    group.add_argument(
+        '--make', metavar='FILE', type=str,
+        help='Write a Makefile.')
+    gen_parser.add_argument(
+        '-m', '--method', type=_parse_method,
+        default='latex-pdf',
+        help='Export to this file type (default: `latex-pdf`).')
+    gen_parser.add_argument(
+        '--svglatex', type=str, default='svglatex',
+        help='Command that the build file uses to run `svglatex`.')
+    gen_parser.set_defaults(func=_gen_build_command)
+    typeset_parser = subparsers.add_parser(
+        'typeset',
+        help=(
+            'Typeset the text of converted figures in one LaTeX run, '
+            'as a standalone PDF file for each figure.'))
+    typeset_parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['./img'],
+        help=(
+            'SVG or DOT file, or directory to search for '
+            'SVG and DOT files (default: `./img`).'))
+    typeset_parser.add_argument(
+        '--preamble', metavar='FILE', type=str, required=True,
+        help=(
+            'LaTeX document whose preamble (before '
+            '`\\begin{document}`) is used, or file with a preamble.'))
+    typeset_parser.add_argument(
+        '--latex', type=str, default='pdflatex',
+        help='LaTeX executable (default: `pdflatex`).')
+    typeset_parser.add_argument(
+        '--width', type=str, default=None,
+        help=(
+            'Width of the figures, as a TeX dimension, for example '
+            '`\\linewidth` (default: natural width of each figure).'))
+    _add_deterministic_arg(typeset_parser)
+    typeset_parser.set_defaults(func=_typeset_command)
+    stats_parser = subparsers.add_parser(
+        'stats',
+        help='Report hit rates and slowest figures from build history.')
+    stats_parser.add_argument(
+        '-n', '--number', type=int, default=10,
+        help='Number of slowest figures to report (default: 10).')
+    stats_parser.set_defaults(func=_stats_command)
     args = parser.parse_args()
     return args
 
 
-def convert_if_svg_newer(svg, out_type):
-    """Convert SVG file to PDF or EPS."""
-    base, ext = os.path.splitext(svg)
-    assert ext == '.svg', ext
-    if 'pdf' in out_type:
-        out = base + '.pdf'
-    elif 'eps' in out_type:
-        out = base + '.eps'
+def _parse_method(s):
+    """Return export method `s`, if it is valid."""
+    try:
+        formats.parse_targets(s)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return s
+
+
+def _parse_size(s):
+    """Return number of bytes from `s`, for example `'512M'`."""
+    units = dict(K=2**10, M=2**20, G=2**30, T=2**40)
+    s = s.strip().upper().rstrip('B')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+
+def _add_optimize_pdf_arg(parser):
+    parser.add_argument(
+        '--optimize-pdf', action='store_true',
+        help=(
+            'Optimize the PDF after export: recompress streams, '
+            'merge duplicate objects, and strip metadata. '
+            'PDF files already optimized are left alone.'))
+
+
+def _add_deterministic_arg(parser):
+    parser.add_argument(
+        '--deterministic', action='store_true',
+        help=(
+            'Make outputs byte-for-byte reproducible: remove volatile '
+            'PDF metadata, or set dates to `$SOURCE_DATE_EPOCH`. '
+            'Implied if `$SOURCE_DATE_EPOCH` is set.'))
+
+
+def _add_processes_arg(parser, default):
+    if default is None:
+        s = 'as many as there are independent steps'
     else:
-        raise ValueError(out_type)
+        s = str(default)
+    parser.add_argument(
+        '--processes', type=int, default=default,
+        help=(
+            'Number of `inkscape` processes that convert '
+            'each figure concurrently (default: {s}).').format(s=s))
+
+
+def _add_rasterize_filters_arg(parser):
+    parser.add_argument(
+        '--rasterize-filters', metavar='DPI', type=float, default=None,
+        help=(
+            'Replace elements that have filters (for example blur) '
+            'by images rasterized at this resolution, instead of '
+            'ignoring the filters. Images are cached.'))
+
+
+def _add_compact_tex_arg(parser):
+    parser.add_argument(
+        '--compact-tex', action='store_true',
+        help=(
+            'In `*.pdf_tex` files, define a macro for each text '
+            'style, and typeset each label with the macro of its '
+            'style (shorter files for figures with many labels).'))
+
+
+def _add_estimate_text_arg(parser):
+    parser.add_argument(
+        '--estimate-text', action='store_true',
+        help=(
+            'Experimental: estimate the extents of text from the '
+            'metrics of installed fonts (found with `fc-match`), '
+            'instead of querying Inkscape. Text that cannot be '
+            'estimated is queried.'))
+
+
+def _add_draft_arg(parser):
+    parser.add_argument(
+        '--draft', action='store_true',
+        help=(
+            'Write only a `*.pdf_tex` with a frame of the size of '
+            'the figure and its text, without calling Inkscape. '
+            'Figures remain out of date, until converted without '
+            '`--draft`.'))
+
+
+def _add_native_pdf_arg(parser):
+    parser.add_argument(
+        '--native-pdf', action='store_true',
+        help=(
+            'Write the PDF of graphics drawn only with paths and '
+            'basic shapes in solid colors directly, without Inkscape. '
+            'Other graphics are exported with Inkscape.'))
+
+
+def _add_simplify_paths_arg(parser):
+    parser.add_argument(
+        '--simplify-paths', metavar='BP', type=float, default=None,
+        help=(
+            'Before exporting, simplify paths of many straight '
+            'segments (for example lines of plots), so that they '
+            'move at most this many bp (for example `0.1`).'))
+
+
+def _build_command(args):
+    build(
+        args.paths, args.method, args.jobs,
+        args.optimize_pdf, args.memory_budget,
+        args.deterministic, args.force, args.restat,
+        args.processes, args.rasterize_filters, args.compact_tex,
+        args.estimate_text, args.draft, args.native_pdf,
+        args.changed_since, args.simplify_paths, args.resume)
+
+
+def _check_command(args):
+    svgs = collect_svg_files(args.paths)
+    problems = check.check_files(svgs, args.jobs)
+    if problems:
+        print(check.format_problems(problems))
+        sys.exit(1)
+
+
+def _gen_build_command(args):
+    svgs = collect_svg_files(args.paths)
+    if args.ninja is not None:
+        buildgen.write_ninja(
+            svgs, args.method, args.ninja, args.svglatex)
+    else:
+        buildgen.write_makefile(
+            svgs, args.method, args.make, args.svglatex)
+
+
+def _typeset_command(args):
+    svgs = collect_svg_files(args.paths)
+    epoch = source_date_epoch()
+    outs = typeset.typeset_figures(
+        svgs, args.preamble, args.latex, args.width,
+        args.deterministic or epoch is not None, epoch)
+    print('{n} of {k} figures typeset.'.format(
+        n=len(outs), k=len(svgs)))
+
+
+def _stats_command(args):
+    stats = history.stats(args.number)
+    total = stats.fresh + stats.converted + stats.failed
+    print('{n} conversion requests: {f} fresh, {c} converted, '
+          '{e} failed'.format(
+              n=total, f=stats.fresh, c=stats.converted,
+              e=stats.failed))
+    if total:
+        print('hit rate: {r:0.1f} %'.format(
+            r=100.0 * stats.fresh / total))
+    if not stats.slowest:
+        return
+    print('slowest figures (mean wall time, mean CPU time, peak memory):')
+    for fig in stats.slowest:
+        print('    {wall:8.2f} s {cpu:8.2f} s {rss:>10}  {path} '
+              '[{method}, {count} runs]'.format(
+                  wall=fig.wall, cpu=fig.cpu,
+                  rss=humanize.naturalsize(fig.rss),
+                  path=fig.path, method=fig.method,
+                  count=fig.count))
+
+
+def build(
+        paths, out_type, jobs=None, optimize_pdf=False,
+        memory_budget=None, deterministic=False,
+        force=False, restat=False, processes=1,
+        raster_dpi=None, compact=False, estimate_text=False,
+        draft=False, native_pdf=False, changed_since=None,
+        simplify_tolerance=None, resume=False):
+    """Convert SVG files under `paths` that are not up to date.
+
+    Files to convert are first checked (see `check.check_files`),
+    and files with problems are not converted.
+    If `changed_since` is a `git` revision, then which files are
+    up to date is decided by `git`, see `_split_changed`.
+
+    Conversions are recorded in a journal (see `svglatex.journal`),
+    which other batches in the same directory may be using.
+    If `resume`, then outputs of conversions that the journal records
+    as interrupted are removed first, figures whose conversion the
+    journal records as completed, with outputs unchanged, are
+    skipped, and outputs changed since are removed, so converted
+    again.
+    Conversions run in parallel, in `jobs` worker processes,
+    scheduled as described in `run_batch`.
+    If `optimize_pdf`, then all PDF files of the batch are
+    optimized afterwards, also in parallel.
+
+    @param paths: SVG files and directories
+    @type paths: iterable of `str`
+    @type out_type: `str`
+    @type jobs: `int` or `None`
+    @type optimize_pdf: `bool`
+    @param memory_budget: bytes, see `run_batch`
+    @param deterministic, force, restat, processes, raster_dpi,
+        compact, estimate_text, draft, native_pdf,
+        simplify_tolerance: see `convert_if_svg_newer`
+    @param changed_since: `git` revision, or `None`
+    @type resume: `bool`
+    """
+    svgs = collect_svg_files(paths)
+    journal.compact()
+    done = set()
+    if resume:
+        entries = journal.load()
+        interrupted = journal.discard_interrupted(entries, out_type)
+        for svg in svgs:
+            entry = entries.get((svg, out_type))
+            if svg in interrupted or entry is None:
+                continue
+            if journal.is_verified(entry, svg, out_type):
+                done.add(svg)
+            elif entry.get('state') == journal.COMPLETED:
+                # outputs changed since, so are not trusted
+                journal.discard_outputs(svg, out_type)
+        log.info('Resuming: {n} figures completed.'.format(
+            n=len(done)))
+    if changed_since is None:
+        candidates = svgs
+    else:
+        candidates = _split_changed(svgs, out_type, changed_since)
+        # modification times are not meaningful after a checkout
+        force = True
+    stale = list()
+    for svg in svgs:
+        start = time.monotonic()
+        if svg in done or svg not in candidates or (
+                not force and is_fresh(svg, out_type)):
+            history.record(
+                svg, out_type, history.FRESH,
+                time.monotonic() - start)
+        else:
+            stale.append(svg)
+    problems = check.check_files(stale, jobs)
+    if problems:
+        print(check.format_problems(problems))
+    stale = [svg for svg in stale if svg not in problems]
+    failed = run_batch(
+        convert_if_svg_newer, stale, out_type,
+        jobs, memory_budget,
+        args=(
+            False, deterministic, force, restat,
+            processes, raster_dpi, compact, estimate_text, draft,
+            native_pdf, simplify_tolerance),
+        record=not draft)
+    failed.extend(problems)
+    # drafts are not up to date, and have no PDF
+    if not draft:
+        manifest.update(_manifest_entries(
+            [svg for svg in svgs if svg not in failed], out_type))
+    if optimize_pdf and not draft:
+        pdfs = [
+            out for svg in svgs if svg not in failed
+            for out in formats.outputs(svg, out_type)
+            if out.endswith('.pdf')]
+        reports = pdf.optimize_files(pdfs, jobs)
+        for report in reports:
+            _print_optimization_report(report)
+    if failed:
+        raise Exception(
+            'Conversion failed for SVG files: {f}'.format(
+                f=', '.join(sorted(failed))))
+
+
+def run_batch(
+        func, svgs, out_type, jobs=None,
+        memory_budget=None, args=tuple(), record=False):
+    """Call `func(svg, out_type, *args)` in parallel for each of `svgs`.
+
+    Conversions are scheduled longest first, using the wall times
+    recorded in the build history, so that a long conversion does
+    not start last. Files without history go first, largest first.
+
+    A conversion starts only if the sum of estimated peak memory of
+    running conversions stays within `memory_budget`. If nothing is
+    running, then the next conversion starts regardless.
+
+    @param func: picklable callable
+    @type svgs: `list` of `str`
+    @type out_type: `str`
+    @param jobs: number of worker processes,
+        if `None`, then the number of processors
+    @param memory_budget: bytes, if `None`, then 80% of
+        physical memory (if that can be found)
+    @param record: if `True`, then record in the journal
+        when each conversion starts, and how it ends
+        (see `svglatex.journal`)
+    @return: SVG files whose conversion raised an exception
+    @rtype: `list`
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if memory_budget is None:
+        memory_budget = _default_memory_budget()
+    est = history.estimates(svgs, out_type)
+    pending = _longest_first(svgs, est)
+    running = dict()
+    failed = list()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker,
+            initargs=(os.getpid(),)) as executor:
+        try:
+            while pending or running:
+                while pending and len(running) < jobs:
+                    used = sum(rss for _, rss in running.values())
+                    i = _next_admissible(
+                        pending, est, used, memory_budget, running)
+                    if i is None:
+                        break
+                    svg = pending.pop(i)
+                    rss = est[svg].rss if svg in est else 0
+                    if record:
+                        journal.started(svg, out_type)
+                    future = executor.submit(func, svg, out_type, *args)
+                    running[future] = (svg, rss)
+                done, _ = concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    svg, _ = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log.error('Converting "{f}" failed: {e}'.format(
+                            f=svg, e=e))
+                        failed.append(svg)
+                        if record:
+                            journal.failed(svg, out_type)
+                        continue
+                    if record:
+                        journal.completed(svg, out_type)
+        except BaseException:
+            # for example, terminated: stop the workers (and their
+            # `inkscape` processes, see `_init_worker`), so that
+            # exiting does not wait for their conversions
+            for child in multiprocessing.active_children():
+                child.terminate()
+            raise
+    return failed
+
+
+def _install_signal_handlers():
+    """Kill `inkscape` processes when terminated, see `_terminate`.
+
+    Signal handlers can be set only in the main thread,
+    so this function does nothing in other threads.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for name in ('SIGTERM', 'SIGHUP'):
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, _terminate)
+
+
+def _terminate(signum, frame):
+    """Kill running `inkscape` processes, and exit.
+
+    The `inkscape` processes run in process groups of their own
+    (see `inkscape.running`), so they are not signaled together
+    with `svglatex`.
+    """
+    inkscape.kill_all()
+    raise SystemExit(128 + signum)
+
+
+def _init_worker(parent):
+    """Initialize worker process of `run_batch`.
+
+    When the worker is terminated, or its parent `parent` exits
+    (even if killed), the `inkscape` processes of the worker are
+    killed, so that they are not left running.
+
+    @param parent: process ID
+    @type parent: `int`
+    """
+    _install_signal_handlers()
+    watcher = threading.Thread(
+        target=_watch_parent, args=(parent,), daemon=True)
+    watcher.start()
+
+
+def _watch_parent(parent):
+    """Kill `inkscape` processes, and exit, when `parent` exits."""
+    while os.getppid() == parent:
+        time.sleep(_PARENT_POLL)
+    inkscape.kill_all()
+    os._exit(1)
+
+
+def _split_changed(svgs, out_type, rev):
+    """Return `svgs` to convert, given changes since `rev`.
+
+    Figures to convert are those that changed since the `git`
+    revision `rev`, or whose linked files changed (see
+    `buildgen.implicit_dependencies`), and those with missing
+    outputs. The outputs of other figures (for example restored
+    from the artifacts of an earlier build) are kept, and their
+    modification times updated, so that they are newer than the
+    figure, as checked out, and `svglatex -i` finds them fresh.
+
+    @type svgs: `list` of `str`
+    @type out_type: `str`
+    @type rev: `str`
+    @rtype: `set` of `str`
+    """
+    changed = vcs.changed_files(rev)
+    selected = set()
+    for svg in svgs:
+        sources = [svg] + buildgen.implicit_dependencies(svg)
+        outs = formats.outputs(svg, out_type)
+        if any(os.path.realpath(f) in changed for f in sources):
+            selected.add(svg)
+        elif not all(os.path.isfile(out) for out in outs):
+            log.info('Unchanged "{f}" has no outputs, converting.'.format(
+                f=svg))
+            selected.add(svg)
+        else:
+            for out in outs:
+                if not is_newer(out, svg):
+                    os.utime(out)
+    log.info('{n} of {m} figures changed since {rev}.'.format(
+        n=len(selected), m=len(svgs), rev=rev))
+    return selected
+
+
+def _manifest_entries(svgs, out_type):
+    """Return manifest entries for SVG files under `./img`.
+
+    The keys are those that `\includesvg` passes to `svglatex`:
+    the path that starts with `./img/`, and the file name,
+    if no other SVG file in `svgs` has the same name.
+    """
+    names = collections.Counter(
+        os.path.basename(svg) for svg in svgs)
+    img = os.path.abspath('img')
+    entries = list()
+    for svg in svgs:
+        if not os.path.abspath(svg).startswith(img + os.sep):
+            continue
+        base = os.path.splitext(os.path.relpath(svg))[0]
+        key = './' + base.replace(os.sep, '/')
+        entries.append((key, out_type, svg))
+        if names[os.path.basename(svg)] == 1:
+            entries.append((os.path.basename(base), out_type, svg))
+    return entries
+
+
+def _longest_first(svgs, est):
+    """Return `svgs` sorted by decreasing estimated wall time."""
+    unknown = [svg for svg in svgs if svg not in est]
+    unknown.sort(key=os.path.getsize, reverse=True)
+    known = [svg for svg in svgs if svg in est]
+    known.sort(key=lambda svg: est[svg].wall, reverse=True)
+    return unknown + known
+
+
+def _next_admissible(pending, est, used, memory_budget, running):
+    """Return index of first pending conversion that fits in memory."""
+    if not running:
+        return 0
+    if memory_budget is None:
+        return 0
+    for i, svg in enumerate(pending):
+        rss = est[svg].rss if svg in est else 0
+        if used + rss <= memory_budget:
+            return i
+    return None
+
+
+def _default_memory_budget():
+    """Return 80% of physical memory in bytes, or `None`."""
+    try:
+        pages = os.sysconf('SC_PHYS_PAGES')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+    return int(0.8 * pages * page_size)
+
+
+def collect_svg_files(paths):
+    """Return sorted `list` of SVG and DOT files in `paths`.
+
+    @param paths: SVG and DOT files, and directories to search
+    @type paths: iterable of `str`
+    """
+    svgs = set()
+    for path in paths:
+        if os.path.isdir(path):
+            svgs.update(locate('*.svg', path))
+            svgs.update(locate('*' + dot.DOT_EXT, path))
+        elif os.path.isfile(path):
+            svgs.add(os.path.abspath(path))
+        else:
+            raise FileNotFoundError(
+                'No SVG file or directory "{f}"'.format(f=path))
+    return sorted(svgs)
+
+
+def convert_if_svg_newer(
+        svg, out_type, optimize_pdf=False, deterministic=False,
+        force=False, restat=False, processes=None,
+        raster_dpi=None, compact=False, estimate_text=False,
+        draft=False, native_pdf=False, simplify_tolerance=None):
+    """Convert SVG file to the targets of export method `out_type`.
+
+    Freshness is checked for each target, and only stale
+    targets are converted, all from one parse of the SVG,
+    see `converter.convert_targets`.
+
+    If `svg` is a DOT file, then it is first converted to SVG
+    using Graphviz, and freshness is checked against `svg`.
+    The conversion is recorded in the build history.
+
+    @param out_type: export method, see `formats.parse_targets`
+    @param optimize_pdf: if `True`, then optimize the PDF
+    @param deterministic: if `True`, or `$SOURCE_DATE_EPOCH` is set,
+        then remove volatile metadata from the PDF,
+        see `pdf.make_deterministic`
+    @param force: if `True`, then convert even if outputs are
+        newer than `svg`
+    @param restat: if `True`, then outputs whose contents did not
+        change keep their modification time
+    @param processes: number of concurrent `inkscape` processes,
+        see `converter.convert_targets`
+    @param raster_dpi: if not `None`, then rasterize elements that
+        have filters, see `converter.convert_targets`
+    @param compact: if `True`, then write compact `.pdf_tex`,
+        see `converter.convert_targets`
+    @param estimate_text: if `True`, then estimate extents of text
+        from font metrics, see `converter.convert_targets`
+    @param draft: if `True`, then write only a draft `.pdf_tex`
+        for `latex-pdf`, without `inkscape`, see
+        `converter.convert_draft`. Drafts are not recorded
+        in the build history.
+    @param native_pdf: if `True`, then write the PDF of simple
+        graphics without `inkscape`, see `converter.convert_targets`
+    @param simplify_tolerance: if not `None`, then simplify long
+        polylines within this many bp, see
+        `converter.convert_targets`
+    """
+    targets = formats.parse_targets(out_type)
+    if draft:
+        targets = [t for t in targets if t.method == 'latex-pdf']
+        if not targets:
+            log.info('Draft mode applies only to `latex-pdf`.')
+            return
+    base, ext = os.path.splitext(svg)
+    assert ext in ('.svg', dot.DOT_EXT), ext
     if not os.access(svg, os.F_OK):
         raise FileNotFoundError(
             'No SVG file "{f}"'.format(f=svg))
-    fresh = is_newer(out, svg)
-    if out_type == 'latex-pdf':
-        pdf_tex = base + '.pdf_tex'
-        fresh &= is_newer(pdf_tex, svg)
-    if fresh:
+    start = time.monotonic()
+    if not _stale_targets(svg, targets, force):
         log.info('No update needed, target newer than SVG.')
+        history.record(
+            svg, out_type, history.FRESH,
+            time.monotonic() - start)
+        return
+    # one process converts, others wait for it and reuse its result
+    with contextlib.ExitStack() as stack:
+        # in sorted order, so that processes do not deadlock
+        for out in sorted(
+                formats.target_outputs(base, t)[0] for t in targets):
+            stack.enter_context(lock.locked(out))
+        stale = _stale_targets(svg, targets, force)
+        if not stale:
+            log.info('SVG converted by another process meanwhile.')
+            history.record(
+                svg, out_type, history.FRESH,
+                time.monotonic() - start)
+            return
+        log.info('File not found or old. Converting from SVG...')
+        outs = [
+            out for t in stale
+            for out in formats.target_outputs(base, t)]
+        before = _output_stats(outs) if restat else dict()
+        if draft:
+            _convert_draft(svg, base, compact)
+            _restore_unchanged_mtimes(before)
+            return
+        inkscape.reset_usage()
+        try:
+            convert_svg(
+                svg, base, stale, processes, raster_dpi, compact,
+                estimate_text, native_pdf, simplify_tolerance)
+        except Exception:
+            _record_conversion(svg, out_type, history.FAILED, start)
+            raise
+        _record_conversion(svg, out_type, history.CONVERTED, start)
+        epoch = source_date_epoch()
+        for out in outs:
+            if not out.endswith('.pdf'):
+                continue
+            if deterministic or epoch is not None:
+                pdf.make_file_deterministic(out, epoch)
+            if optimize_pdf:
+                report = pdf.optimize_file(out)
+                _print_optimization_report(report)
+        _restore_unchanged_mtimes(before)
+
+
+def _stale_targets(svg, targets, force=False):
+    """Return `targets` with an output not newer than `svg`.
+
+    @param targets: `list` of `formats.Target`
+    @param force: if `True`, then return all `targets`
+    """
+    if force:
+        return list(targets)
+    base = os.path.splitext(svg)[0]
+    return [
+        t for t in targets
+        if not all(
+            is_newer(out, svg)
+            for out in formats.target_outputs(base, t))]
+
+
+def _output_stats(outs):
+    """Return `dict` that maps existing `outs` to digest and stat."""
+    stats = dict()
+    for out in outs:
+        try:
+            st = os.stat(out)
+        except FileNotFoundError:
+            continue
+        stats[out] = (cache.file_digest(out), st)
+    return stats
+
+
+def _restore_unchanged_mtimes(before):
+    """Restore modification times of outputs with same contents.
+
+    @param before: as returned by `_output_stats`
+    """
+    for out, (digest, st) in before.items():
+        if os.path.isfile(out) and cache.file_digest(out) == digest:
+            os.utime(out, ns=(st.st_atime_ns, st.st_mtime_ns))
+            log.info('Output "{f}" unchanged.'.format(f=out))
+
+
+def source_date_epoch():
+    """Return `$SOURCE_DATE_EPOCH` as `int`, or `None` if unset.
+
+    https://reproducible-builds.org/specs/source-date-epoch/
+    """
+    s = os.environ.get('SOURCE_DATE_EPOCH')
+    if not s:
+        return None
+    return int(s)
+
+
+def is_fresh(svg, out_type):
+    """Return `True` if all outputs are newer than `svg`."""
+    return all(
+        is_newer(out, svg) for out in formats.outputs(svg, out_type))
+
+
+def _record_conversion(svg, out_type, result, start):
+    """Record conversion that started at `start` in build history."""
+    use = inkscape.usage()
+    history.record(
+        svg, out_type, result,
+        wall=time.monotonic() - start,
+        cpu=use.cpu, rss=use.rss)
+
+
+def _print_optimization_report(report):
+    """Print sizes before and after optimizing a PDF file.
+
+    @type report: `pdf.OptimizationReport`
+    """
+    if report.cached:
+        print('{f}: already optimized ({s})'.format(
+            f=report.path,
+            s=humanize.naturalsize(report.size_after)))
         return
-    log.info('File not found or old. Converting from SVG...')
-    convert_svg(svg, out, out_type)
+    print('{f}: {a} -> {b}'.format(
+        f=report.path,
+        a=humanize.naturalsize(report.size_before),
+        b=humanize.naturalsize(report.size_after)))
+    for name in report.fonts_not_subset:
+        print('    font not subset: {name}'.format(name=name))
 
 
 def is_newer(target, source):
@@ -122,26 +963,29 @@ def _format_time(t):
         datetime.datetime.fromtimestamp(t))
 
 
-def convert_svg(svg, out, out_type):
-    """Convert from SVG to output format."""
-    assert out_type in ('latex-pdf', 'pdf'), out_type
-    if out_type == 'latex-pdf':
-        converter.convert(svg)
-    elif out_type == 'pdf':
-        inkscape = converter.which_inkscape()
-        svg_path = os.path.realpath(svg)
-        out_path = os.path.realpath(out)
-        args = [
-            inkscape,
-            '--without-gui',
-            '--export-area-drawing',
-            '--export-ignore-filters',
-            '--export-dpi={dpi}'.format(dpi=96),
-            '--export-pdf={out}'.format(out=out_path),
-            svg_path]
-        r = subprocess.call(args)
-        if r != 0:
-            raise Exception('Conversion error')
+def _convert_draft(svg, base, compact=False):
+    """Write draft `.pdf_tex` for `svg`, see `converter.convert_draft`."""
+    if svg.endswith(dot.DOT_EXT):
+        svg = dot.to_svg(svg)
+    converter.convert_draft(svg, base, compact)
+
+
+def convert_svg(
+        svg, base, targets, processes=None, raster_dpi=None,
+        compact=False, estimate_text=False, native_pdf=False,
+        simplify_tolerance=None):
+    """Convert from SVG to `targets`, with outputs named `base`.
+
+    @param base: path of output files without extension
+    @param targets: `list` of `formats.Target`
+    @param processes, raster_dpi, compact, estimate_text, native_pdf,
+        simplify_tolerance: see `converter.convert_targets`
+    """
+    if svg.endswith(dot.DOT_EXT):
+        svg = dot.to_svg(svg)
+    converter.convert_targets(
+        svg, targets, base, processes, raster_dpi, compact,
+        estimate_text, native_pdf, simplify_tolerance)
 
 
 def convert_svg_using_inkscape(svg, out, out_type):
@@ -162,7 +1006,7 @@ def convert_svg_using_inkscape(svg, out, out_type):
     if 'latex' in out_type:
         args.append('--export-latex')
     args = shlex.split(' '.join(args))
-    r = subprocess.call(args)
+    r = inkscape.call(args, os.path.getsize(svg_abspath), inkscape.wait)
     if r != 0:
         raise Exception(
             'conversion from "{svg}" to "{out}" failed'.format(
@@ -0,0 +1,234 @@
+"""Journal of batch conversions, for resuming interrupted batches.
+
+`svglatex build` appends a line to the journal when a conversion
+starts, and when it completes or fails. A completed conversion records
+digests of the source (and of the files it links to) and of each
+output, so that a batch resumed with `--resume` skips only work that
+is verified to be complete. Each line is a JSON object:
+
+    {"path": ..., "method": ..., "state": ..., "time": ...,
+     "source": ..., "outputs": {path: digest, ...}}
+
+The journal is the file `.svglatex-journal` in the current directory.
+Several batches can run in the same directory at once (for example
+rules of a Ninja build file), so the journal is never truncated while
+in use: lines are appended under the lock of the journal (see
+`svglatex.lock`), and `compact` rewrites the journal under the same
+lock. A last line cut short by an interruption is ignored.
+
+A started entry records the process (and host) of the batch. When
+resuming, outputs of conversions that started and did not finish (for
+example because the batch was killed) are not trusted, even if newer
+than the source, and are removed, together with temporary files left
+next to them (see `cache.replacing`). Conversions whose batch is still
+running, or whose outputs are locked by another process, are left
+alone.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import contextlib
+import glob
+import json
+import logging
+import os
+import socket
+import time
+
+from svglatex import buildgen
+from svglatex import cache
+from svglatex import formats
+from svglatex import lock
+
+
+log = logging.getLogger(__name__)
+JOURNAL_FILE = '.svglatex-journal'
+STARTED = 'started'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+def compact(fname=JOURNAL_FILE):
+    """Rewrite journal `fname` with only the last entry of each figure.
+
+    Processes that append to the journal wait meanwhile.
+    """
+    with lock.locked(fname):
+        entries = load(fname)
+        lines = [
+            json.dumps(entry, sort_keys=True) + '\n'
+            for _, entry in sorted(entries.items())]
+        cache.atomic_write(fname, ''.join(lines))
+
+
+def load(fname=JOURNAL_FILE):
+    """Return `dict` that maps `(path, method)` to last entry.
+
+    @rtype: `dict`
+    """
+    last = dict()
+    if not os.path.isfile(fname):
+        return last
+    with open(fname, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                key = (entry['path'], entry['method'])
+            except (ValueError, KeyError, TypeError):
+                log.info('Ignoring malformed journal line: {s}'.format(
+                    s=line.strip()))
+                continue
+            last[key] = entry
+    return last
+
+
+def started(path, method, fname=JOURNAL_FILE):
+    """Append that converting `path` by `method` started."""
+    _append(dict(
+        path=os.path.abspath(path), method=method, state=STARTED,
+        pid=os.getpid(), host=socket.gethostname()),
+        fname)
+
+
+def completed(path, method, fname=JOURNAL_FILE):
+    """Append that converting `path` by `method` completed.
+
+    Digests of the source and outputs are recorded.
+    """
+    outputs = {
+        out: cache.file_digest(out)
+        for out in formats.outputs(path, method)
+        if os.path.isfile(out)}
+    _append(dict(
+        path=os.path.abspath(path), method=method, state=COMPLETED,
+        source=source_digest(path), outputs=outputs),
+        fname)
+
+
+def failed(path, method, fname=JOURNAL_FILE):
+    """Append that converting `path` by `method` failed."""
+    _append(dict(
+        path=os.path.abspath(path), method=method, state=FAILED),
+        fname)
+
+
+def _append(entry, fname):
+    """Append `entry` as a line, and flush it to disk."""
+    entry['time'] = time.time()
+    line = json.dumps(entry, sort_keys=True) + '\n'
+    with lock.locked(fname):
+        with open(fname, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def source_digest(path):
+    """Return digest of `path` and of the files that it links to.
+
+    @rtype: `str`
+    """
+    deps = [path] + buildgen.implicit_dependencies(path)
+    s = ' '.join(cache.file_digest(dep) for dep in deps)
+    return cache.bytes_digest(s.encode('ascii'))
+
+
+def is_verified(entry, path, method):
+    """Return `True` if `entry` records complete current outputs.
+
+    The conversion must have completed, from the current contents
+    of `path` (and the files it links to), and each output must
+    exist with the recorded contents.
+
+    @param entry: last journal entry of `path`, or `None`
+    @rtype: `bool`
+    """
+    if entry is None or entry.get('state') != COMPLETED:
+        return False
+    outs = formats.outputs(path, method)
+    recorded = entry.get('outputs', dict())
+    if sorted(recorded) != sorted(outs):
+        return False
+    try:
+        if entry.get('source') != source_digest(path):
+            return False
+        return all(
+            cache.file_digest(out) == recorded[out] for out in outs)
+    except OSError:
+        return False
+
+
+def discard_interrupted(entries, method):
+    """Remove outputs of conversions by `method` that did not finish.
+
+    Conversions whose batch is still running are not interrupted,
+    and are skipped.
+
+    @param entries: as returned by `load`
+    @return: sources whose outputs were removed
+    @rtype: `list` of `str`
+    """
+    discarded = list()
+    for (path, m), entry in sorted(entries.items()):
+        if m != method or entry.get('state') != STARTED:
+            continue
+        if _is_running(entry) or not discard_outputs(path, method):
+            log.info(
+                'Conversion of "{f}" is running in another '
+                'process.'.format(f=path))
+            continue
+        discarded.append(path)
+        log.warning(
+            'Conversion of "{f}" was interrupted, '
+            'discarded its outputs.'.format(f=path))
+    return discarded
+
+
+def discard_outputs(path, method):
+    """Remove outputs of converting `path` by `method`.
+
+    Temporary files for writing the outputs are removed too.
+    Nothing is removed if another process holds the lock of
+    an output (as when converting, see `interface.convert_if_svg_newer`).
+
+    @return: `True` if the outputs were removed
+    @rtype: `bool`
+    """
+    base = os.path.splitext(path)[0]
+    locked = sorted(
+        formats.target_outputs(base, t)[0]
+        for t in formats.parse_targets(method))
+    try:
+        with contextlib.ExitStack() as stack:
+            for out in locked:
+                stack.enter_context(lock.locked(out, timeout=0))
+            for out in formats.outputs(path, method):
+                _remove_partial(out)
+    except lock.LockTimeout:
+        return False
+    return True
+
+
+def _is_running(entry):
+    """Return `True` if the batch of `entry` runs on this host."""
+    pid = entry.get('pid')
+    if pid is None or entry.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove_partial(out):
+    """Remove file `out`, and temporary files for writing it."""
+    dirname, name = os.path.split(out)
+    _, ext = os.path.splitext(name)
+    pattern = os.path.join(
+        glob.escape(dirname), '.' + glob.escape(name) + '.*' + ext)
+    for path in [out] + glob.glob(pattern):
+        if os.path.isfile(path):
+            os.remove(path)
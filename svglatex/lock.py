@@ -0,0 +1,171 @@
+"""Advisory file locks, for converting each figure in one process.
+
+A lock for a file is taken on a lock file under the cache directory
+(`locks/` in `cache.cache_dir`), named by the digest of the real path
+of the file, using `fcntl.lockf`. So the directories of figures are
+left clean, and a file reached through symbolic links has one lock.
+Lock files are kept, and reused. The lock file records the
+process identifier and host name of the holder. The operating
+system releases the lock when the holder exits, also if it crashes.
+A lock file whose holder (on this host) is no longer running, but
+which is still locked (for example on a network file system that
+did not release the lock), is detected as stale and replaced.
+
+POSIX locks do not exclude threads of the same process,
+so each lock is also guarded by a lock among threads.
+Where `fcntl` is unavailable, only threads are excluded.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import contextlib
+import errno
+import logging
+import os
+import socket
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from svglatex import cache
+
+
+log = logging.getLogger(__name__)
+_POLL_INTERVAL = 0.1  # seconds
+_thread_locks = collections.defaultdict(threading.Lock)
+_thread_locks_lock = threading.Lock()
+
+
+class LockTimeout(Exception):
+    """Raised when waiting for a lock takes too long."""
+
+
+def lock_file(path):
+    """Return path of lock file for file `path`.
+
+    @type path: `str`
+    @rtype: `str`
+    """
+    key = cache.bytes_digest(os.path.realpath(path).encode('utf-8'))
+    return os.path.join(cache.cache_dir('locks'), key + '.lock')
+
+
+@contextlib.contextmanager
+def locked(path, timeout=None):
+    """Context manager that holds the lock for file `path`.
+
+    @type path: `str`
+    @param timeout: seconds to wait,
+        if `None`, then wait without limit
+    @raise LockTimeout: if `timeout` elapses
+    """
+    fname = lock_file(path)
+    with _thread_locks_lock:
+        thread_lock = _thread_locks[fname]
+    if not thread_lock.acquire(
+            timeout=-1 if timeout is None else timeout):
+        raise LockTimeout(fname)
+    try:
+        if fcntl is None:
+            yield
+            return
+        fd = _acquire(fname, timeout)
+        try:
+            yield
+        finally:
+            os.close(fd)
+    finally:
+        thread_lock.release()
+
+
+def _acquire(fname, timeout):
+    """Return file descriptor of lock file `fname`, after locking it."""
+    start = time.monotonic()
+    waiting = False
+    suspect = None
+    while True:
+        fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                os.close(fd)
+                raise
+            holder = _read_holder(fd)
+            os.close(fd)
+            # a new holder may not have recorded itself yet,
+            # so a dead holder must be seen twice in a row
+            stale = _is_stale(holder) and holder == suspect
+            suspect = holder if _is_stale(holder) else None
+            if stale:
+                log.warning(
+                    'Removing stale lock "{f}" of process {pid}'.format(
+                        f=fname, pid=holder[0]))
+                _remove(fname)
+                continue
+            if not waiting:
+                log.info(
+                    'Waiting for process {pid} that holds "{f}"'.format(
+                        pid=holder[0] if holder else '?', f=fname))
+                waiting = True
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise LockTimeout(fname)
+            time.sleep(_POLL_INTERVAL)
+            continue
+        # the lock file may have been replaced while we were locking it
+        try:
+            same = os.fstat(fd).st_ino == os.stat(fname).st_ino
+        except FileNotFoundError:
+            same = False
+        if not same:
+            os.close(fd)
+            continue
+        _write_holder(fd)
+        return fd
+
+
+def _write_holder(fd):
+    """Record this process as holder of locked file `fd`."""
+    s = '{pid} {host}\n'.format(pid=os.getpid(), host=socket.gethostname())
+    os.ftruncate(fd, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, s.encode('utf-8'))
+
+
+def _read_holder(fd):
+    """Return `(pid, host)` recorded in lock file `fd`, or `None`."""
+    try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        s = os.read(fd, 1024).decode('utf-8')
+        pid, host = s.split()
+        return int(pid), host
+    except (OSError, ValueError):
+        return None
+
+
+def _is_stale(holder):
+    """Return `True` if `holder` is a process on this host that exited."""
+    if holder is None:
+        return False
+    pid, host = holder
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
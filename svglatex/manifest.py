@@ -0,0 +1,123 @@
+"""TeX-readable manifest of figures whose outputs are up to date.
+
+The manifest is the file `svglatex-manifest.tex` in the current
+directory (the directory where LaTeX runs). Each line is:
+
+    \\svglatex@entry{key}{method}{base}{source}{md5}
+
+where `key` is the name passed to `\\includesvg`, `method` the export
+method, `base` the path of the output files without extension,
+`source` the path of the SVG (or DOT) file, and `md5` the MD5 digest
+(uppercase) of the source file when its outputs were last found
+up to date.
+
+The style `svglatex.sty` reads the manifest once, and skips calling
+`svglatex` (via `\\write18`) for figures whose source file still has the
+recorded MD5 digest, and whose outputs exist.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import hashlib
+import os
+import re
+
+from svglatex import cache
+from svglatex import lock
+
+
+MANIFEST_FILE = 'svglatex-manifest.tex'
+_HEADER = '% svglatex manifest of up-to-date figures, generated by svglatex\n'
+_ENTRY = (
+    '\\svglatex@entry{{{key}}}{{{method}}}'
+    '{{{base}}}{{{source}}}{{{md5}}}\n')
+_RX_ENTRY = re.compile(
+    r'^\\svglatex@entry\{([^{}]*)\}\{([^{}]*)\}'
+    r'\{([^{}]*)\}\{([^{}]*)\}\{([^{}]*)\}\s*$', re.MULTILINE)
+# characters that cannot appear in manifest entries
+_RX_UNSAFE = re.compile(r'[{}%#\\\s]')
+
+
+def update(entries, fname=MANIFEST_FILE):
+    """Add to manifest `fname` that SVG files are up to date.
+
+    Entries that cannot be written safely in TeX are skipped.
+
+    @param entries: iterable of `(key, method, svg)`, where
+        `key` is the name that LaTeX passes to `svglatex`,
+        and `svg` the path to the SVG (or DOT) file
+    @param fname: path to manifest file
+    """
+    with lock.locked(fname):
+        manifest = load(fname)
+        changed = False
+        for key, method, svg in entries:
+            source = tex_path(svg)
+            base = os.path.splitext(source)[0]
+            if any(_RX_UNSAFE.search(s) for s in (key, method, source)):
+                continue
+            value = (base, source, file_md5(svg))
+            if manifest.get((key, method)) == value:
+                continue
+            manifest[(key, method)] = value
+            changed = True
+        if changed:
+            dump(manifest, fname)
+
+
+def remove(key, method, fname=MANIFEST_FILE):
+    """Remove entry for `key` and `method` from manifest `fname`."""
+    with lock.locked(fname):
+        manifest = load(fname)
+        if manifest.pop((key, method), None) is not None:
+            dump(manifest, fname)
+
+
+def load(fname=MANIFEST_FILE):
+    """Return `dict` of entries in manifest `fname`.
+
+    @return: maps `(key, method)` to `(base, source, md5)`
+    @rtype: `dict`
+    """
+    try:
+        with open(fname, 'r', encoding='utf-8') as f:
+            s = f.read()
+    except FileNotFoundError:
+        return dict()
+    return {
+        (key, method): (base, source, md5)
+        for key, method, base, source, md5 in _RX_ENTRY.findall(s)}
+
+
+def dump(manifest, fname=MANIFEST_FILE):
+    """Write `manifest` to file `fname`, sorted by key.
+
+    @param manifest: as returned by `load`
+    """
+    lines = [_HEADER]
+    for (key, method), (base, source, md5) in sorted(manifest.items()):
+        lines.append(_ENTRY.format(
+            key=key, method=method, base=base,
+            source=source, md5=md5))
+    cache.atomic_write(fname, ''.join(lines))
+
+
+def file_md5(path):
+    """Return uppercase MD5 hex digest of file `path`.
+
+    This is the format of `\\pdf@filemdfivesum` of `pdftexcmds`.
+    """
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest().upper()
+
+
+def tex_path(path):
+    """Return `path` relative to current directory, with `/`."""
+    if os.path.isabs(path):
+        rel = os.path.relpath(path)
+        if not rel.startswith(os.pardir):
+            path = rel
+    return path.replace(os.sep, '/')
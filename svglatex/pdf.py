@@ -0,0 +1,1132 @@
+"""Minimal reading, rewriting, and optimization of PDF files.
+
+The PDF files that `inkscape` (via `cairo`) produces for figures are
+small and simple. This module contains a small parser for such files,
+and a serializer that rewrites them. Optimizing a PDF:
+
+- recompresses streams,
+- merges duplicate objects,
+- removes unreachable objects and unneeded metadata, and
+- audits embedded fonts for subsetting.
+
+The box of a page is read without parsing the whole file,
+using the cross-reference sections, see `page_box`.
+
+The pages of a PDF can be split into one document each,
+see `split_pages`.
+
+Making a PDF deterministic removes or fixes metadata that change
+from one export to the next (dates, XMP metadata, file identifier).
+
+No external dependencies are needed.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import re
+import time
+import zlib
+
+from svglatex import cache
+
+
+_WHITESPACE = b'\x00\t\n\x0c\r '
+_DELIMITERS = b'()<>[]{}/%'
+_RX_OBJ = re.compile(br'(\d+)\s+(\d+)\s+obj\b')
+_RX_REGULAR = re.compile(br'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+_RX_INT = re.compile(br'[+-]?\d+$')
+_RX_REAL = re.compile(br'[+-]?(\d+\.\d*|\.\d+|\d+)$')
+_RX_SUBSET_TAG = re.compile(r'^[A-Z]{6}\+')
+_RX_TRAILER = re.compile(br'trailer\s*<<')
+_RX_STARTXREF = re.compile(br'startxref\s+(\d+)')
+_RX_XREF_SUBSECTION = re.compile(br'(\d+)\s+(\d+)[ \t]*\r?\n')
+_RX_XREF_ENTRY = re.compile(br'\s*(\d{10})\s+(\d{5})\s+([nf])')
+# bytes read from the end of a file, to find `startxref`
+_TAIL_SIZE = 1024
+# bytes first read at an offset, when reading by cross-references
+_CHUNK_SIZE = 4096
+# limit on nesting of page trees, to stop on cycles
+_MAX_DEPTH = 64
+_ZLIB_LEVEL = 9
+_STRING_ESCAPES = {
+    ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t',
+    ord('b'): b'\b', ord('f'): b'\f',
+    ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+# keys of dictionaries that hold metadata not needed for
+# including a figure in a LaTeX document
+_CATALOG_METADATA = ('Metadata', 'PieceInfo')
+_PAGE_METADATA = ('PieceInfo', 'Thumb', 'Metadata')
+_FONT_FILES = ('FontFile', 'FontFile2', 'FontFile3')
+# attributes that pages inherit from the page tree
+_INHERITABLE = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+# page entries that refer back to the page tree, or to other pages
+_PAGE_LINKS = ('Annots', 'B')
+
+
+class Name(str):
+    """PDF name object."""
+
+
+class Ref(collections.namedtuple('Ref', ['num', 'gen'])):
+    """PDF indirect reference."""
+
+
+class Stream(object):
+    """PDF stream object.
+
+    @ivar dict: stream dictionary
+    @ivar data: stream contents, as stored in the file (encoded)
+    """
+
+    def __init__(self, d, data):
+        self.dict = d
+        self.data = data
+
+
+class _Keyword(str):
+    """Bare keyword, for example `endobj`."""
+
+
+OptimizationReport = collections.namedtuple(
+    'OptimizationReport',
+    ['path', 'size_before', 'size_after',
+     'fonts_not_subset', 'cached'])
+
+
+class Document(object):
+    """PDF document, as a collection of objects.
+
+    @ivar objects: `dict` that maps object numbers to objects
+    @ivar trailer: trailer dictionary
+    @ivar version: PDF version `str`, for example `'1.5'`
+    """
+
+    def __init__(self, objects, trailer, version='1.5'):
+        self.objects = objects
+        self.trailer = trailer
+        self.version = version
+
+    def resolve(self, x):
+        """Return object that `x` refers to, if `x` is a `Ref`."""
+        while isinstance(x, Ref):
+            x = self.objects.get(x.num)
+        return x
+
+    def catalog(self):
+        """Return document catalog dictionary."""
+        return self.resolve(self.trailer.get('Root'))
+
+    def pages(self):
+        """Return `list` of page dictionaries, in order."""
+        pages = list()
+        stack = [self.resolve(self.catalog().get('Pages'))]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, dict):
+                continue
+            if node.get('Type') == 'Page':
+                pages.append(node)
+                continue
+            kids = self.resolve(node.get('Kids', list()))
+            stack.extend(
+                self.resolve(k) for k in reversed(kids))
+        return pages
+
+    def dumps(self):
+        """Return PDF file contents as `bytes`.
+
+        Only objects reachable from the trailer are written,
+        and they are renumbered consecutively.
+        """
+        order = _reachable(self.objects, self.trailer)
+        renumber = {num: i + 1 for i, num in enumerate(order)}
+        header = '%PDF-{v}\n'.format(v=self.version).encode('ascii')
+        out = bytearray(header + b'%\xb5\xed\xae\xfb\n')
+        offsets = list()
+        for num in order:
+            obj = _renumber(self.objects[num], renumber)
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % renumber[num]
+            out += _dumps_indirect(obj)
+            out += b'\nendobj\n'
+        xref = len(out)
+        size = len(order) + 1
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % size
+        for offset in offsets:
+            out += b'%010d 00000 n \n' % offset
+        trailer = {
+            k: v for k, v in self.trailer.items()
+            if k in ('Root', 'Info', 'ID')}
+        trailer = _renumber(trailer, renumber)
+        trailer['Size'] = size
+        out += b'trailer\n' + dumps(trailer)
+        out += b'\nstartxref\n%d\n%%%%EOF\n' % xref
+        return bytes(out)
+
+
+def read(path):
+    """Return `Document` parsed from PDF file `path`.
+
+    @type path: `str`
+    @rtype: `Document`
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return loads(data)
+
+
+def loads(data):
+    """Return `Document` parsed from `data`.
+
+    The file is scanned for indirect objects, instead of relying on
+    cross-reference tables, so incremental updates and slightly
+    damaged files are read too. Object streams are expanded.
+
+    @type data: `bytes`
+    @rtype: `Document`
+    """
+    m = re.match(br'%PDF-(\d\.\d)', data)
+    if m is None:
+        raise ValueError('not a PDF file')
+    version = m.group(1).decode('ascii')
+    objects = dict()
+    trailer = dict()
+    pos = m.end()
+    while True:
+        m = _RX_OBJ.search(data, pos)
+        if m is None:
+            break
+        num = int(m.group(1))
+        lexer = _Lexer(data, m.end())
+        try:
+            obj = lexer.parse_indirect()
+        except ValueError:
+            pos = m.end()
+            continue
+        pos = lexer.pos
+        if isinstance(obj, Stream) and obj.dict.get('Type') == 'XRef':
+            trailer.update(obj.dict)
+            continue
+        objects[num] = obj
+    for m in _RX_TRAILER.finditer(data):
+        lexer = _Lexer(data, m.end() - 2)
+        trailer.update(lexer.parse_object())
+    _expand_object_streams(objects)
+    for k in ('Type', 'Size', 'Index', 'W', 'Filter',
+              'DecodeParms', 'Length', 'Prev', 'XRefStm'):
+        trailer.pop(k, None)
+    if 'Root' not in trailer:
+        raise ValueError('PDF file has no document catalog')
+    return Document(objects, trailer, version)
+
+
+def _expand_object_streams(objects):
+    """Move objects out of object streams, in place."""
+    streams = [
+        num for num, obj in objects.items()
+        if isinstance(obj, Stream) and obj.dict.get('Type') == 'ObjStm']
+    for num in streams:
+        stm = objects.pop(num)
+        data = decode_stream(stm)
+        n = stm.dict['N']
+        first = stm.dict['First']
+        lexer = _Lexer(data, 0)
+        pairs = [(lexer.parse_object(), lexer.parse_object())
+                 for _ in range(n)]
+        for objnum, offset in pairs:
+            if objnum in objects:
+                continue
+            lexer = _Lexer(data, first + offset)
+            objects[objnum] = lexer.parse_object()
+
+
+def decode_stream(stream):
+    """Return decoded contents of `stream`.
+
+    Only the filter `FlateDecode` without predictors is supported.
+
+    @type stream: `Stream`
+    @rtype: `bytes`
+    """
+    filters = _stream_filters(stream)
+    if filters is None:
+        raise ValueError('unsupported stream encoding')
+    data = stream.data
+    for _ in filters:
+        data = zlib.decompress(data)
+    return data
+
+
+def _stream_filters(stream):
+    """Return `list` of filters if all are `FlateDecode`, else `None`."""
+    d = stream.dict
+    if d.get('DecodeParms') is not None:
+        return None
+    filters = d.get('Filter')
+    if filters is None:
+        return list()
+    if not isinstance(filters, list):
+        filters = [filters]
+    if any(f != 'FlateDecode' for f in filters):
+        return None
+    return filters
+
+
+def page_box(path):
+    """Return `(x0, y0, x1, y1)` of the first page of PDF file `path`.
+
+    This is the `CropBox` of the page if it has one, else the
+    `MediaBox`, in big points (bp). Only the end of the file, the
+    cross-reference sections, and the objects from the catalog to
+    the page are read, by seeking in the file. If the cross-reference
+    sections cannot be used, then the whole file is parsed.
+
+    @type path: `str`
+    @rtype: `tuple` of `float`
+    """
+    with open(path, 'rb') as f:
+        return _page_box(f, read, path)
+
+
+def loads_page_box(data):
+    """Return box of the first page of PDF `data`, see `page_box`.
+
+    @type data: `bytes`
+    @rtype: `tuple` of `float`
+    """
+    return _page_box(io.BytesIO(data), loads, data)
+
+
+def _page_box(f, parse, source):
+    """Return box of the first page of PDF file object `f`.
+
+    @param parse: called with `source` to parse the whole file,
+        if the cross-reference sections cannot be used
+    """
+    try:
+        reader = _XRefReader(f)
+        box = reader.page_box()
+    except (ValueError, LookupError, TypeError,
+            AttributeError, zlib.error):
+        doc = parse(source)
+        box = _inherited_box(doc.resolve, doc.pages()[0])
+    x0, y0, x1, y1 = (float(v) for v in box)
+    return x0, y0, x1, y1
+
+
+def _inherited_box(resolve, page):
+    """Return `CropBox`, else `MediaBox` of `page`, maybe inherited.
+
+    @param resolve: callable that returns the object that
+        a `Ref` refers to
+    @type page: `dict`
+    @rtype: `list`
+    """
+    for key in ('CropBox', 'MediaBox'):
+        node = page
+        for _ in range(_MAX_DEPTH):
+            if not isinstance(node, dict):
+                break
+            box = resolve(node.get(key))
+            if box is not None:
+                return [resolve(v) for v in box]
+            node = resolve(node.get('Parent'))
+    raise ValueError('page has no MediaBox')
+
+
+class _XRefReader(object):
+    """Reader of objects of a PDF file, using cross-references.
+
+    Both cross-reference tables and streams are read,
+    following `Prev` to earlier sections.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        f.seek(0, os.SEEK_END)
+        self.size = f.tell()
+        f.seek(max(0, self.size - _TAIL_SIZE))
+        tail = f.read()
+        matches = list(_RX_STARTXREF.finditer(tail))
+        if not matches:
+            raise ValueError('no "startxref" at the end of file')
+        # maps object numbers to offsets, or to
+        # `(object stream number, index)`
+        self.entries = dict()
+        self.trailer = dict()
+        self._objects = dict()
+        self._read_sections(int(matches[-1].group(1)))
+
+    def page_box(self):
+        """Return box of first page, see `page_box`."""
+        catalog = self.resolve(self.trailer['Root'])
+        node = self.resolve(catalog['Pages'])
+        for _ in range(_MAX_DEPTH):
+            if node.get('Type') == 'Page':
+                return _inherited_box(self.resolve, node)
+            node = self.resolve(self.resolve(node['Kids'])[0])
+        raise ValueError('page tree too deep')
+
+    def resolve(self, x):
+        """Return object that `x` refers to, if `x` is a `Ref`."""
+        while isinstance(x, Ref):
+            x = self.get(x.num)
+        return x
+
+    def get(self, num):
+        """Return object with number `num`, or `None`."""
+        if num in self._objects:
+            return self._objects[num]
+        entry = self.entries.get(num)
+        if entry is None:
+            obj = None
+        elif isinstance(entry, tuple):
+            stm_num, index = entry
+            obj = self._from_object_stream(self.get(stm_num), index)
+        else:
+            obj = self._parse(entry, _parse_numbered)
+        self._objects[num] = obj
+        return obj
+
+    def _read_sections(self, offset):
+        """Read cross-reference sections, from latest to earliest."""
+        seen = set()
+        pending = [offset]
+        while pending:
+            offset = pending.pop()
+            if offset in seen:
+                continue
+            seen.add(offset)
+            section = self._parse(offset, _parse_xref_section)
+            entries, trailer = section
+            # later sections override earlier ones
+            for num, entry in entries.items():
+                self.entries.setdefault(num, entry)
+            for k, v in trailer.items():
+                self.trailer.setdefault(k, v)
+            for key in ('Prev', 'XRefStm'):
+                if isinstance(trailer.get(key), int):
+                    pending.append(trailer[key])
+
+    def _parse(self, offset, parse):
+        """Return `parse(lexer)` for data that starts at `offset`.
+
+        Data are read in increasing chunks,
+        until `parse` succeeds, or the file ends.
+        """
+        n = _CHUNK_SIZE
+        while True:
+            self.f.seek(offset)
+            data = self.f.read(n)
+            try:
+                return parse(_Lexer(data, 0))
+            except (ValueError, IndexError, AttributeError):
+                if offset + len(data) >= self.size:
+                    raise
+            n *= 4
+
+    def _from_object_stream(self, stm, index):
+        """Return object at `index` in object stream `stm`."""
+        data = decode_stream(stm)
+        lexer = _Lexer(data, 0)
+        pairs = [
+            (lexer.parse_object(), lexer.parse_object())
+            for _ in range(stm.dict['N'])]
+        _, offset = pairs[index]
+        lexer = _Lexer(data, stm.dict['First'] + offset)
+        return lexer.parse_object()
+
+
+def _parse_numbered(lexer):
+    """Return indirect object `N G obj ... endobj` at `lexer.pos`."""
+    lexer.skip_space()
+    m = _RX_OBJ.match(lexer.data, lexer.pos)
+    if m is None:
+        raise ValueError('expected object at {p}'.format(p=lexer.pos))
+    lexer.pos = m.end()
+    return lexer.parse_indirect()
+
+
+def _parse_xref_section(lexer):
+    """Return entries and trailer of cross-reference section.
+
+    @return: `(entries, trailer)`, with `entries` as in `_XRefReader`
+    @rtype: `tuple`
+    """
+    lexer.skip_space()
+    data = lexer.data
+    if not data.startswith(b'xref', lexer.pos):
+        stream = _parse_numbered(lexer)
+        if not isinstance(stream, Stream):
+            raise ValueError('expected cross-reference stream')
+        return _xref_stream_entries(stream), stream.dict
+    lexer.pos += len(b'xref')
+    entries = dict()
+    while True:
+        lexer.skip_space()
+        if data.startswith(b'trailer', lexer.pos):
+            lexer.pos += len(b'trailer')
+            trailer = lexer.parse_object()
+            return entries, trailer
+        m = _RX_XREF_SUBSECTION.match(data, lexer.pos)
+        if m is None:
+            raise ValueError('bad cross-reference table')
+        start, count = int(m.group(1)), int(m.group(2))
+        pos = m.end()
+        for num in range(start, start + count):
+            m = _RX_XREF_ENTRY.match(data, pos)
+            if m is None:
+                raise ValueError('bad cross-reference entry')
+            pos = m.end()
+            if m.group(3) == b'n':
+                entries[num] = int(m.group(1))
+        lexer.pos = pos
+
+
+def _xref_stream_entries(stream):
+    """Return entries of cross-reference stream, as in `_XRefReader`."""
+    data = _decode_with_predictor(stream)
+    widths = stream.dict['W']
+    size = stream.dict['Size']
+    index = stream.dict.get('Index', [0, size])
+    row = sum(widths)
+    entries = dict()
+    pos = 0
+    for i in range(0, len(index), 2):
+        start, count = index[i], index[i + 1]
+        for num in range(start, start + count):
+            fields = list()
+            for w in widths:
+                fields.append(int.from_bytes(data[pos:pos + w], 'big'))
+                pos += w
+            kind = fields[0] if widths[0] else 1
+            if kind == 1:
+                entries[num] = fields[1]
+            elif kind == 2:
+                entries[num] = (fields[1], fields[2])
+    if pos > len(data) or row == 0:
+        raise ValueError('bad cross-reference stream')
+    return entries
+
+
+def _decode_with_predictor(stream):
+    """Return decoded `stream`, undoing PNG predictors.
+
+    Cross-reference streams are often encoded with PNG predictors,
+    which `decode_stream` does not support.
+    """
+    parms = stream.dict.get('DecodeParms')
+    if parms is None:
+        return decode_stream(stream)
+    if isinstance(parms, list):
+        parms = parms[0]
+    d = dict(stream.dict)
+    d.pop('DecodeParms')
+    data = decode_stream(Stream(d, stream.data))
+    predictor = parms.get('Predictor', 1)
+    if predictor == 1:
+        return data
+    if predictor < 10:
+        raise ValueError('unsupported predictor {p}'.format(p=predictor))
+    columns = parms.get('Columns', 1)
+    out = bytearray()
+    prev = bytearray(columns)
+    for i in range(0, len(data), columns + 1):
+        kind = data[i]
+        line = bytearray(data[i + 1:i + 1 + columns])
+        if kind == 0:
+            pass
+        elif kind == 1:
+            for j in range(1, len(line)):
+                line[j] = (line[j] + line[j - 1]) & 0xff
+        elif kind == 2:
+            for j in range(len(line)):
+                line[j] = (line[j] + prev[j]) & 0xff
+        else:
+            raise ValueError('unsupported PNG predictor {k}'.format(k=kind))
+        out += line
+        prev = line
+    return bytes(out)
+
+
+def optimize(doc):
+    """Optimize `doc` in place, and return names of fonts not subset.
+
+    @type doc: `Document`
+    @rtype: `list` of `str`
+    """
+    _strip_metadata(doc)
+    for num in _reachable(doc.objects, doc.trailer):
+        obj = doc.objects[num]
+        if isinstance(obj, Stream):
+            _recompress(obj)
+    _merge_duplicates(doc)
+    return _fonts_not_subset(doc)
+
+
+def _strip_metadata(doc):
+    """Remove metadata that are not needed for including figures."""
+    doc.trailer.pop('Info', None)
+    catalog = doc.catalog()
+    for k in _CATALOG_METADATA:
+        catalog.pop(k, None)
+    for page in doc.pages():
+        for k in _PAGE_METADATA:
+            page.pop(k, None)
+
+
+def _recompress(stream):
+    """Compress `stream` with maximum compression, if that is smaller."""
+    filters = _stream_filters(stream)
+    if filters is None:
+        return
+    try:
+        raw = decode_stream(stream)
+    except zlib.error:
+        return
+    data = zlib.compress(raw, _ZLIB_LEVEL)
+    if len(data) >= len(stream.data):
+        return
+    stream.data = data
+    stream.dict['Filter'] = Name('FlateDecode')
+    stream.dict.pop('Length', None)
+
+
+def _merge_duplicates(doc):
+    """Replace references to identical objects with one reference.
+
+    Merging is repeated, because merging objects can make
+    other objects (that refer to the merged ones) identical.
+    """
+    while True:
+        seen = dict()
+        renumber = dict()
+        for num in sorted(_reachable(doc.objects, doc.trailer)):
+            obj = doc.objects[num]
+            if isinstance(obj, dict) and obj.get('Type') in (
+                    'Page', 'Pages', 'Catalog'):
+                continue
+            key = _dumps_indirect(obj)
+            if key in seen:
+                renumber[num] = seen[key]
+            else:
+                seen[key] = num
+        if not renumber:
+            return
+        mapping = {num: num for num in doc.objects}
+        mapping.update(renumber)
+        for num in renumber:
+            del doc.objects[num]
+        for num, obj in doc.objects.items():
+            doc.objects[num] = _renumber(obj, mapping)
+        doc.trailer = _renumber(doc.trailer, mapping)
+
+
+def _fonts_not_subset(doc):
+    """Return names of embedded fonts that are not subset."""
+    names = set()
+    for num in _reachable(doc.objects, doc.trailer):
+        obj = doc.objects[num]
+        if not isinstance(obj, dict):
+            continue
+        if obj.get('Type') != 'FontDescriptor':
+            continue
+        if not any(k in obj for k in _FONT_FILES):
+            continue
+        name = str(obj.get('FontName', ''))
+        if _RX_SUBSET_TAG.match(name) is None:
+            names.add(name)
+    return sorted(names)
+
+
+def optimize_file(path, use_cache=True):
+    """Optimize PDF file `path` in place, and return report.
+
+    The file is rewritten only if the result is smaller.
+    The digests of optimized files are recorded in the cache,
+    so files that are already optimized are left alone.
+
+    @type path: `str`
+    @param use_cache: if `False`, then optimize regardless of cache
+    @rtype: `OptimizationReport`
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = len(data)
+    marker_dir = cache.cache_dir('optimized-pdf')
+    digest = cache.bytes_digest(data)
+    marker = os.path.join(marker_dir, digest)
+    if use_cache and os.path.isfile(marker):
+        return OptimizationReport(
+            path=path, size_before=size, size_after=size,
+            fonts_not_subset=list(), cached=True)
+    doc = loads(data)
+    fonts = optimize(doc)
+    out = doc.dumps()
+    if len(out) < size:
+        cache.atomic_write(path, out)
+        data = out
+        digest = cache.bytes_digest(data)
+        marker = os.path.join(marker_dir, digest)
+    with open(marker, 'w'):
+        pass
+    return OptimizationReport(
+        path=path, size_before=size, size_after=len(data),
+        fonts_not_subset=fonts, cached=False)
+
+
+def optimize_files(paths, jobs=None, use_cache=True):
+    """Optimize PDF files `paths` in parallel, and return reports.
+
+    @type paths: iterable of `str`
+    @param jobs: number of worker processes,
+        if `None`, then the number of processors
+    @rtype: `list` of `OptimizationReport`
+    """
+    paths = list(paths)
+    if not paths:
+        return list()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs) as executor:
+        futures = [
+            executor.submit(optimize_file, path, use_cache)
+            for path in paths]
+        return [f.result() for f in futures]
+
+
+def split_pages(doc):
+    """Return a `Document` for each page of `doc`, in order.
+
+    Attributes that a page inherits from the page tree are copied
+    to the page. Annotations are removed, because they can refer
+    to other pages (and `\\includegraphics` ignores them).
+    Each document shares the objects of `doc`, and contains only
+    those reachable from its page when written (see `Document.dumps`).
+
+    @type doc: `Document`
+    @rtype: `list` of `Document`
+    """
+    docs = list()
+    free = max(doc.objects, default=0) + 1
+    page_num, pages_num, catalog_num = free, free + 1, free + 2
+    for page in doc.pages():
+        new_page = dict(page)
+        for key in _INHERITABLE:
+            node = page
+            for _ in range(_MAX_DEPTH):
+                if not isinstance(node, dict) or key in node:
+                    break
+                node = doc.resolve(node.get('Parent'))
+            if isinstance(node, dict) and key in node:
+                new_page[key] = node[key]
+        for key in _PAGE_LINKS:
+            new_page.pop(key, None)
+        new_page['Parent'] = Ref(pages_num, 0)
+        objects = dict(doc.objects)
+        objects[page_num] = new_page
+        objects[pages_num] = {
+            'Type': Name('Pages'),
+            'Kids': [Ref(page_num, 0)],
+            'Count': 1}
+        objects[catalog_num] = {
+            'Type': Name('Catalog'),
+            'Pages': Ref(pages_num, 0)}
+        trailer = {'Root': Ref(catalog_num, 0)}
+        if 'Info' in doc.trailer:
+            trailer['Info'] = doc.trailer['Info']
+        docs.append(Document(objects, trailer, doc.version))
+    return docs
+
+
+def make_deterministic(doc, epoch=None):
+    """Remove or fix volatile metadata of `doc`, in place.
+
+    Creation and modification dates are set to `epoch`, or removed
+    if `epoch` is `None`. XMP metadata (which contain dates and
+    random identifiers) are removed. The file identifier is
+    replaced by a digest of the document.
+
+    @type doc: `Document`
+    @param epoch: seconds since 1970-01-01 00:00:00 UTC
+    @type epoch: `int` or `None`
+    """
+    info = doc.resolve(doc.trailer.get('Info'))
+    if isinstance(info, dict):
+        for k in ('CreationDate', 'ModDate'):
+            if k not in info:
+                continue
+            if epoch is None:
+                del info[k]
+            else:
+                info[k] = pdf_date(epoch)
+    doc.catalog().pop('Metadata', None)
+    doc.trailer.pop('ID', None)
+    digest = hashlib.md5(doc.dumps()).digest()
+    doc.trailer['ID'] = [digest, digest]
+
+
+def make_file_deterministic(path, epoch=None):
+    """Rewrite PDF file `path` as described in `make_deterministic`.
+
+    @type path: `str`
+    @type epoch: `int` or `None`
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    doc = loads(data)
+    make_deterministic(doc, epoch)
+    out = doc.dumps()
+    if out != data:
+        cache.atomic_write(path, out)
+
+
+def pdf_date(epoch):
+    """Return PDF date string for `epoch`, in UTC.
+
+    @param epoch: seconds since 1970-01-01 00:00:00 UTC
+    @rtype: `bytes`
+    """
+    s = time.strftime("D:%Y%m%d%H%M%S+00'00'", time.gmtime(epoch))
+    return s.encode('ascii')
+
+
+def _reachable(objects, trailer):
+    """Return numbers of objects reachable from `trailer`, in order.
+
+    The order is breadth-first, starting from the trailer,
+    and visiting dictionary entries sorted by key.
+    """
+    order = list()
+    visited = set()
+    queue = collections.deque(_refs(trailer))
+    while queue:
+        num = queue.popleft()
+        if num in visited or num not in objects:
+            continue
+        visited.add(num)
+        order.append(num)
+        queue.extend(_refs(objects[num]))
+    return order
+
+
+def _refs(obj):
+    """Yield numbers of objects that `obj` refers to."""
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, Ref):
+            yield x.num
+        elif isinstance(x, Stream):
+            stack.append(x.dict)
+        elif isinstance(x, dict):
+            stack.extend(v for _, v in sorted(x.items(), reverse=True))
+        elif isinstance(x, list):
+            stack.extend(reversed(x))
+
+
+def _renumber(obj, mapping):
+    """Return copy of `obj` with references renumbered by `mapping`.
+
+    References to objects missing from `mapping` become `null`.
+    """
+    if isinstance(obj, Ref):
+        num = mapping.get(obj.num)
+        if num is None:
+            return None
+        return Ref(num, 0)
+    elif isinstance(obj, Stream):
+        return Stream(_renumber(obj.dict, mapping), obj.data)
+    elif isinstance(obj, dict):
+        return {k: _renumber(v, mapping) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_renumber(x, mapping) for x in obj]
+    return obj
+
+
+def dumps(obj):
+    """Return PDF syntax for direct object `obj`.
+
+    @rtype: `bytes`
+    """
+    if obj is None:
+        return b'null'
+    elif obj is True:
+        return b'true'
+    elif obj is False:
+        return b'false'
+    elif isinstance(obj, int):
+        return b'%d' % obj
+    elif isinstance(obj, float):
+        return format_real(obj).encode('ascii')
+    elif isinstance(obj, Name):
+        return b'/' + _escape_name(obj)
+    elif isinstance(obj, (bytes, bytearray)):
+        return _dumps_string(obj)
+    elif isinstance(obj, Ref):
+        return b'%d %d R' % (obj.num, obj.gen)
+    elif isinstance(obj, list):
+        return b'[' + b' '.join(dumps(x) for x in obj) + b']'
+    elif isinstance(obj, dict):
+        items = (
+            b'/' + _escape_name(k) + b' ' + dumps(v)
+            for k, v in sorted(obj.items()))
+        return b'<<' + b' '.join(items) + b'>>'
+    raise TypeError(obj)
+
+
+def _dumps_indirect(obj):
+    """Return PDF syntax for body of indirect object `obj`."""
+    if not isinstance(obj, Stream):
+        return dumps(obj)
+    d = dict(obj.dict)
+    d['Length'] = len(obj.data)
+    return dumps(d) + b'\nstream\n' + obj.data + b'\nendstream'
+
+
+def format_real(x):
+    """Return PDF syntax for real number `x`.
+
+    PDF does not allow exponential notation.
+
+    @type x: `float`
+    @rtype: `str`
+    """
+    s = '{x:.6f}'.format(x=x).rstrip('0').rstrip('.')
+    if s in ('-0', ''):
+        s = '0'
+    return s
+
+
+def _escape_name(name):
+    """Return `name` encoded for PDF syntax."""
+    out = bytearray()
+    for c in name.encode('utf-8'):
+        if c < 0x21 or c > 0x7e or c in _DELIMITERS or c == ord('#'):
+            out += b'#%02X' % c
+        else:
+            out.append(c)
+    return bytes(out)
+
+
+def _dumps_string(s):
+    """Return PDF literal string for `s`."""
+    out = bytearray(b'(')
+    for c in s:
+        if c in b'()\\':
+            out += b'\\' + bytes([c])
+        elif c < 0x20 or c > 0x7e:
+            out += b'\\%03o' % c
+        else:
+            out.append(c)
+    out += b')'
+    return bytes(out)
+
+
+class _Lexer(object):
+    """Parser of PDF objects from `bytes`."""
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip_space(self):
+        """Advance past whitespace and comments."""
+        data = self.data
+        n = len(data)
+        while self.pos < n:
+            c = data[self.pos]
+            if c in _WHITESPACE:
+                self.pos += 1
+            elif c == 0x25:  # %
+                while self.pos < n and data[self.pos] not in b'\r\n':
+                    self.pos += 1
+            else:
+                break
+
+    def parse_indirect(self):
+        """Return body of indirect object that starts at `self.pos`."""
+        obj = self.parse_object()
+        self.skip_space()
+        if self.data.startswith(b'stream', self.pos):
+            obj = self._parse_stream(obj)
+            self.skip_space()
+        if not self.data.startswith(b'endobj', self.pos):
+            raise ValueError('expected "endobj" at {p}'.format(p=self.pos))
+        self.pos += len(b'endobj')
+        return obj
+
+    def _parse_stream(self, d):
+        """Return `Stream` with dictionary `d`."""
+        data = self.data
+        start = self.pos + len(b'stream')
+        if data.startswith(b'\r\n', start):
+            start += 2
+        elif data.startswith(b'\n', start) or data.startswith(
+                b'\r', start):
+            start += 1
+        length = d.get('Length')
+        end = None
+        if isinstance(length, int):
+            end = start + length
+            lexer = _Lexer(data, end)
+            lexer.skip_space()
+            if not data.startswith(b'endstream', lexer.pos):
+                end = None
+        if end is None:
+            end = data.find(b'endstream', start)
+            if end < 0:
+                raise ValueError('stream without "endstream"')
+            self.pos = end + len(b'endstream')
+            if data.startswith(b'\r\n', end - 2):
+                end -= 2
+            elif data[end - 1] in b'\r\n':
+                end -= 1
+        else:
+            self.pos = lexer.pos + len(b'endstream')
+        return Stream(d, data[start:end])
+
+    def parse_object(self):
+        """Return next direct object."""
+        self.skip_space()
+        data = self.data
+        if self.pos >= len(data):
+            raise ValueError('unexpected end of data')
+        c = data[self.pos:self.pos + 1]
+        if c == b'/':
+            return self._parse_name()
+        elif c == b'(':
+            return self._parse_literal_string()
+        elif data.startswith(b'<<', self.pos):
+            return self._parse_dict()
+        elif c == b'<':
+            return self._parse_hex_string()
+        elif c == b'[':
+            return self._parse_array()
+        elif c in (b']', b'>', b')', b'{', b'}'):
+            raise ValueError('unexpected delimiter {c!r}'.format(c=c))
+        return self._parse_token()
+
+    def _parse_token(self):
+        m = _RX_REGULAR.match(self.data, self.pos)
+        token = m.group()
+        self.pos = m.end()
+        if _RX_INT.match(token):
+            num = int(token)
+            ref = self._parse_ref_tail(num)
+            if ref is not None:
+                return ref
+            return num
+        elif _RX_REAL.match(token):
+            return float(token)
+        elif token == b'true':
+            return True
+        elif token == b'false':
+            return False
+        elif token == b'null':
+            return None
+        return _Keyword(token.decode('latin-1'))
+
+    def _parse_ref_tail(self, num):
+        """Return `Ref` if `num` is followed by `gen R`, else `None`."""
+        pos = self.pos
+        self.skip_space()
+        m = _RX_REGULAR.match(self.data, self.pos)
+        if m is not None and _RX_INT.match(m.group()):
+            gen = int(m.group())
+            self.pos = m.end()
+            self.skip_space()
+            m = _RX_REGULAR.match(self.data, self.pos)
+            if m is not None and m.group() == b'R':
+                self.pos = m.end()
+                return Ref(num, gen)
+        self.pos = pos
+        return None
+
+    def _parse_name(self):
+        m = _RX_REGULAR.match(self.data, self.pos + 1)
+        if m is None:
+            self.pos += 1
+            return Name('')
+        raw = m.group()
+        self.pos = m.end()
+        if b'#' in raw:
+            raw = re.sub(
+                br'#([0-9A-Fa-f]{2})',
+                lambda x: bytes([int(x.group(1), 16)]), raw)
+        return Name(raw.decode('utf-8', 'replace'))
+
+    def _parse_literal_string(self):
+        data = self.data
+        pos = self.pos + 1
+        depth = 1
+        out = bytearray()
+        while True:
+            c = data[pos]
+            pos += 1
+            if c == 0x5c:  # backslash
+                e = data[pos]
+                pos += 1
+                if e in _STRING_ESCAPES:
+                    out += _STRING_ESCAPES[e]
+                elif 0x30 <= e <= 0x37:
+                    digits = bytes([e])
+                    while len(digits) < 3 and 0x30 <= data[pos] <= 0x37:
+                        digits += data[pos:pos + 1]
+                        pos += 1
+                    out.append(int(digits, 8) & 0xff)
+                elif e == 0x0d:
+                    if data[pos] == 0x0a:
+                        pos += 1
+                elif e == 0x0a:
+                    pass
+                else:
+                    out.append(e)
+            elif c == 0x28:  # (
+                depth += 1
+                out.append(c)
+            elif c == 0x29:  # )
+                depth -= 1
+                if depth == 0:
+                    break
+                out.append(c)
+            else:
+                out.append(c)
+        self.pos = pos
+        return bytes(out)
+
+    def _parse_hex_string(self):
+        end = self.data.index(b'>', self.pos)
+        digits = re.sub(br'\s', b'', self.data[self.pos + 1:end])
+        if len(digits) % 2:
+            digits += b'0'
+        self.pos = end + 1
+        return bytes.fromhex(digits.decode('ascii'))
+
+    def _parse_array(self):
+        self.pos += 1
+        items = list()
+        while True:
+            self.skip_space()
+            if self.data.startswith(b']', self.pos):
+                self.pos += 1
+                return items
+            items.append(self.parse_object())
+
+    def _parse_dict(self):
+        self.pos += 2
+        d = dict()
+        while True:
+            self.skip_space()
+            if self.data.startswith(b'>>', self.pos):
+                self.pos += 2
+                return d
+            key = self.parse_object()
+            if not isinstance(key, Name):
+                raise ValueError(
+                    'dictionary key is not a name: {k!r}'.format(k=key))
+            d[str(key)] = self.parse_object()
@@ -0,0 +1,240 @@
+"""Simplification of long polylines in SVG, before export.
+
+Plots exported by plotting programs often contain paths with many
+thousands of vertices, closer to each other than can be seen at the
+printed size. Such paths slow down parsing, exporting, and rendering
+the PDF. Here, paths drawn only with straight segments (`path` with
+commands `M`, `L`, `H`, `V`, `Z`, `polyline`, and `polygon`) are
+simplified with the Douglas-Peucker algorithm, so that the simplified
+line is within a tolerance of the original one.
+
+The tolerance is in bp (PostScript points) of the output, measured
+after the transformations of each element (see
+`svgpdf.element_transform`). Paths with curves, arcs, or markers,
+and short paths, are not changed. Text is not changed.
+
+Distances are computed with NumPy, if it is installed.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import logging
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from svglatex import pdf
+from svglatex import svgpdf
+
+
+log = logging.getLogger(__name__)
+# bp per px
+_BP_PER_PX = 72.0 / svgpdf.DPI
+# paths with fewer vertices are not simplified
+_MIN_VERTICES = 64
+_SVG_NS = '{http://www.w3.org/2000/svg}'
+# vertices before and after simplification
+Reduction = collections.namedtuple(
+    'Reduction', ['paths', 'before', 'after'])
+
+
+def simplify_paths(svg_data, tolerance):
+    """Simplify long polylines in `svg_data`, in place.
+
+    @type svg_data: `lxml.etree._ElementTree`
+    @param tolerance: largest distance between the original and the
+        simplified lines, in bp
+    @type tolerance: `float`
+    @rtype: `Reduction`
+    """
+    paths = before = after = 0
+    root = svg_data.getroot()
+    for el in root.iter(
+            _SVG_NS + 'path', _SVG_NS + 'polyline', _SVG_NS + 'polygon'):
+        if _has_markers(el):
+            continue
+        try:
+            r = _simplify_element(el, tolerance / _BP_PER_PX)
+        except svgpdf.Unsupported as e:
+            log.info('Not simplifying `{i}`: {e}'.format(
+                i=el.attrib.get('id'), e=e))
+            continue
+        if r is None:
+            continue
+        paths += 1
+        before += r[0]
+        after += r[1]
+    reduction = Reduction(paths, before, after)
+    if paths:
+        log.info(
+            'Simplified {n} paths from {a} to {b} vertices '
+            '({p:0.1f} % fewer).'.format(
+                n=paths, a=before, b=after,
+                p=100.0 * (before - after) / before))
+    return reduction
+
+
+def _simplify_element(el, tolerance):
+    """Simplify `el`, and return vertices before and after.
+
+    Return `None` if `el` is not changed.
+
+    @param tolerance: in px
+    @rtype: `tuple` or `None`
+    """
+    polygon = el.tag == _SVG_NS + 'polygon'
+    if el.tag == _SVG_NS + 'path':
+        ops = svgpdf.parse_path(el.attrib.get('d', ''))
+        subpaths = _subpaths(ops)
+    else:
+        points = svgpdf.parse_points(el.attrib.get('points', ''))
+        subpaths = [(points, polygon)] if points else None
+    if not subpaths:
+        return None
+    before = sum(len(points) for points, _ in subpaths)
+    if before < _MIN_VERTICES:
+        return None
+    a, b, c, d, e, f = svgpdf.element_transform(el)
+    simplified = list()
+    for points, closed in subpaths:
+        if len(points) > 2:
+            ctm_points = [
+                (a * x + c * y + e, b * x + d * y + f)
+                for x, y in points]
+            keep = douglas_peucker(ctm_points, tolerance)
+            points = [points[i] for i in keep]
+        simplified.append((points, closed))
+    after = sum(len(points) for points, _ in simplified)
+    if after == before:
+        return None
+    if el.tag == _SVG_NS + 'path':
+        el.attrib['d'] = ' '.join(
+            _format_subpath(points, closed)
+            for points, closed in simplified)
+    else:
+        points, _ = simplified[0]
+        el.attrib['points'] = ' '.join(_format_point(p) for p in points)
+    return before, after
+
+
+def _subpaths(ops):
+    """Return `list` of `(points, closed)`, or `None` if curved.
+
+    @param ops: as returned by `svgpdf.parse_path`
+    """
+    subpaths = list()
+    for op in ops:
+        kind = op[0]
+        if kind == 'C':
+            return None
+        if kind == 'M':
+            subpaths.append(([op[1]], False))
+        elif kind == 'L':
+            subpaths[-1][0].append(op[1])
+        else:  # `Z`
+            subpaths[-1] = (subpaths[-1][0], True)
+    return subpaths
+
+
+def _has_markers(el):
+    """Return `True` if `el` or an ancestor may set markers.
+
+    Markers are drawn at vertices, so removing vertices
+    would remove markers.
+    """
+    while el is not None:
+        style = el.attrib.get('style', '')
+        if 'marker' in style or any(
+                key.startswith('marker') for key in el.attrib):
+            return True
+        el = el.getparent()
+    return False
+
+
+def douglas_peucker(points, tolerance):
+    """Return indices of `points` that simplify the line.
+
+    The line through the returned vertices (which include the
+    first and last vertices) is within `tolerance` of the line
+    through `points`.
+
+    @param points: `list` of `(x, y)`
+    @type tolerance: `float`
+    @rtype: `list` of `int`
+    """
+    n = len(points)
+    if numpy is not None:
+        points = numpy.asarray(points, dtype=float)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        k, d = _farthest(points, i, j)
+        if d > tolerance:
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return [i for i in range(n) if keep[i]]
+
+
+def _farthest(points, i, j):
+    """Return point between `i` and `j` farthest from their segment.
+
+    @return: index of point, and its distance from the segment
+        between `points[i]` and `points[j]`
+    @rtype: `tuple`
+    """
+    if numpy is not None:
+        return _farthest_numpy(points, i, j)
+    ax, ay = points[i]
+    bx, by = points[j]
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    best = (i + 1, -1.0)
+    for k in range(i + 1, j):
+        px, py = points[k]
+        t = 0.0
+        if length2 > 0:
+            t = ((px - ax) * dx + (py - ay) * dy) / length2
+            t = min(max(t, 0.0), 1.0)
+        d = math.hypot(px - ax - t * dx, py - ay - t * dy)
+        if d > best[1]:
+            best = (k, d)
+    return best
+
+
+def _farthest_numpy(points, i, j):
+    """Return `_farthest`, computed with NumPy arrays."""
+    a = points[i]
+    ab = points[j] - a
+    ap = points[i + 1:j] - a
+    length2 = numpy.dot(ab, ab)
+    if length2 > 0:
+        t = numpy.clip(ap.dot(ab) / length2, 0.0, 1.0)
+    else:
+        t = numpy.zeros(len(ap))
+    d = numpy.hypot(*(ap - numpy.outer(t, ab)).T)
+    k = int(numpy.argmax(d))
+    return i + 1 + k, float(d[k])
+
+
+def _format_subpath(points, closed):
+    """Return path data for polyline through `points`."""
+    s = 'M ' + _format_point(points[0])
+    if len(points) > 1:
+        s += ' L ' + ' '.join(_format_point(p) for p in points[1:])
+    if closed:
+        s += ' Z'
+    return s
+
+
+def _format_point(p):
+    return '{x},{y}'.format(
+        x=pdf.format_real(p[0]), y=pdf.format_real(p[1]))
@@ -0,0 +1,919 @@
+"""Export simple SVG drawings to PDF, without Inkscape.
+
+Many figures are diagrams drawn with paths and basic shapes in
+solid colors. The graphics of such figures (with the text removed,
+see `converter._split_text_graphics`) are written here directly as
+the operators of a PDF content stream, each shape with the
+transformations of its ancestors. The page is cropped to the
+drawing area, as by `inkscape --export-area-drawing`: the bounding
+box of the shapes, enlarged by half the width of strokes.
+
+Supported are the elements `path`, `rect`, `circle`, `ellipse`,
+`line`, `polyline`, `polygon`, grouped with `g` (and `a`), with
+`fill` and `stroke` in solid colors, their opacities, and the
+properties of strokes (width, caps, joins, dashes). Other features
+(for example gradients, patterns, markers, clipping, masks, filters,
+images, `use`, or the opacity of groups) raise `Unsupported`, and
+callers then export with `inkscape`.
+
+No external dependencies are needed.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import math
+import re
+import zlib
+
+from svglatex import pdf
+
+
+DPI = 96.0  # px / in
+_BP_PER_PX = 72.0 / DPI
+_SVG_NS = 'http://www.w3.org/2000/svg'
+_SHAPES = (
+    'path', 'rect', 'circle', 'ellipse',
+    'line', 'polyline', 'polygon')
+_GROUPS = ('g', 'a')
+# SVG elements that draw nothing
+_SKIPPED = ('defs', 'title', 'desc', 'metadata')
+# px per unit
+_UNITS = {
+    '': 1.0, 'px': 1.0, 'in': DPI, 'mm': DPI / 25.4,
+    'cm': DPI / 2.54, 'pt': DPI / 72.0, 'pc': DPI / 6.0}
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_RX_LENGTH = re.compile(r'^\s*({n})\s*([a-z]*)\s*$'.format(n=_NUMBER))
+_RX_NUMBER = re.compile(r'[\s,]*({n})'.format(n=_NUMBER))
+_RX_FLAG = re.compile(r'[\s,]*([01])')
+_RX_COMMAND = re.compile(r'[\s,]*([MmZzLlHhVvCcSsQqTtAa])')
+_RX_END = re.compile(r'[\s,]*$')
+_RX_TRANSFORM = re.compile(
+    r'[\s,]*(matrix|translate|scale|rotate|skewX|skewY)'
+    r'\s*\(([^)]*)\)')
+_RX_HEX_COLOR = re.compile(r'^#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
+_RX_RGB_COLOR = re.compile(r'^rgb\(([^)]*)\)$')
+_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255),
+    'red': (255, 0, 0), 'lime': (0, 255, 0), 'blue': (0, 0, 255),
+    'green': (0, 128, 0), 'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255), 'aqua': (0, 255, 255),
+    'magenta': (255, 0, 255), 'fuchsia': (255, 0, 255),
+    'gray': (128, 128, 128), 'grey': (128, 128, 128),
+    'silver': (192, 192, 192), 'maroon': (128, 0, 0),
+    'navy': (0, 0, 128), 'olive': (128, 128, 0),
+    'purple': (128, 0, 128), 'teal': (0, 128, 128),
+    'orange': (255, 165, 0)}
+# inherited properties, with their initial values
+_INHERITED = {
+    'fill': 'black', 'fill-opacity': '1', 'fill-rule': 'nonzero',
+    'stroke': 'none', 'stroke-opacity': '1', 'stroke-width': '1',
+    'stroke-linecap': 'butt', 'stroke-linejoin': 'miter',
+    'stroke-miterlimit': '4', 'stroke-dasharray': 'none',
+    'stroke-dashoffset': '0'}
+# properties supported only at these values
+_RESTRICTED = {
+    'clip-path': ('none',), 'mask': ('none',), 'filter': ('none',),
+    'marker': ('none',), 'marker-start': ('none',),
+    'marker-mid': ('none',), 'marker-end': ('none',),
+    'visibility': ('visible',), 'paint-order': ('normal',),
+    'vector-effect': ('none',), 'mix-blend-mode': ('normal',)}
+_PROPERTIES = set(_INHERITED).union(_RESTRICTED, ('opacity', 'display'))
+_LINECAPS = dict(butt=0, round=1, square=2)
+_LINEJOINS = dict(miter=0, round=1, bevel=2)
+# control points of a quarter of a unit circle
+_KAPPA = 4.0 / 3.0 * (math.sqrt(2.0) - 1.0)
+_IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+class Unsupported(Exception):
+    """SVG uses a feature that is not exported by this module."""
+
+
+def export(svg_data):
+    """Return PDF of the graphics in `svg_data`, and their position.
+
+    Raise `Unsupported` if `svg_data` contains features that are
+    not supported (see module docstring).
+
+    @type svg_data: `lxml.etree._ElementTree`
+    @return: `(data, bbox)`, where `data` is the PDF file as `bytes`,
+        and `bbox` is `(x, y, width, height)` of the drawing area,
+        in px of the SVG document
+    @rtype: `tuple`
+    """
+    root = svg_data.getroot()
+    ctm = _root_transform(root)
+    props = _specified(root)
+    _check_restricted(props)
+    if _opacity(props.get('opacity', '1')) != 1.0:
+        raise Unsupported('opacity of the root element')
+    style = dict(_INHERITED)
+    _inherit(style, props)
+    out = _Content()
+    _draw_children(root, ctm, style, out)
+    if out.bbox is None:
+        raise Unsupported('nothing is drawn')
+    x0, y0, x1, y1 = out.bbox
+    if x1 <= x0 or y1 <= y0:
+        raise Unsupported('drawing area is empty')
+    width = (x1 - x0) * _BP_PER_PX
+    height = (y1 - y0) * _BP_PER_PX
+    # from px, with y downwards, to bp on the page, with y upwards
+    page = (
+        _BP_PER_PX, 0.0, 0.0, - _BP_PER_PX,
+        - x0 * _BP_PER_PX, y1 * _BP_PER_PX)
+    content = '{m} cm\n'.format(m=_format_numbers(page)) + out.dumps()
+    data = _dumps_pdf(content.encode('ascii'), width, height, out.states)
+    bbox = (x0, y0, x1 - x0, y1 - y0)
+    return data, bbox
+
+
+def _dumps_pdf(content, width, height, states):
+    """Return PDF file with one page, drawn by `content`.
+
+    @type content: `bytes`
+    @param width, height: of page, in bp
+    @param states: `dict` that maps `(fill, stroke)` alpha
+        to names of graphics states
+    @rtype: `bytes`
+    """
+    resources = dict()
+    if states:
+        resources['ExtGState'] = {
+            name: {
+                'Type': pdf.Name('ExtGState'),
+                'ca': fill, 'CA': stroke}
+            for (fill, stroke), name in states.items()}
+    stream = pdf.Stream(
+        {'Filter': pdf.Name('FlateDecode')},
+        zlib.compress(content, 9))
+    objects = {
+        1: {'Type': pdf.Name('Catalog'), 'Pages': pdf.Ref(2, 0)},
+        2: {
+            'Type': pdf.Name('Pages'),
+            'Kids': [pdf.Ref(3, 0)], 'Count': 1},
+        3: {
+            'Type': pdf.Name('Page'), 'Parent': pdf.Ref(2, 0),
+            'MediaBox': [0, 0, width, height],
+            'Resources': resources,
+            'Contents': pdf.Ref(4, 0)},
+        4: stream}
+    doc = pdf.Document(objects, {'Root': pdf.Ref(1, 0)}, version='1.4')
+    return doc.dumps()
+
+
+class _Content(object):
+    """Operators of a content stream, and the area they draw.
+
+    @ivar lines: `list` of `str`
+    @ivar states: `dict` that maps `(fill, stroke)` alpha to
+        names of graphics states
+    @ivar bbox: `(x0, y0, x1, y1)` in px, or `None`
+    """
+
+    def __init__(self):
+        self.lines = list()
+        self.states = dict()
+        self.bbox = None
+
+    def add_bbox(self, x0, y0, x1, y1):
+        """Enlarge `self.bbox` to contain the given box."""
+        if self.bbox is not None:
+            bx0, by0, bx1, by1 = self.bbox
+            x0, y0 = min(x0, bx0), min(y0, by0)
+            x1, y1 = max(x1, bx1), max(y1, by1)
+        self.bbox = (x0, y0, x1, y1)
+
+    def state(self, fill, stroke):
+        """Return name of graphics state with alphas `fill, stroke`."""
+        key = (round(fill, 6), round(stroke, 6))
+        if key not in self.states:
+            self.states[key] = 'a{i}'.format(i=len(self.states))
+        return self.states[key]
+
+    def dumps(self):
+        """Return content stream as `str`."""
+        return ''.join(line + '\n' for line in self.lines)
+
+
+def _draw_children(el, ctm, style, out):
+    """Draw children of `el`, with transformation `ctm`.
+
+    @param ctm: from user units of `el` to px of the document
+    @param style: `dict` of properties inherited by the children
+    @type out: `_Content`
+    """
+    for child in el:
+        name = _svg_name(child)
+        if name is None or name in _SKIPPED:
+            continue
+        props = _specified(child)
+        if props.get('display') == 'none':
+            continue
+        _check_restricted(props)
+        child_style = dict(style)
+        _inherit(child_style, props)
+        m = ctm
+        if 'transform' in child.attrib:
+            m = _multiply(ctm, _parse_transform(child.attrib['transform']))
+        opacity = _opacity(props.get('opacity', '1'))
+        if name in _GROUPS:
+            if opacity != 1.0:
+                raise Unsupported('opacity of group')
+            _draw_children(child, m, child_style, out)
+        elif name in _SHAPES:
+            _draw_shape(child, name, m, child_style, opacity, out)
+        else:
+            raise Unsupported('element `{name}`'.format(name=name))
+
+
+def _draw_shape(el, name, ctm, style, opacity, out):
+    """Write operators that paint shape `el` to `out`."""
+    ops = _shape_path(el, name)
+    if not any(op[0] in ('L', 'C') for op in ops):
+        return
+    fill = _parse_paint(style['fill'])
+    stroke = _parse_paint(style['stroke'])
+    width = _length(style['stroke-width'])
+    if width <= 0:
+        stroke = None
+    if fill is None and stroke is None:
+        return
+    fill_alpha = _opacity(style['fill-opacity'])
+    stroke_alpha = _opacity(style['stroke-opacity'])
+    if opacity != 1.0:
+        # on a single paint, the opacity of the element
+        # is the same as the opacity of the paint
+        if fill is not None and stroke is not None:
+            raise Unsupported('opacity of filled and stroked shape')
+        fill_alpha *= opacity
+        stroke_alpha *= opacity
+    a, b, c, d, _, _ = ctm
+    det = a * d - b * c
+    if det == 0:
+        return
+    x0, y0, x1, y1 = _path_bbox(ops, ctm)
+    if stroke is not None:
+        # as Inkscape's visual bounding box
+        r = 0.5 * width * math.sqrt(abs(det))
+        x0, y0, x1, y1 = x0 - r, y0 - r, x1 + r, y1 + r
+    out.add_bbox(x0, y0, x1, y1)
+    lines = ['q', '{m} cm'.format(m=_format_numbers(ctm))]
+    alphas = (
+        fill_alpha if fill is not None else 1.0,
+        stroke_alpha if stroke is not None else 1.0)
+    if alphas != (1.0, 1.0):
+        lines.append('/{s} gs'.format(s=out.state(*alphas)))
+    if fill is not None:
+        lines.append('{c} rg'.format(c=_format_numbers(fill)))
+    if stroke is not None:
+        lines.append('{c} RG'.format(c=_format_numbers(stroke)))
+        lines.extend(_stroke_operators(style, width))
+    lines.extend(_path_operators(ops))
+    evenodd = style['fill-rule'] == 'evenodd'
+    if stroke is None:
+        paint = 'f*' if evenodd else 'f'
+    elif fill is None:
+        paint = 'S'
+    else:
+        paint = 'B*' if evenodd else 'B'
+    lines.extend([paint, 'Q'])
+    out.lines.extend(lines)
+
+
+def _stroke_operators(style, width):
+    """Return operators that set the properties of strokes."""
+    cap = _LINECAPS.get(style['stroke-linecap'])
+    join = _LINEJOINS.get(style['stroke-linejoin'])
+    if cap is None or join is None:
+        raise Unsupported('stroke-linecap or stroke-linejoin')
+    miter = _number(style['stroke-miterlimit'])
+    dashes = _parse_dasharray(style['stroke-dasharray'])
+    offset = _length(style['stroke-dashoffset'])
+    return [
+        '{w} w {cap} J {join} j {m} M'.format(
+            w=pdf.format_real(width), cap=cap, join=join,
+            m=pdf.format_real(max(miter, 1.0))),
+        '[{d}] {o} d'.format(
+            d=_format_numbers(dashes),
+            o=pdf.format_real(offset if dashes else 0.0))]
+
+
+def _parse_dasharray(value):
+    """Return `list` of lengths of dashes and gaps."""
+    if value == 'none':
+        return list()
+    dashes = [_length(x) for x in re.split(r'[\s,]+', value.strip())]
+    if any(x < 0 for x in dashes):
+        raise Unsupported('negative length in stroke-dasharray')
+    if sum(dashes) == 0:
+        return list()
+    if len(dashes) % 2:
+        dashes = dashes + dashes
+    return dashes
+
+
+def _path_operators(ops):
+    """Return path construction operators for `ops`."""
+    lines = list()
+    for op in ops:
+        if op[0] == 'Z':
+            lines.append('h')
+            continue
+        points = ' '.join(
+            _format_numbers(p) for p in op[1:])
+        lines.append('{p} {op}'.format(
+            p=points, op=dict(M='m', L='l', C='c')[op[0]]))
+    return lines
+
+
+def _path_bbox(ops, ctm):
+    """Return bounding box of `ops` transformed by `ctm`.
+
+    `ops` must contain at least one segment.
+
+    @return: `(x0, y0, x1, y1)`
+    """
+    xs = list()
+    ys = list()
+    current = None
+    for op in ops:
+        if op[0] == 'Z':
+            continue
+        points = [_apply(ctm, p) for p in op[1:]]
+        if op[0] == 'M':
+            # a subpath of only `M` draws nothing
+            current = points[0]
+            continue
+        xs.append(current[0])
+        ys.append(current[1])
+        if op[0] == 'C':
+            for axis, values in ((0, xs), (1, ys)):
+                values.extend(_cubic_extrema(
+                    current[axis], points[0][axis],
+                    points[1][axis], points[2][axis]))
+        current = points[-1]
+        xs.append(current[0])
+        ys.append(current[1])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _cubic_extrema(p0, p1, p2, p3):
+    """Return values of a cubic Bezier where its derivative is zero.
+
+    @param p0, p1, p2, p3: coordinates of control points
+        along one axis
+    @rtype: `list` of `float`
+    """
+    # derivative / 3 = a t^2 + b t + c
+    a = - p0 + 3 * p1 - 3 * p2 + p3
+    b = 2 * (p0 - 2 * p1 + p2)
+    c = p1 - p0
+    if abs(a) < 1e-12:
+        roots = [- c / b] if abs(b) > 1e-12 else list()
+    else:
+        disc = b * b - 4 * a * c
+        if disc < 0:
+            return list()
+        sq = math.sqrt(disc)
+        roots = [(- b + sq) / (2 * a), (- b - sq) / (2 * a)]
+    values = list()
+    for t in roots:
+        if 0 < t < 1:
+            s = 1 - t
+            values.append(
+                s ** 3 * p0 + 3 * s * s * t * p1 +
+                3 * s * t * t * p2 + t ** 3 * p3)
+    return values
+
+
+def _shape_path(el, name):
+    """Return path of shape `el`, as `list` of operations.
+
+    Each operation is `('M', p)`, `('L', p)`, `('C', p1, p2, p)`,
+    or `('Z',)`, with absolute points `p = (x, y)`.
+    """
+    attr = el.attrib
+    if name == 'path':
+        return parse_path(attr.get('d', ''))
+    if name == 'rect':
+        return _rect_path(
+            _length(attr.get('x', '0')), _length(attr.get('y', '0')),
+            _length(attr.get('width', '0')),
+            _length(attr.get('height', '0')),
+            attr.get('rx'), attr.get('ry'))
+    if name in ('circle', 'ellipse'):
+        cx = _length(attr.get('cx', '0'))
+        cy = _length(attr.get('cy', '0'))
+        if name == 'circle':
+            rx = ry = _length(attr.get('r', '0'))
+        else:
+            rx = _length(attr.get('rx', '0'))
+            ry = _length(attr.get('ry', '0'))
+        if rx <= 0 or ry <= 0:
+            return list()
+        return _ellipse_path(cx, cy, rx, ry)
+    if name == 'line':
+        return [
+            ('M', (_length(attr.get('x1', '0')),
+                   _length(attr.get('y1', '0')))),
+            ('L', (_length(attr.get('x2', '0')),
+                   _length(attr.get('y2', '0'))))]
+    points = parse_points(attr.get('points', ''))
+    if not points:
+        return list()
+    ops = [('M', points[0])]
+    ops.extend(('L', p) for p in points[1:])
+    if name == 'polygon':
+        ops.append(('Z',))
+    return ops
+
+
+def parse_points(value):
+    """Return `list` of `(x, y)` from attribute `points`.
+
+    Raise `Unsupported` if the number of coordinates is odd.
+
+    @type value: `str`
+    """
+    values = [float(x) for x in re.findall(_NUMBER, value)]
+    if len(values) % 2:
+        raise Unsupported('odd number of coordinates in `points`')
+    return list(zip(values[::2], values[1::2]))
+
+
+def _rect_path(x, y, width, height, rx, ry):
+    """Return path of rectangle, with rounded corners if `rx, ry`."""
+    if width <= 0 or height <= 0:
+        return list()
+    rx = None if rx is None else _length(rx)
+    ry = None if ry is None else _length(ry)
+    if rx is None:
+        rx = ry
+    if ry is None:
+        ry = rx
+    if not rx or not ry or rx < 0 or ry < 0:
+        return [
+            ('M', (x, y)), ('L', (x + width, y)),
+            ('L', (x + width, y + height)), ('L', (x, y + height)),
+            ('Z',)]
+    rx = min(rx, width / 2)
+    ry = min(ry, height / 2)
+    kx = (1 - _KAPPA) * rx
+    ky = (1 - _KAPPA) * ry
+    x1 = x + width
+    y1 = y + height
+    return [
+        ('M', (x + rx, y)),
+        ('L', (x1 - rx, y)),
+        ('C', (x1 - kx, y), (x1, y + ky), (x1, y + ry)),
+        ('L', (x1, y1 - ry)),
+        ('C', (x1, y1 - ky), (x1 - kx, y1), (x1 - rx, y1)),
+        ('L', (x + rx, y1)),
+        ('C', (x + kx, y1), (x, y1 - ky), (x, y1 - ry)),
+        ('L', (x, y + ry)),
+        ('C', (x, y + ky), (x + kx, y), (x + rx, y)),
+        ('Z',)]
+
+
+def _ellipse_path(cx, cy, rx, ry):
+    """Return path of ellipse, starting at `(cx + rx, cy)`."""
+    kx = _KAPPA * rx
+    ky = _KAPPA * ry
+    return [
+        ('M', (cx + rx, cy)),
+        ('C', (cx + rx, cy + ky), (cx + kx, cy + ry), (cx, cy + ry)),
+        ('C', (cx - kx, cy + ry), (cx - rx, cy + ky), (cx - rx, cy)),
+        ('C', (cx - rx, cy - ky), (cx - kx, cy - ry), (cx, cy - ry)),
+        ('C', (cx + kx, cy - ry), (cx + rx, cy - ky), (cx + rx, cy)),
+        ('Z',)]
+
+
+class _PathLexer(object):
+    """Reads commands, numbers, and flags from path data."""
+
+    def __init__(self, d):
+        self.d = d
+        self.pos = 0
+
+    def done(self):
+        return _RX_END.match(self.d, self.pos) is not None
+
+    def command(self):
+        """Return next command letter, or `None`."""
+        return self._match(_RX_COMMAND)
+
+    def number(self):
+        return float(self._expect(_RX_NUMBER))
+
+    def flag(self):
+        return self._expect(_RX_FLAG) == '1'
+
+    def point(self):
+        return (self.number(), self.number())
+
+    def _match(self, rx):
+        m = rx.match(self.d, self.pos)
+        if m is None:
+            return None
+        self.pos = m.end()
+        return m.group(1)
+
+    def _expect(self, rx):
+        s = self._match(rx)
+        if s is None:
+            raise Unsupported('malformed path data at: {s}'.format(
+                s=self.d[self.pos:self.pos + 20]))
+        return s
+
+
+def parse_path(d):
+    """Return operations of SVG path data `d`.
+
+    Each operation is `('M', p)`, `('L', p)`, `('C', p1, p2, p)`,
+    or `('Z',)`, with absolute points `p = (x, y)`. Quadratic
+    Beziers and arcs are converted to cubic Beziers.
+    Raise `Unsupported` if `d` is malformed.
+
+    @type d: `str`
+    @rtype: `list` of `tuple`
+    """
+    lexer = _PathLexer(d)
+    ops = list()
+    current = start = (0.0, 0.0)
+    # last control points, for `S` and `T`
+    cubic = quad = None
+    cmd = None
+    closed = False
+    while not lexer.done():
+        c = lexer.command()
+        if c is None:
+            # repeated command, after `M` repeated as `L`
+            if cmd is None or cmd in 'Zz':
+                raise Unsupported('malformed path data')
+            c = dict(M='L', m='l').get(cmd, cmd)
+        cmd = c
+        upper = c.upper()
+        dx, dy = current if c.islower() else (0.0, 0.0)
+        if closed and upper not in 'MZ':
+            # drawing after `Z` starts at the start of the subpath
+            ops.append(('M', start))
+        closed = False
+        new_cubic = new_quad = None
+        if upper == 'M':
+            x, y = lexer.point()
+            current = start = (dx + x, dy + y)
+            ops.append(('M', current))
+        elif upper == 'Z':
+            if ops:
+                ops.append(('Z',))
+            current = start
+            closed = True
+        elif upper == 'L':
+            x, y = lexer.point()
+            current = (dx + x, dy + y)
+            ops.append(('L', current))
+        elif upper == 'H':
+            current = (dx + lexer.number(), current[1])
+            ops.append(('L', current))
+        elif upper == 'V':
+            current = (current[0], dy + lexer.number())
+            ops.append(('L', current))
+        elif upper in 'CS':
+            if upper == 'C':
+                x, y = lexer.point()
+                p1 = (dx + x, dy + y)
+            else:
+                p1 = _reflect(cubic, current)
+            x, y = lexer.point()
+            p2 = (dx + x, dy + y)
+            x, y = lexer.point()
+            p = (dx + x, dy + y)
+            ops.append(('C', p1, p2, p))
+            current = p
+            new_cubic = p2
+        elif upper in 'QT':
+            if upper == 'Q':
+                x, y = lexer.point()
+                q = (dx + x, dy + y)
+            else:
+                q = _reflect(quad, current)
+            x, y = lexer.point()
+            p = (dx + x, dy + y)
+            ops.append(_quadratic_to_cubic(current, q, p))
+            current = p
+            new_quad = q
+        else:  # `A`
+            rx = lexer.number()
+            ry = lexer.number()
+            angle = lexer.number()
+            large = lexer.flag()
+            sweep = lexer.flag()
+            x, y = lexer.point()
+            p = (dx + x, dy + y)
+            ops.extend(_arc_to_cubics(
+                current, rx, ry, angle, large, sweep, p))
+            current = p
+        if not ops or ops[0][0] != 'M':
+            raise Unsupported('path data does not start with `M`')
+        cubic = new_cubic
+        quad = new_quad
+    return ops
+
+
+def _reflect(control, current):
+    """Return reflection of `control` about `current`."""
+    if control is None:
+        return current
+    return (
+        2 * current[0] - control[0],
+        2 * current[1] - control[1])
+
+
+def _quadratic_to_cubic(p0, q, p):
+    """Return cubic operation for quadratic Bezier `p0, q, p`."""
+    p1 = (
+        p0[0] + 2.0 / 3.0 * (q[0] - p0[0]),
+        p0[1] + 2.0 / 3.0 * (q[1] - p0[1]))
+    p2 = (
+        p[0] + 2.0 / 3.0 * (q[0] - p[0]),
+        p[1] + 2.0 / 3.0 * (q[1] - p[1]))
+    return ('C', p1, p2, p)
+
+
+def _arc_to_cubics(p0, rx, ry, angle, large, sweep, p):
+    """Return cubic operations for an elliptical arc.
+
+    The arc is converted from endpoint to center parameterization,
+    as in Appendix F.6 of the SVG 1.1 specification, and each
+    quarter (or less) of it is approximated by a cubic Bezier.
+    """
+    if p0 == p:
+        return list()
+    rx = abs(rx)
+    ry = abs(ry)
+    if rx == 0 or ry == 0:
+        return [('L', p)]
+    phi = math.radians(angle)
+    cos, sin = math.cos(phi), math.sin(phi)
+    hx = (p0[0] - p[0]) / 2
+    hy = (p0[1] - p[1]) / 2
+    x1 = cos * hx + sin * hy
+    y1 = - sin * hx + cos * hy
+    scale = (x1 / rx) ** 2 + (y1 / ry) ** 2
+    if scale > 1:
+        rx *= math.sqrt(scale)
+        ry *= math.sqrt(scale)
+    num = (rx * ry) ** 2 - (rx * y1) ** 2 - (ry * x1) ** 2
+    den = (rx * y1) ** 2 + (ry * x1) ** 2
+    coef = math.sqrt(max(0.0, num / den))
+    if large == sweep:
+        coef = - coef
+    cx1 = coef * rx * y1 / ry
+    cy1 = - coef * ry * x1 / rx
+    cx = cos * cx1 - sin * cy1 + (p0[0] + p[0]) / 2
+    cy = sin * cx1 + cos * cy1 + (p0[1] + p[1]) / 2
+    ux, uy = (x1 - cx1) / rx, (y1 - cy1) / ry
+    vx, vy = (- x1 - cx1) / rx, (- y1 - cy1) / ry
+    theta = math.atan2(uy, ux)
+    delta = math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    n = max(1, int(math.ceil(abs(delta) / (math.pi / 2) - 1e-9)))
+    step = delta / n
+    t = 4.0 / 3.0 * math.tan(step / 4)
+
+    def point(u, v):
+        return (
+            cx + rx * cos * u - ry * sin * v,
+            cy + rx * sin * u + ry * cos * v)
+    ops = list()
+    for i in range(n):
+        a1 = theta + i * step
+        a2 = a1 + step
+        c1, s1 = math.cos(a1), math.sin(a1)
+        c2, s2 = math.cos(a2), math.sin(a2)
+        end = p if i == n - 1 else point(c2, s2)
+        ops.append((
+            'C', point(c1 - t * s1, s1 + t * c1),
+            point(c2 + t * s2, s2 - t * c2), end))
+    return ops
+
+
+def element_transform(el):
+    """Return transformation from user units of `el` to px.
+
+    This includes the `transform` of `el`, and raises `Unsupported`
+    for the root elements that `export` does not support.
+
+    @type el: `lxml.etree._Element`
+    @return: matrix `(a, b, c, d, e, f)`
+    @rtype: `tuple`
+    """
+    chain = list()
+    while el.getparent() is not None:
+        chain.append(el)
+        el = el.getparent()
+    m = _root_transform(el)
+    for e in reversed(chain):
+        if 'transform' in e.attrib:
+            m = _multiply(m, _parse_transform(e.attrib['transform']))
+    return m
+
+
+def _root_transform(root):
+    """Return transformation from user units of `root` to px.
+
+    Only a `viewBox` at the origin, scaled equally along
+    both axes, is supported, as is assumed when positioning
+    text (see `converter._scaling_assumed`).
+    """
+    if 'width' not in root.attrib or 'height' not in root.attrib:
+        raise Unsupported('root element without width and height')
+    if 'transform' in root.attrib:
+        raise Unsupported('transform of the root element')
+    width = _length(root.attrib['width'])
+    height = _length(root.attrib['height'])
+    viewbox = root.attrib.get('viewBox')
+    if viewbox is None:
+        return _IDENTITY
+    try:
+        x, y, w, h = (float(v) for v in re.split(
+            r'[\s,]+', viewbox.strip()))
+    except ValueError:
+        raise Unsupported('viewBox "{v}"'.format(v=viewbox))
+    if x != 0 or y != 0 or w <= 0 or h <= 0:
+        raise Unsupported('viewBox "{v}"'.format(v=viewbox))
+    sx = width / w
+    sy = height / h
+    if abs(sx - sy) > 1e-6 * max(sx, sy):
+        raise Unsupported('viewBox scaled differently along axes')
+    return (sx, 0.0, 0.0, sx, 0.0, 0.0)
+
+
+def _parse_transform(value):
+    """Return matrix `(a, b, c, d, e, f)` of `transform` value."""
+    m = _IDENTITY
+    pos = 0
+    while value[pos:].strip(' \t\r\n,'):
+        match = _RX_TRANSFORM.match(value, pos)
+        if match is None:
+            raise Unsupported('transform "{v}"'.format(v=value))
+        pos = match.end()
+        func = match.group(1)
+        args = [float(x) for x in re.findall(_NUMBER, match.group(2))]
+        m = _multiply(m, _transform_matrix(func, args))
+    return m
+
+
+def _transform_matrix(func, args):
+    """Return matrix of transform function `func` with `args`."""
+    n = len(args)
+    if func == 'matrix' and n == 6:
+        return tuple(args)
+    if func == 'translate' and n in (1, 2):
+        return (1.0, 0.0, 0.0, 1.0, args[0], args[1] if n == 2 else 0.0)
+    if func == 'scale' and n in (1, 2):
+        return (args[0], 0.0, 0.0, args[-1], 0.0, 0.0)
+    if func == 'rotate' and n in (1, 3):
+        a = math.radians(args[0])
+        r = (math.cos(a), math.sin(a), - math.sin(a), math.cos(a),
+             0.0, 0.0)
+        if n == 1:
+            return r
+        cx, cy = args[1:]
+        m = _multiply((1.0, 0.0, 0.0, 1.0, cx, cy), r)
+        return _multiply(m, (1.0, 0.0, 0.0, 1.0, - cx, - cy))
+    if func == 'skewX' and n == 1:
+        return (1.0, 0.0, math.tan(math.radians(args[0])), 1.0, 0.0, 0.0)
+    if func == 'skewY' and n == 1:
+        return (1.0, math.tan(math.radians(args[0])), 0.0, 1.0, 0.0, 0.0)
+    raise Unsupported('transform {f}({a})'.format(
+        f=func, a=', '.join(str(x) for x in args)))
+
+
+def _multiply(m, n):
+    """Return matrix of applying `n`, then `m`."""
+    a1, b1, c1, d1, e1, f1 = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (
+        a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+        a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+        a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+
+def _apply(m, p):
+    """Return point `p` transformed by matrix `m`."""
+    a, b, c, d, e, f = m
+    x, y = p
+    return (a * x + c * y + e, b * x + d * y + f)
+
+
+def _svg_name(el):
+    """Return local name of SVG element `el`, else `None`.
+
+    Comments, and elements in other namespaces
+    (for example `sodipodi:namedview`), are not drawn.
+    """
+    if not isinstance(el.tag, str):
+        return None
+    prefix = '{{{ns}}}'.format(ns=_SVG_NS)
+    if not el.tag.startswith(prefix):
+        return None
+    return el.tag[len(prefix):]
+
+
+def _specified(el):
+    """Return `dict` of properties specified on `el`.
+
+    Declarations in the attribute `style` override
+    presentation attributes.
+    """
+    props = {
+        k: v.strip() for k, v in el.attrib.items()
+        if k in _PROPERTIES}
+    for item in el.attrib.get('style', '').split(';'):
+        k, _, v = item.partition(':')
+        k = k.strip()
+        if k in _PROPERTIES:
+            props[k] = v.strip()
+    return props
+
+
+def _check_restricted(props):
+    """Raise `Unsupported` if a property has an unsupported value."""
+    for k, values in _RESTRICTED.items():
+        v = props.get(k)
+        if v is not None and v not in values and v != 'inherit':
+            raise Unsupported('{k}: {v}'.format(k=k, v=v))
+
+
+def _inherit(style, props):
+    """Update inherited `style` with specified `props`."""
+    for k, v in props.items():
+        if k in _INHERITED and v != 'inherit':
+            style[k] = v
+
+
+def _parse_paint(value):
+    """Return RGB color in `[0, 1]`, or `None` for `'none'`."""
+    value = value.strip()
+    if value == 'none':
+        return None
+    if value in _COLORS:
+        return tuple(x / 255.0 for x in _COLORS[value])
+    m = _RX_HEX_COLOR.match(value)
+    if m is not None:
+        h = m.group(1)
+        if len(h) == 3:
+            h = ''.join(2 * x for x in h)
+        return tuple(int(h[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+    m = _RX_RGB_COLOR.match(value)
+    if m is not None:
+        parts = [x.strip() for x in m.group(1).split(',')]
+        if len(parts) == 3:
+            try:
+                return tuple(
+                    min(max(_color_component(x), 0.0), 1.0)
+                    for x in parts)
+            except ValueError:
+                pass
+    raise Unsupported('paint "{v}"'.format(v=value))
+
+
+def _color_component(s):
+    """Return component of `rgb()` color in `[0, 1]`."""
+    if s.endswith('%'):
+        return float(s[:-1]) / 100.0
+    return float(s) / 255.0
+
+
+def _opacity(value):
+    """Return opacity in `[0, 1]` from `value`."""
+    return min(max(_number(value), 0.0), 1.0)
+
+
+def _number(value):
+    """Return `float` from `value`, else raise `Unsupported`."""
+    try:
+        return float(value)
+    except ValueError:
+        raise Unsupported('number "{v}"'.format(v=value))
+
+
+def _length(value):
+    """Return length in user units from `value`.
+
+    Absolute units are converted to px, as Inkscape does.
+    Percentages are not supported.
+    """
+    m = _RX_LENGTH.match(value)
+    if m is None or m.group(2) not in _UNITS:
+        raise Unsupported('length "{v}"'.format(v=value))
+    return float(m.group(1)) * _UNITS[m.group(2)]
+
+
+def _format_numbers(values):
+    return ' '.join(pdf.format_real(float(x)) for x in values)
@@ -0,0 +1,252 @@
+"""Figures typeset in advance, as standalone PDF files.
+
+Overlaying the text of a `.pdf_tex` file on its PDF typesets the
+labels of every figure in every LaTeX run of the document, and calling
+`svglatex` from `svglatex.sty` needs `--shell-escape`. Instead, the
+`.pdf_tex` files of many figures can be typeset together, in one LaTeX
+run with the preamble of the document, one page per figure. The pages
+are split into one PDF file per figure, named `<base>-typeset.pdf`,
+which the document includes as finished graphics (see the package
+option `typeset` of `svglatex.sty`).
+
+Each figure is typeset at width `\\svgwidth` (by default the natural
+width of the figure), so the labels have the size of the document's
+fonts only if the document includes the figure at that width.
+
+The typeset PDF of each figure is cached, by the digests of the
+preamble, of the `.pdf_tex` file, and of the PDF of its graphics.
+So only figures that changed are typeset again.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import collections
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from svglatex import cache
+from svglatex import manifest
+from svglatex import pdf
+
+
+log = logging.getLogger(__name__)
+TYPESET_SUFFIX = '-typeset.pdf'
+# changes to the driver below invalidate cached figures
+_DRIVER_VERSION = '1'
+_JOBNAME = 'svglatex-typeset'
+_RX_BEGIN_DOCUMENT = re.compile(r'^[^%\n]*\\begin\s*\{document\}', re.M)
+_RX_DOCUMENTCLASS = re.compile(r'^[^%\n]*\\documentclass\b', re.M)
+_RX_GRAPHICS = re.compile(
+    r'\\includegraphics\[width=([0-9.]+)\\unitlength\]\{([^{}]*)\}')
+# characters that cannot appear in paths given to `\input`
+_RX_UNSAFE = re.compile(r'[{}%#\\\s]')
+# appended to the preamble of the document
+_DRIVER = r'''
+\makeatletter
+\@ifpackageloaded{graphicx}{}{\usepackage{graphicx}}
+\@ifpackageloaded{xcolor}{}{%
+  \@ifpackageloaded{color}{}{\usepackage{color}}}
+\newsavebox\svglatex@typesetbox
+% \svglatex@typeset{width}{pdf_tex}
+%
+% Ship out a page of the size of the picture.
+\newcommand\svglatex@typeset[2]{%
+  \def\svgwidth{#1}%
+  \sbox\svglatex@typesetbox{\input{#2}}%
+  \ifdefined\pagewidth
+    \pagewidth=\wd\svglatex@typesetbox
+    \pageheight=\dimexpr\ht\svglatex@typesetbox
+      +\dp\svglatex@typesetbox\relax
+  \else
+    \pdfpagewidth=\wd\svglatex@typesetbox
+    \pdfpageheight=\dimexpr\ht\svglatex@typesetbox
+      +\dp\svglatex@typesetbox\relax
+  \fi
+  \shipout\box\svglatex@typesetbox}
+\hoffset=-1in
+\voffset=-1in
+\begin{document}
+'''
+_PAGE = '\\svglatex@typeset{{{width}}}{{{fname}}}\n'
+_END = '\\makeatother\n\\end{document}\n'
+# number of lines of the LaTeX log in error messages
+_LOG_LINES = 20
+Figure = collections.namedtuple(
+    'Figure', ['pdf_tex', 'output', 'width', 'key'])
+
+
+def typeset_figures(
+        sources, preamble_fname, latex='pdflatex', width=None,
+        deterministic=False, epoch=None):
+    """Typeset the `.pdf_tex` of each of `sources`, and split pages.
+
+    Figures found in the cache are not typeset again.
+
+    @param sources: paths to SVG (or DOT) files, converted
+        with method `latex-pdf`
+    @type sources: `list` of `str`
+    @param preamble_fname: LaTeX document whose preamble (the text
+        before `\\begin{document}`) is used, or file with only
+        a preamble
+    @type preamble_fname: `str`
+    @param latex: LaTeX executable, for example `lualatex`
+    @type latex: `str`
+    @param width: TeX dimension of the figures, for example
+        `\\linewidth`, if `None`, then the natural width of each
+    @type width: `str`
+    @param deterministic: if `True`, then remove volatile metadata
+        of the PDF files (see `pdf.make_deterministic`)
+    @param epoch: see `pdf.make_deterministic`
+    @return: paths of PDF files typeset in this run
+    @rtype: `list` of `str`
+    """
+    preamble = read_preamble(preamble_fname)
+    figures = [
+        _figure(source, preamble, latex, width)
+        for source in sources]
+    cache_dir = cache.cache_dir('typeset')
+    pending = list()
+    for fig in figures:
+        cached = os.path.join(cache_dir, fig.key + '.pdf')
+        if os.path.isfile(cached):
+            _copy_if_changed(cached, fig.output)
+        else:
+            pending.append(fig)
+    log.info('{n} of {k} figures found typeset in cache.'.format(
+        n=len(figures) - len(pending), k=len(figures)))
+    if not pending:
+        return list()
+    docs = _run_latex(pending, preamble, latex)
+    for fig, doc in zip(pending, docs):
+        if deterministic:
+            pdf.make_deterministic(doc, epoch)
+        data = doc.dumps()
+        cache.atomic_write(
+            os.path.join(cache_dir, fig.key + '.pdf'), data)
+        cache.atomic_write(fig.output, data)
+    return [fig.output for fig in pending]
+
+
+def read_preamble(fname):
+    """Return preamble of LaTeX document `fname`.
+
+    The preamble is the text before `\\begin{document}`, or the
+    whole file if it has no `\\begin{document}`. If the preamble
+    does not declare a document class, then `article` is used.
+
+    @type fname: `str`
+    @rtype: `str`
+    """
+    with open(fname, 'r', encoding='utf-8') as f:
+        s = f.read()
+    m = _RX_BEGIN_DOCUMENT.search(s)
+    if m is not None:
+        s = s[:m.start()]
+    if _RX_DOCUMENTCLASS.search(s) is None:
+        s = '\\documentclass{article}\n' + s
+    return s
+
+
+def typeset_path(source):
+    """Return path of typeset PDF of SVG (or DOT) file `source`.
+
+    @type source: `str`
+    @rtype: `str`
+    """
+    return os.path.splitext(source)[0] + TYPESET_SUFFIX
+
+
+def _figure(source, preamble, latex, width):
+    """Return `Figure` for typesetting `source`.
+
+    @raise Exception: if the `.pdf_tex` of `source` is missing,
+        or does not include graphics (for example a draft)
+    """
+    base = os.path.splitext(source)[0]
+    pdf_tex = manifest.tex_path(base + '.pdf_tex')
+    if not os.path.isfile(pdf_tex):
+        raise Exception((
+            'File "{f}" not found, convert "{s}" '
+            'with method `latex-pdf` first.').format(
+                f=pdf_tex, s=source))
+    if _RX_UNSAFE.search(pdf_tex):
+        raise Exception(
+            'Cannot `\\input` file "{f}" from LaTeX.'.format(f=pdf_tex))
+    with open(pdf_tex, 'rb') as f:
+        tex = f.read()
+    m = _RX_GRAPHICS.search(tex.decode('utf-8'))
+    if m is None:
+        raise Exception((
+            'File "{f}" does not include graphics '
+            '(is it a draft?).').format(f=pdf_tex))
+    scale, graphics = m.groups()
+    if width is None:
+        x0, _, x1, _ = pdf.page_box(graphics)
+        width = '{w}bp'.format(
+            w=pdf.format_real((x1 - x0) / float(scale)))
+    parts = [
+        _DRIVER_VERSION, latex, width,
+        cache.bytes_digest(preamble.encode('utf-8')),
+        cache.bytes_digest(tex),
+        cache.file_digest(graphics)]
+    key = cache.bytes_digest(' '.join(parts).encode('utf-8'))
+    return Figure(pdf_tex, typeset_path(source), width, key)
+
+
+def _run_latex(figures, preamble, latex):
+    """Typeset `figures` in one LaTeX run, and return their pages.
+
+    LaTeX runs in the current directory, as when typesetting the
+    document, so that paths in `.pdf_tex` files are found.
+
+    @type figures: `list` of `Figure`
+    @rtype: `list` of `pdf.Document`
+    """
+    if shutil.which(latex) is None:
+        raise Exception(
+            '`{latex}` not found in `$PATH`'.format(latex=latex))
+    pages = ''.join(
+        _PAGE.format(width=fig.width, fname=fig.pdf_tex)
+        for fig in figures)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tex_fname = os.path.join(tmpdir, _JOBNAME + '.tex')
+        with open(tex_fname, 'w', encoding='utf-8') as f:
+            f.write(preamble + _DRIVER + pages + _END)
+        log.info('Typesetting {n} figures with `{latex}`.'.format(
+            n=len(figures), latex=latex))
+        args = [
+            latex, '-interaction=nonstopmode', '-halt-on-error',
+            '-output-directory=' + tmpdir,
+            '-jobname=' + _JOBNAME, tex_fname]
+        r = subprocess.run(
+            args, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        if r.returncode != 0:
+            lines = r.stdout.splitlines()[-_LOG_LINES:]
+            raise Exception(
+                '`{latex}` failed to typeset figures:\n{log}'.format(
+                    latex=latex, log='\n'.join(lines)))
+        doc = pdf.read(os.path.join(tmpdir, _JOBNAME + '.pdf'))
+    docs = pdf.split_pages(doc)
+    if len(docs) != len(figures):
+        raise Exception((
+            '`{latex}` wrote {n} pages for {k} figures '
+            '(does the preamble ship out pages?)').format(
+                latex=latex, n=len(docs), k=len(figures)))
+    return docs
+
+
+def _copy_if_changed(cached, output):
+    """Copy file `cached` to `output`, unless it has the same contents."""
+    if (os.path.isfile(output) and
+            cache.file_digest(output) == cache.file_digest(cached)):
+        return
+    with open(cached, 'rb') as f:
+        data = f.read()
+    cache.atomic_write(output, data)
+
@@ -0,0 +1,55 @@
+"""Files changed in a `git` repository since a revision.
+
+Builds in continuous integration check out the repository afresh,
+so the modification times of figures and of outputs restored from
+earlier builds say nothing about which figures changed. Instead,
+`git` is asked which files differ from a revision.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import os
+import shutil
+import subprocess
+
+
+def changed_files(rev, cwd=None):
+    """Return files that differ from revision `rev`.
+
+    These are the tracked files whose contents in the working tree
+    (committed or not) differ from `rev`, including deleted and
+    renamed files, and the untracked files that are not ignored.
+
+    @param rev: `git` revision, for example `origin/main` or `HEAD~3`
+    @type rev: `str`
+    @param cwd: directory in the repository,
+        if `None`, then the current directory
+    @return: absolute paths, with symbolic links resolved
+    @rtype: `set` of `str`
+    """
+    if shutil.which('git') is None:
+        raise Exception('`git` not found in `$PATH`')
+    if cwd is None:
+        cwd = os.getcwd()
+    top = _git(['rev-parse', '--show-toplevel'], cwd).strip()
+    diff = _git(
+        ['diff', '--name-only', '--no-renames', '-z', rev, '--'], cwd)
+    untracked = _git(
+        ['ls-files', '--others', '--exclude-standard', '--full-name',
+         '-z'], top)
+    names = diff.split('\0') + untracked.split('\0')
+    return {
+        os.path.realpath(os.path.join(top, name))
+        for name in names if name}
+
+
+def _git(args, cwd):
+    """Return output of `git` with `args`, and raise if it fails."""
+    r = subprocess.run(
+        ['git'] + args, cwd=cwd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if r.returncode != 0:
+        raise Exception('`git {a}` failed: {e}'.format(
+            a=' '.join(args), e=r.stderr.strip()))
+    return r.stdout
@@ -0,0 +1,121 @@
+"""Benchmark pdfLaTeX time per pass, for plain and compact `.pdf_tex`.
+
+A figure with many labels in a few styles is written as `.pdf_tex`
+twice, as by `svglatex` without and with `--compact-tex`, and each
+is typeset by `pdflatex` several times. The size of each `.pdf_tex`,
+and the mean and minimum time per pass, are printed.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from svglatex import converter
+
+
+DRIVER = r'''\documentclass{{article}}
+\usepackage{{graphicx}}
+\usepackage{{color}}
+\begin{{document}}
+\def\svgwidth{{\linewidth}}
+\input{{{fname}}}
+\end{{document}}
+'''
+SIZES = sorted(converter._FONT_SIZE_MAP.values())
+COLORS = [(0, 0, 0), (200, 0, 0), (0, 0, 200)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--labels', type=int, default=5000,
+        help='Number of labels in the figure.')
+    parser.add_argument(
+        '--styles', type=int, default=8,
+        help='Number of distinct styles of labels.')
+    parser.add_argument(
+        '--passes', type=int, default=5,
+        help='Number of `pdflatex` runs for each file.')
+    parser.add_argument(
+        '--latex', default='pdflatex',
+        help='LaTeX executable.')
+    args = parser.parse_args()
+    if shutil.which(args.latex) is None:
+        raise FileNotFoundError(
+            '`{latex}` not found in `$PATH`'.format(latex=args.latex))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compact in (False, True):
+            name = 'compact' if compact else 'plain'
+            fname = os.path.join(tmpdir, name + '.pdf_tex')
+            tex = make_picture(args.labels, args.styles, compact)
+            with open(fname, 'w', encoding='utf-8') as f:
+                f.write(tex)
+            times = run_latex(args.latex, tmpdir, name, args.passes)
+            print((
+                '{name:>8}: {size:>9} bytes, '
+                'mean {mean:6.3f} s, min {min:6.3f} s per pass').format(
+                    name=name, size=os.path.getsize(fname),
+                    mean=sum(times) / len(times), min=min(times)))
+
+
+def make_picture(n_labels, n_styles, compact):
+    """Return `.pdf_tex` contents for `n_labels` in `n_styles`.
+
+    @type n_labels: `int`
+    @type n_styles: `int`
+    @type compact: `bool`
+    @rtype: `str`
+    """
+    rng = random.Random(0)
+    styles = [make_style(i) for i in range(n_styles)]
+    labels = list()
+    for i in range(n_labels):
+        pos = (rng.uniform(0, 1000), rng.uniform(0, 1000))
+        label = converter._TeXLabel(pos, '$x_{{{i}}}$'.format(i=i))
+        style = styles[i % n_styles]
+        for attr, value in style.items():
+            setattr(label, attr, value)
+        labels.append(label)
+    bbox = converter._BBox(x=0.0, y=0.0, width=1000.0, height=1000.0)
+    picture = converter._TeXPicture(
+        bbox, bbox, labels=labels, compact=compact)
+    return picture.dumps()
+
+
+def make_style(i):
+    """Return `dict` of label attributes for the `i`-th style."""
+    return dict(
+        fontsize=SIZES[i % len(SIZES)],
+        color=COLORS[(i // len(SIZES)) % len(COLORS)],
+        fontweight=(
+            converter._WEIGHT_BOLD if i % 2
+            else converter._WEIGHT_NORMAL),
+        align=i % 3)
+
+
+def run_latex(latex, dirname, name, passes):
+    """Return times of `passes` runs of `latex` on figure `name`.
+
+    @rtype: `list` of `float`
+    """
+    driver = os.path.join(dirname, name + '_doc.tex')
+    with open(driver, 'w', encoding='utf-8') as f:
+        f.write(DRIVER.format(fname=name + '.pdf_tex'))
+    times = list()
+    for _ in range(passes):
+        start = time.perf_counter()
+        subprocess.run(
+            [latex, '--interaction=batchmode', os.path.basename(driver)],
+            cwd=dirname, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Stand-in for `inkscape`, for testing `svglatex` without Inkscape.
+
+The command-line interface of Inkscape 0.92, or of Inkscape 1.x (with
+`--actions`, `--pipe`, and `--query-id` of several elements), is
+imitated, as selected by the environment variable
+`$FAKE_INKSCAPE_VERSION` (default: `1.2.1`). Queries return made-up
+bounding boxes: the root element has the size of the SVG page, and
+each other element with an `id` a small box. Exports write a small
+PDF file of the size of the page, whatever the export type.
+
+Other environment variables:
+
+- `$FAKE_INKSCAPE_SLEEP`: seconds to sleep before converting,
+  to imitate the time Inkscape takes
+- `$FAKE_INKSCAPE_LOG`: file that each call appends its arguments to
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import os
+import re
+import sys
+import time
+import zlib
+
+from lxml import etree
+
+
+VERSION = os.environ.get('FAKE_INKSCAPE_VERSION', '1.2.1')
+MODERN_OPTIONS = [
+    '--export-filename=FILE', '--export-type=TYPE', '--actions=ACTIONS',
+    '--action-list', '--pipe', '--shell', '--query-all', '--query-id=ID',
+    '--export-area-drawing']
+LEGACY_OPTIONS = [
+    '-z, --without-gui', '-A, --export-pdf=FILENAME',
+    '-f, --file=FILENAME', '--shell', '-S, --query-all',
+    '-I, --query-id=ID']
+ACTIONS = [
+    'query-all', 'export-do', 'export-filename', 'export-type',
+    'export-area-drawing', 'export-ignore-filters', 'export-dpi',
+    'file-open']
+_RX_UNIT = re.compile('[a-z]+$')
+
+
+def main():
+    args = sys.argv[1:]
+    log = os.environ.get('FAKE_INKSCAPE_LOG')
+    if log:
+        with open(log, 'a') as f:
+            f.write(' '.join(args) + '\n')
+    modern = not VERSION.startswith('0.')
+    if '--version' in args:
+        print('Inkscape {v} (5da689c313, 2019-01-14)'.format(v=VERSION))
+        return
+    if '--help' in args:
+        options = MODERN_OPTIONS if modern else LEGACY_OPTIONS
+        print('\n'.join('  ' + s for s in options))
+        return
+    if '--action-list' in args:
+        for action in ACTIONS:
+            print('{a:30}:  fake'.format(a=action))
+        return
+    call = parse_args(args)
+    delay = os.environ.get('FAKE_INKSCAPE_SLEEP')
+    if delay:
+        time.sleep(float(delay))
+    if call['pipe']:
+        doc = etree.parse(sys.stdin.buffer)
+    else:
+        doc = etree.parse(call['file'])
+    root = doc.getroot()
+    width = _length(root.get('width', '100'))
+    height = _length(root.get('height', '100'))
+    if call['ids'] is not None and modern:
+        query_ids(root, call['ids'])
+        return
+    if call['query']:
+        query_all(root, width, height, call['ids'])
+    data = make_pdf(0.75 * width, 0.75 * height)
+    for out in call['outputs']:
+        if out == '-':
+            sys.stdout.buffer.write(data)
+        else:
+            with open(out, 'wb') as f:
+                f.write(data)
+
+
+def parse_args(args):
+    """Return `dict` of input, outputs, and queries in `args`."""
+    call = dict(
+        file=None, outputs=list(), query=False,
+        pipe=False, ids=None)
+    for a in args:
+        if a.startswith('--file='):
+            call['file'] = a[len('--file='):]
+        elif a.startswith('--export-pdf='):
+            call['outputs'] = [a[len('--export-pdf='):]]
+        elif a.startswith('--export-filename='):
+            call['outputs'] = [a[len('--export-filename='):]]
+        elif a == '--query-all':
+            call['query'] = True
+        elif a.startswith('--query-id='):
+            call['ids'] = a[len('--query-id='):].split(',')
+            call['query'] = True
+        elif a == '--pipe':
+            call['pipe'] = True
+        elif a.startswith('--actions='):
+            for action in a[len('--actions='):].split(';'):
+                if action == 'query-all':
+                    call['query'] = True
+                elif action.startswith('export-filename:'):
+                    call['outputs'].append(
+                        action[len('export-filename:'):])
+        elif not a.startswith('-'):
+            call['file'] = a
+    return call
+
+
+def query_ids(root, ids):
+    """Print bounding boxes of `ids`, as `--query-id` of Inkscape 1.x.
+
+    Exit with status 1 if an element is not found.
+    """
+    found = {
+        el.get('id'): i for i, el in enumerate(root.iter())
+        if el.get('id') in ids}
+    if set(found) != set(ids):
+        sys.exit(1)
+    print(','.join(str(found[name] % 50) for name in ids))
+    print(','.join(str(found[name] % 40) for name in ids))
+    print(','.join('10' for _ in ids))
+    print(','.join('5' for _ in ids))
+
+
+def query_all(root, width, height, ids=None):
+    """Print bounding boxes, as `--query-all`."""
+    for i, el in enumerate(root.iter()):
+        name = el.get('id')
+        if name is None or (ids is not None and name not in ids):
+            continue
+        if el is root:
+            print('{n},0,0,{w},{h}'.format(n=name, w=width, h=height))
+        else:
+            print('{n},{x},{y},10,5'.format(n=name, x=i % 50, y=i % 40))
+
+
+def make_pdf(width, height):
+    """Return PDF with one page of `width` and `height` in bp.
+
+    @rtype: `bytes`
+    """
+    content = zlib.compress(b'0 0 m 10 10 l S\n' * 20)
+    info = (
+        '<< /Producer (cairo 1.15.10 (https://cairographics.org)) '
+        '/CreationDate (D:{t}) >>').format(
+            t=time.strftime('%Y%m%d%H%M%S'))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [ 3 0 R ] /Count 1 >>',
+        ('<< /Type /Page /Parent 2 0 R /MediaBox [ 0 0 {w:g} {h:g} ] '
+         '/Contents 4 0 R /Resources << /ExtGState << /a0 5 0 R >> >> '
+         '>>').format(w=width, h=height).encode('ascii'),
+        (b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) +
+         content + b'\nendstream'),
+        b'<< /CA 1 /ca 1 >>',
+        info.encode('ascii')]
+    out = bytearray(b'%PDF-1.5\n%\xb5\xed\xae\xfb\n')
+    offsets = list()
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % (i + 1) + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    file_id = os.urandom(8).hex().encode('ascii')
+    out += (
+        b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R '
+        b'/ID [<%s> <%s>] >>\nstartxref\n%d\n%%%%EOF\n') % (
+            len(objects) + 1, len(objects), file_id, file_id, xref)
+    return bytes(out)
+
+
+def _length(s):
+    """Return length `s` without unit, as `float`."""
+    return float(_RX_UNIT.sub('', s.strip()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""Load test of `svglatex` called by concurrent LaTeX builds.
+
+Several clients, each a directory with a LaTeX document, are built at
+the same time, as in a shared build server, or by parallel jobs of
+continuous integration. Each LaTeX run of a client does what
+`svglatex.sty` does for each of its figures: skip the figure if the
+manifest records the current MD5 digest of its SVG file (and its
+outputs exist), otherwise call `svglatex -i ./img/...` in the
+client's directory (as `\\write18` does), and wait for it.
+
+Each client includes private figures (under `img/`), and figures
+shared by all clients (under `img/shared/`, a symbolic link to one
+directory). The figures are converted before the clients start, and
+a fraction of them is then made stale (by editing the SVG), so the
+first LaTeX run of each client finds them out of date.
+
+The following are reported:
+
+- throughput: calls of `svglatex` per second, and conversions per
+  second, over the whole test
+- latency: median and 99th percentile of calls of `svglatex`
+- duplicated conversions: stale figures converted more than once
+  (for example a shared figure converted by several clients),
+  and up-to-date figures converted, as recorded in the build history
+- corruption: outputs that do not parse as PDF or as complete
+  `.pdf_tex` after a call returns, outputs older than their SVG at
+  the end, temporary files left behind, and malformed manifests
+
+The exit status is 1 if any call failed, any conversion was
+duplicated, or any file was corrupted.
+
+By default, Inkscape is replaced by `fake_inkscape.py`, which writes
+small PDF files after `--fake-delay` seconds, so that the test measures
+`svglatex` itself (locking, freshness checks, manifest and history
+updates). With `--inkscape system`, the `inkscape` in `$PATH` is used.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import argparse
+import collections
+import math
+import os
+import random
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from svglatex import cache
+from svglatex import formats
+from svglatex import history
+from svglatex import interface
+from svglatex import manifest
+from svglatex import pdf
+
+
+FAKE_INKSCAPE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'fake_inkscape.py')
+WRAPPER = '#!/bin/sh\nexec "{python}" "{script}" "$@"\n'
+SVG = '''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg"
+     width="{width}" height="{height}" id="svg{name}">
+  <rect id="frame" x="5" y="5" width="{w}" height="{h}"
+        style="fill:none;stroke:#000000;stroke-width:1" />
+{labels}
+</svg>
+'''
+LABEL = (
+    '  <text id="label{i}" x="{x}" y="{y}" '
+    'style="font-size:{size}px;font-family:serif;fill:#000000">'
+    '{text}</text>')
+TEX_END = '\\endgroup%\n'
+Client = collections.namedtuple('Client', ['path', 'figures'])
+Result = collections.namedtuple(
+    'Result', ['client', 'key', 'latency', 'returncode'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--clients', type=int, default=8,
+        help='Number of concurrent LaTeX builds.')
+    parser.add_argument(
+        '--figures', type=int, default=20,
+        help='Number of figures in each document.')
+    parser.add_argument(
+        '--runs', type=int, default=3,
+        help='Number of LaTeX runs of each document.')
+    parser.add_argument(
+        '--stale', type=float, default=0.3,
+        help='Fraction of figures edited after converting.')
+    parser.add_argument(
+        '--shared', type=float, default=0.5,
+        help='Fraction of the figures of each document that '
+             'all documents include.')
+    parser.add_argument(
+        '--labels', type=int, default=10,
+        help='Number of labels in each figure.')
+    parser.add_argument(
+        '-m', '--method', default='latex-pdf',
+        help='Export method, as for `svglatex -m`.')
+    parser.add_argument(
+        '--inkscape', default='fake',
+        help='`fake` for `fake_inkscape.py`, `system` for '
+             'the `inkscape` in `$PATH`, or path to an executable.')
+    parser.add_argument(
+        '--fake-delay', type=float, default=0.2,
+        help='Seconds that the fake Inkscape takes to convert.')
+    parser.add_argument(
+        '--without-manifest', action='store_true',
+        help='Call `svglatex` for every figure in every LaTeX run '
+             '(as `svglatex.sty` without the manifest).')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of the choice of stale figures, and '
+             'of the order of figures in each document.')
+    parser.add_argument(
+        '--keep', action='store_true',
+        help='Keep the directory of the test, and print its path.')
+    args = parser.parse_args()
+    if not 0 <= args.stale <= 1 or not 0 <= args.shared <= 1:
+        raise ValueError('`--stale` and `--shared` are fractions.')
+    tmpdir = tempfile.mkdtemp(prefix='svglatex-load-')
+    try:
+        ok = run(args, tmpdir)
+    finally:
+        if args.keep:
+            print('Test files are in "{d}"'.format(d=tmpdir))
+        else:
+            shutil.rmtree(tmpdir)
+    sys.exit(0 if ok else 1)
+
+
+def run(args, root):
+    """Run the load test in directory `root`.
+
+    @return: `True` if no call failed, no conversion was duplicated,
+        and no file was corrupted
+    @rtype: `bool`
+    """
+    rng = random.Random(args.seed)
+    env = _environment(args, root)
+    clients = make_corpus(args, root, rng)
+    print('Converting {n} figures before the test...'.format(
+        n=len(_distinct(clients))))
+    for client in clients:
+        _call(
+            ['build', '-m', args.method, './img', './img/shared'],
+            client.path, env, check=True)
+    stale = make_stale(clients, args.stale, args.method, rng)
+    before = count_conversions(env[cache.CACHE_DIR_ENV], args.method)
+    start = time.time()
+    if args.inkscape == 'fake':
+        env['FAKE_INKSCAPE_SLEEP'] = str(args.fake_delay)
+    results, corrupt = run_clients(
+        clients, args.runs, args.method, env,
+        not args.without_manifest)
+    elapsed = time.time() - start
+    converted = count_conversions(
+        env[cache.CACHE_DIR_ENV], args.method)
+    converted.subtract(before)
+    converted = +converted
+    corrupt.extend(scan(clients, args.method))
+    return report(
+        results, elapsed, converted, stale, corrupt,
+        len(clients) * len(clients[0].figures) * args.runs)
+
+
+def make_corpus(args, root, rng):
+    """Write SVG files of documents, and return `list` of `Client`.
+
+    The figures of each client are keys as passed to `svglatex -i`
+    (for example `./img/shared/fig0`), shuffled.
+    """
+    n_shared = int(round(args.figures * args.shared))
+    shared = os.path.join(root, 'shared')
+    os.mkdir(shared)
+    for i in range(n_shared):
+        write_svg(
+            os.path.join(shared, 'fig{i}.svg'.format(i=i)),
+            args.labels, rng)
+    clients = list()
+    for c in range(args.clients):
+        path = os.path.join(root, 'clients', str(c))
+        img = os.path.join(path, 'img')
+        os.makedirs(img)
+        os.symlink(shared, os.path.join(img, 'shared'))
+        keys = ['./img/shared/fig{i}'.format(i=i) for i in range(n_shared)]
+        for i in range(args.figures - n_shared):
+            write_svg(
+                os.path.join(img, 'fig{i}.svg'.format(i=i)),
+                args.labels, rng)
+            keys.append('./img/fig{i}'.format(i=i))
+        rng.shuffle(keys)
+        clients.append(Client(path, keys))
+    return clients
+
+
+def write_svg(fname, n_labels, rng):
+    """Write SVG file with `n_labels` labels at random positions.
+
+    The file is dated in the past, so that outputs converted
+    in the same second are newer, see `make_stale`.
+    """
+    width, height = 400, 300
+    labels = '\n'.join(
+        LABEL.format(
+            i=i, x=rng.randint(10, width - 60), y=rng.randint(20, height),
+            size=rng.choice((10, 12)),
+            text='$x_{{{i}}}$'.format(i=i))
+        for i in range(n_labels))
+    name = os.path.splitext(os.path.basename(fname))[0]
+    s = SVG.format(
+        width=width, height=height, w=width - 10, h=height - 10,
+        name=name, labels=labels)
+    with open(fname, 'w', encoding='utf-8') as f:
+        f.write(s)
+    past = time.time() - 10
+    os.utime(fname, (past, past))
+
+
+def make_stale(clients, fraction, method, rng):
+    """Edit a `fraction` of the distinct figures, and return them.
+
+    Modification times are compared in whole seconds, so the edits
+    are dated a second earlier (and the outputs before them), lest
+    outputs converted in the same second seem older than the edit.
+
+    @return: real paths of edited SVG files
+    @rtype: `set` of `str`
+    """
+    svgs = sorted(_distinct(clients))
+    stale = rng.sample(svgs, int(round(len(svgs) * fraction)))
+    edited = time.time() - 1
+    for svg in stale:
+        with open(svg, 'a', encoding='utf-8') as f:
+            f.write('<!-- edited -->\n')
+        os.utime(svg, (edited, edited))
+        for out in formats.outputs(svg, method):
+            os.utime(out, (edited - 2, edited - 2))
+    return set(stale)
+
+
+def run_clients(clients, runs, method, env, use_manifest):
+    """Build documents of `clients` concurrently, `runs` times each.
+
+    @return: results of calls of `svglatex`, and problems found
+        in outputs after each call
+    @rtype: `tuple` of `list` of `Result` and `list` of `str`
+    """
+    results = list()
+    corrupt = list()
+    barrier = threading.Barrier(len(clients))
+    lock = threading.Lock()
+
+    def build(client):
+        barrier.wait()
+        for _ in range(runs):
+            for key in client.figures:
+                svg = os.path.join(client.path, key + '.svg')
+                if use_manifest and _manifest_hit(client, key, method):
+                    r = Result(client.path, key, None, None)
+                    problems = list()
+                else:
+                    t = time.monotonic()
+                    code = _call(['-i', key, '-m', method], client.path, env)
+                    r = Result(client.path, key, time.monotonic() - t, code)
+                    problems = check_outputs(svg, method)
+                with lock:
+                    results.append(r)
+                    corrupt.extend(problems)
+
+    threads = [
+        threading.Thread(target=build, args=(client,))
+        for client in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, corrupt
+
+
+def _manifest_hit(client, key, method):
+    """Return `True` if `svglatex.sty` would skip calling `svglatex`."""
+    entries = manifest.load(os.path.join(
+        client.path, manifest.MANIFEST_FILE))
+    entry = entries.get((key, method))
+    if entry is None:
+        return False
+    base, source, md5 = entry
+    svg = os.path.join(client.path, source)
+    outs = formats.outputs(svg, method)
+    return (
+        all(os.path.isfile(out) for out in outs) and
+        manifest.file_md5(svg) == md5)
+
+
+def check_outputs(svg, method):
+    """Return problems of the outputs of `svg`.
+
+    @rtype: `list` of `str`
+    """
+    problems = list()
+    for out in formats.outputs(svg, method):
+        if not os.path.isfile(out):
+            problems.append('missing: "{f}"'.format(f=out))
+        elif out.endswith('.pdf'):
+            try:
+                pdf.page_box(out)
+                pdf.read(out)
+            except Exception as e:
+                problems.append('invalid PDF "{f}": {e}'.format(
+                    f=out, e=e))
+        elif out.endswith('.pdf_tex'):
+            with open(out, 'r', encoding='utf-8') as f:
+                tex = f.read()
+            if not tex.endswith(TEX_END):
+                problems.append('incomplete: "{f}"'.format(f=out))
+    return problems
+
+
+def scan(clients, method):
+    """Return problems found in the files of `clients` at the end.
+
+    @rtype: `list` of `str`
+    """
+    problems = list()
+    for svg in sorted(_distinct(clients)):
+        problems.extend(check_outputs(svg, method))
+        if not interface.is_fresh(svg, method):
+            problems.append('outputs older than "{f}"'.format(f=svg))
+    dirs = {os.path.dirname(svg) for svg in _distinct(clients)}
+    for d in sorted(dirs):
+        for name in sorted(os.listdir(d)):
+            if name.startswith('.'):
+                problems.append('temporary file left: "{f}"'.format(
+                    f=os.path.join(d, name)))
+    for client in clients:
+        fname = os.path.join(client.path, manifest.MANIFEST_FILE)
+        with open(fname, 'r', encoding='utf-8') as f:
+            lines = [
+                line for line in f
+                if line.strip() and not line.startswith('%')]
+        if len(lines) != len(manifest.load(fname)):
+            problems.append('malformed manifest: "{f}"'.format(f=fname))
+    return problems
+
+
+def count_conversions(cache_dir, method):
+    """Return `Counter` of conversions of SVG files, from the history.
+
+    @param cache_dir: cache directory of the `svglatex` processes
+    @return: maps real path of SVG file to number of conversions
+    @rtype: `collections.Counter`
+    """
+    fname = os.path.join(cache_dir, history.HISTORY_FILE)
+    con = sqlite3.connect(fname)
+    try:
+        rows = con.execute(
+            'SELECT path, count FROM counts '
+            'WHERE method = ? AND result = ?',
+            (method, history.CONVERTED)).fetchall()
+    finally:
+        con.close()
+    converted = collections.Counter()
+    for path, count in rows:
+        converted[os.path.realpath(path)] += count
+    return converted
+
+
+def report(results, elapsed, converted, stale, corrupt, requests):
+    """Print results of the load test.
+
+    @return: `True` if the test passed
+    @rtype: `bool`
+    """
+    calls = [r for r in results if r.latency is not None]
+    failed = [r for r in calls if r.returncode != 0]
+    latencies = sorted(r.latency for r in calls)
+    duplicated = sum(
+        n - 1 if svg in stale else n
+        for svg, n in converted.items())
+    missed = sorted(stale.difference(converted))
+    n_converted = sum(converted.values())
+    print('requests: {n} in {t:.2f} s ({r:.1f} per s)'.format(
+        n=requests, t=elapsed, r=requests / elapsed))
+    print('manifest hits: {n}'.format(n=requests - len(calls)))
+    print('calls of svglatex: {n} ({r:.1f} per s), {f} failed'.format(
+        n=len(calls), r=len(calls) / elapsed, f=len(failed)))
+    print('conversions: {n} ({r:.1f} per s), {s} stale figures'.format(
+        n=n_converted, r=n_converted / elapsed, s=len(stale)))
+    if latencies:
+        print('latency of calls: p50 {p50:.3f} s, p99 {p99:.3f} s, '
+              'max {m:.3f} s'.format(
+                  p50=percentile(latencies, 50),
+                  p99=percentile(latencies, 99),
+                  m=latencies[-1]))
+    print('duplicated conversions: {n}'.format(n=duplicated))
+    for svg in missed:
+        corrupt.append('stale figure not converted: "{f}"'.format(f=svg))
+    print('corrupted files: {n}'.format(n=len(corrupt)))
+    for problem in corrupt:
+        print('    ' + problem)
+    for r in failed:
+        print('    failed: "{k}" in "{c}"'.format(k=r.key, c=r.client))
+    return not (failed or duplicated or corrupt)
+
+
+def percentile(values, p):
+    """Return `p`-th percentile of sorted `values`, by nearest rank."""
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def _environment(args, root):
+    """Return environment for `svglatex` processes of the test.
+
+    The test has its own cache directory (and so build history).
+    """
+    env = dict(os.environ)
+    env[cache.CACHE_DIR_ENV] = os.path.join(root, 'cache')
+    package = os.path.dirname(os.path.dirname(interface.__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package] + [p for p in [env.get('PYTHONPATH')] if p])
+    if args.inkscape == 'system':
+        return env
+    bin_dir = os.path.join(root, 'bin')
+    os.mkdir(bin_dir)
+    wrapper = os.path.join(bin_dir, 'inkscape')
+    if args.inkscape == 'fake':
+        with open(wrapper, 'w') as f:
+            f.write(WRAPPER.format(
+                python=sys.executable, script=FAKE_INKSCAPE))
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR)
+        env['FAKE_INKSCAPE_SLEEP'] = '0'
+    else:
+        os.symlink(os.path.abspath(args.inkscape), wrapper)
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    return env
+
+
+def _call(args, cwd, env, check=False):
+    """Run `svglatex` with `args` in directory `cwd`.
+
+    @return: exit status
+    @rtype: `int`
+    """
+    r = subprocess.run(
+        [sys.executable, '-m', 'svglatex.interface'] + args,
+        cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    if check and r.returncode != 0:
+        raise Exception('`svglatex {a}` failed:\n{out}'.format(
+            a=' '.join(args), out=r.stdout))
+    return r.returncode
+
+
+def _distinct(clients):
+    """Return real paths of the SVG files of `clients`.
+
+    @rtype: `set` of `str`
+    """
+    return {
+        os.path.realpath(os.path.join(client.path, key + '.svg'))
+        for client in clients for key in client.figures}
+
+
+if __name__ == '__main__':
+    main()
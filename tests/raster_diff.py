@@ -0,0 +1,181 @@
+"""Compare PDF graphics written by `svglatex` with Inkscape's exports.
+
+For each SVG file given, the graphics (without text) are written to
+PDF both by `svgpdf.export` (as by `--native-pdf`) and by `inkscape`.
+Both PDF files are rasterized with `pdftoppm` (from Poppler), and the
+pages and pixels compared. Files with features that are not supported
+natively are skipped. The exit status is 1 if any figure differs
+by more than the tolerances.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from svglatex import converter
+from svglatex import interface
+from svglatex import pdf
+from svglatex import svgpdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['img'],
+        help='SVG file, or directory of SVG files (default: `img`).')
+    parser.add_argument(
+        '--dpi', type=float, default=150,
+        help='Resolution of rasterization (default: 150).')
+    parser.add_argument(
+        '--threshold', type=int, default=64,
+        help=(
+            'Pixels differ if a channel differs by more '
+            'than this, out of 255 (default: 64).'))
+    parser.add_argument(
+        '--tolerance', type=float, default=0.01,
+        help=(
+            'Largest fraction of pixels that may differ '
+            '(default: 0.01).'))
+    parser.add_argument(
+        '--page-tolerance', type=float, default=1.0,
+        help=(
+            'Largest difference of page width and height, '
+            'in bp (default: 1).'))
+    args = parser.parse_args()
+    if shutil.which('pdftoppm') is None:
+        raise FileNotFoundError('`pdftoppm` not found in `$PATH`')
+    failed = list()
+    compared = 0
+    for svg in interface.collect_svg_files(args.paths):
+        if not svg.endswith('.svg'):
+            continue
+        xml, _, _, _ = converter._split_text_graphics(svg)
+        try:
+            data, _ = svgpdf.export(xml)
+        except svgpdf.Unsupported as e:
+            print('{svg}: skipped ({e})'.format(svg=svg, e=e))
+            continue
+        with tempfile.TemporaryDirectory() as tmpdir:
+            native = os.path.join(tmpdir, 'native.pdf')
+            with open(native, 'wb') as f:
+                f.write(data)
+            exported = os.path.join(tmpdir, 'inkscape.pdf')
+            converter._generate_pdf_from_svg_using_inkscape(xml, exported)
+            ok = compare(native, exported, tmpdir, args)
+        compared += 1
+        if not ok:
+            failed.append(svg)
+        print('{svg}: {r}'.format(svg=svg, r='ok' if ok else 'DIFFERS'))
+    print('{n} figures compared, {k} differ'.format(
+        n=compared, k=len(failed)))
+    if failed:
+        sys.exit(1)
+
+
+def compare(native, exported, dirname, args):
+    """Print differences of PDF files, and return `True` if small.
+
+    @type native, exported: `str`
+    @type dirname: `str`
+    @rtype: `bool`
+    """
+    boxes = [pdf.page_box(path) for path in (native, exported)]
+    sizes = [(x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes]
+    dw = abs(sizes[0][0] - sizes[1][0])
+    dh = abs(sizes[0][1] - sizes[1][1])
+    a = rasterize(native, dirname, args.dpi)
+    b = rasterize(exported, dirname, args.dpi)
+    differing, mean = pixel_difference(a, b, args.threshold)
+    print((
+        '    page: {w:.2f} x {h:.2f} bp (inkscape: {iw:.2f} x {ih:.2f}), '
+        'pixels differing: {p:.3%}, mean difference: {m:.2f}').format(
+            w=sizes[0][0], h=sizes[0][1],
+            iw=sizes[1][0], ih=sizes[1][1],
+            p=differing, m=mean))
+    return (
+        dw <= args.page_tolerance and
+        dh <= args.page_tolerance and
+        differing <= args.tolerance)
+
+
+def rasterize(path, dirname, dpi):
+    """Return image of first page of PDF `path`, using `pdftoppm`.
+
+    @return: `(width, height, pixels)`, where `pixels`
+        are RGB `bytes`, row by row
+    @rtype: `tuple`
+    """
+    prefix = os.path.join(
+        dirname, os.path.splitext(os.path.basename(path))[0])
+    subprocess.run(
+        ['pdftoppm', '-r', str(dpi), '-singlefile', path, prefix],
+        check=True)
+    with open(prefix + '.ppm', 'rb') as f:
+        return read_ppm(f.read())
+
+
+def read_ppm(data):
+    """Return `(width, height, pixels)` from binary PPM `data`."""
+    fields = list()
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos)
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    magic, width, height, maxval = fields
+    assert magic == b'P6' and maxval == b'255', fields
+    width, height = int(width), int(height)
+    pixels = data[pos + 1:pos + 1 + 3 * width * height]
+    return width, height, pixels
+
+
+def pixel_difference(a, b, threshold):
+    """Return fraction of pixels that differ, and mean difference.
+
+    Images are compared over the larger size, with missing
+    pixels white, because page sizes can differ by a pixel.
+
+    @param a, b: as returned by `rasterize`
+    @type threshold: `int`
+    @rtype: `tuple`
+    """
+    width = max(a[0], b[0])
+    height = max(a[1], b[1])
+    differing = 0
+    total = 0
+    for y in range(height):
+        row_a = _row(a, y, width)
+        row_b = _row(b, y, width)
+        for x in range(0, 3 * width, 3):
+            d = max(
+                abs(row_a[x + i] - row_b[x + i]) for i in range(3))
+            total += d
+            if d > threshold:
+                differing += 1
+    n = width * height
+    return differing / n, total / n
+
+
+def _row(image, y, width):
+    """Return row `y` of `image`, padded with white to `width`."""
+    w, h, pixels = image
+    if y >= h:
+        return b'\xff' * (3 * width)
+    row = pixels[3 * w * y:3 * w * (y + 1)]
+    return row + b'\xff' * (3 * (width - w))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compare extents of text estimated from fonts with Inkscape's.
+
+For each `text` element (with an `id`) of the SVG files given, the
+bounding box estimated from font metrics (as by `--estimate-text`)
+is compared with the bounding box that `inkscape` returns. For each
+side, the margin by which the estimate contains Inkscape's bounding
+box is printed (in px). Negative margins mean that the estimate is
+not conservative on that side.
+"""
+# Copyright 2020 by Ioannis Filippidis
+# All rights reserved. Licensed under BSD-2.
+#
+import argparse
+
+import lxml.etree as etree
+
+from svglatex import converter
+from svglatex import interface
+
+
+SIDES = ('left', 'top', 'right', 'bottom')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'paths', metavar='PATH', nargs='*', default=['img'],
+        help='SVG file, or directory of SVG files (default: `img`).')
+    args = parser.parse_args()
+    margins = list()
+    skipped = 0
+    for svg in interface.collect_svg_files(args.paths):
+        if not svg.endswith('.svg'):
+            continue
+        doc = etree.parse(svg)
+        scaling = converter._scaling_assumed(doc)
+        texts = [
+            el for el in doc.iter(converter._svg_tag('text'))
+            if 'id' in el.attrib]
+        queried = converter._svg_bounding_boxes(
+            svg, {el.attrib['id'] for el in texts})
+        for el in texts:
+            name = el.attrib['id']
+            estimated = converter._estimate_text_bboxes(doc, {name})
+            if estimated is None or name not in queried:
+                skipped += 1
+                continue
+            m = side_margins(estimated[name], queried[name])
+            margins.append(m)
+            print('{svg}#{name}: {m}'.format(
+                svg=svg, name=name,
+                m=', '.join(
+                    '{s} {v:+.2f}'.format(s=s, v=v)
+                    for s, v in zip(SIDES, m))))
+    print('{n} texts compared, {k} not estimated'.format(
+        n=len(margins), k=skipped))
+    if not margins:
+        return
+    for i, side in enumerate(SIDES):
+        values = [m[i] for m in margins]
+        print((
+            '{side:>7}: min {min:+.2f} px, mean {mean:+.2f} px, '
+            'max {max:+.2f} px, {neg} not conservative').format(
+                side=side, min=min(values),
+                mean=sum(values) / len(values), max=max(values),
+                neg=sum(1 for v in values if v < 0)))
+
+
+def side_margins(estimated, queried):
+    """Return margins by which `estimated` contains `queried`.
+
+    @type estimated, queried: `converter._BBox`
+    @return: margins of left, top, right, bottom sides
+    @rtype: `tuple` of `float`
+    """
+    ex0, ex1, ey0, ey1 = converter._corners(estimated)
+    qx0, qx1, qy0, qy1 = converter._corners(queried)
+    return (qx0 - ex0, qy0 - ey0, ex1 - qx1, ey1 - qy1)
+
+
+if __name__ == '__main__':
+    main()